@@ -1,16 +1,30 @@
 import os
 import logging
-from waitress import serve
-from app import app  # Importa o seu aplicativo Flask do arquivo app.py
 
-# Configura logs simples para o console (apenas para ver que está rodando)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%H:%M:%S')
+# Nada do app é importado fora do bloco abaixo: no Windows os processos do OCR (ocr_worker.py)
+# são iniciados com "spawn" e reimportam este arquivo; assim eles não carregam o Flask, o pool
+# de conexões nem as filas.
 
 if __name__ == "__main__":
+    app = None
     try:
+        from waitress import serve
+        from app import app  # Importa o seu aplicativo Flask do arquivo app.py
+        from banco_dados import configurar_pool
+        from relatorios_pdf import RELATORIOS_WORKERS
+        from importador_planilhas import PLANILHAS_WORKERS
+
+        # Configura logs simples para o console (apenas para ver que está rodando)
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%H:%M:%S')
+
         PORTA = 8080
         THREADS = 6  # Número de tarefas simultâneas (ideal para escritórios pequenos/médios)
         
+        # Uma conexão de banco por thread, mais uma por worker das filas (relatórios PDF e
+        # planilhas): nenhuma requisição espera por conexão livre
+        CONEXOES = THREADS + RELATORIOS_WORKERS + PLANILHAS_WORKERS
+        configurar_pool(tamanho=CONEXOES)
+        
         print("\n" + "="*60)
         print(f"🚀 INICIANDO SERVIDOR DE PRODUÇÃO - NUTRANE COMPRAS")
         print("="*60)
@@ -18,6 +32,7 @@ if __name__ == "__main__":
         print(f"🏠 Local:  http://localhost:{PORTA}")
         print(f"📡 Rede:   http://0.0.0.0:{PORTA} (Acesse pelo IP deste PC)")
         print(f"⚙️  Modo:   Produção (Waitress) com {THREADS} threads")
+        print(f"🗄️  Banco:  Pool com {CONEXOES} conexões reutilizáveis")
         print("-" * 60)
         print("Logs de erro serão salvos automaticamente na pasta 'logs/'.")
         print("Pressione Ctrl+C para encerrar o servidor.")
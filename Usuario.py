@@ -1,27 +1,10 @@
-import os
-import pymysql
-import pymysql.cursors
 from werkzeug.security import generate_password_hash
-from dotenv import load_dotenv
-
-# 1. Carrega as configurações do banco igual ao app.py
-load_dotenv()
-
-DB_HOST = os.getenv('DB_HOST')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_NAME = os.getenv('DB_NAME')
-DB_PORT = int(os.getenv('DB_PORT', 3306))
+import banco_dados
 
+# 1. Usa o mesmo pool de conexões do app.py (configurações vêm do .env)
 def get_db_connection():
     try:
-        conn = pymysql.connect(
-            host=DB_HOST, user=DB_USER, password=DB_PASSWORD,
-            database=DB_NAME, port=DB_PORT,
-            charset='utf8mb4', cursorclass=pymysql.cursors.DictCursor,
-            autocommit=True
-        )
-        return conn
+        return banco_dados.obter_conexao()
     except Exception as e:
         print(f"❌ Erro ao conectar no banco: {e}")
         return None
@@ -1,47 +1,40 @@
 import os
+import hmac
 import math
+import mimetypes
 import json
+import uuid
+import shutil
+import hashlib
+import zipfile
 import logging
 from logging.handlers import RotatingFileHandler
 from io import BytesIO
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
-import pymysql
-import pymysql.cursors
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify, Response, abort, g
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from datetime import datetime, date, timedelta
-from collections import defaultdict
-import pdfplumber
+from datetime import datetime, date
 import re
 from dotenv import load_dotenv
 from xhtml2pdf import pisa 
 from werkzeug.exceptions import HTTPException
-
-# --- NOVAS IMPORTAÇÕES PARA PDF e IMAGEM ---
-from pypdf import PdfReader
-from PIL import Image
-
-# --- CONFIGURAÇÃO DO OCR (TESSERACT PORTÁTIL) ---
-HAS_OCR = False
-try:
-    import pytesseract
-    
-    # Define o caminho RELATIVO para a pasta que você já colocou no servidor
-    caminho_base = os.getcwd()
-    caminho_tesseract = os.path.join(caminho_base, 'Tesseract-OCR', 'tesseract.exe')
-    
-    # Verifica se o arquivo existe
-    if os.path.exists(caminho_tesseract):
-        pytesseract.pytesseract.tesseract_cmd = caminho_tesseract
-        HAS_OCR = True
-        print(f"✅ Tesseract Portátil encontrado em: {caminho_tesseract}")
-    else:
-        print(f"⚠️ AVISO: Tesseract não encontrado em: {caminho_tesseract}")
-        
-except ImportError:
-    print("⚠️ Biblioteca 'pytesseract' não encontrada.")
-except Exception as e:
-    print(f"⚠️ Erro ao configurar Tesseract: {e}")
+import banco_dados
+from cache_memoria import CacheTTL
+import contadores
+import fatos_performance
+import totais_pedido
+import situacao
+import metricas
+import exportacao
+import armazem_anexos
+from miniaturas import CacheMiniaturas
+import parser_solicitacao
+from importador_planilhas import FilaPlanilhas, PASTA_PLANILHAS
+from cache_importacao import CacheImportacao, hash_arquivo, VERSAO_EXTRACAO
+from relatorios_pdf import FilaRelatorios, STATUS_PRONTO, STATUS_ERRO
+
+# --- OCR (TESSERACT PORTÁTIL) EM PROCESSOS SEPARADOS ---
+from ocr_worker import HAS_OCR, FilaOCR, assinatura_preprocessamento, ORIGEM_TEXTO_DIGITAL, ORIGEM_OCR, OCR_MAX_PAGINAS
 
 # 1. CARREGA AS VARIÁVEIS DE AMBIENTE
 load_dotenv()
@@ -60,17 +53,35 @@ file_handler.setFormatter(logging.Formatter(
 file_handler.setLevel(logging.ERROR)
 app.logger.addHandler(file_handler)
 
-UPLOAD_FOLDER = 'static/uploads'
+# --- MÉTRICAS DE DESEMPENHO (tempo por rota, SQL, templates, PDF/OCR) ---
+metricas.instrumentar(app)
+# Para o Prometheus coletar sem sessão: Authorization: Bearer <METRICAS_TOKEN>
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN', '')
+
+UPLOAD_FOLDER = armazem_anexos.PASTA_ANEXOS
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+if armazem_anexos.mover_pasta_antiga(UPLOAD_FOLDER):
+    print(f"📁 Anexos movidos de static/uploads para {UPLOAD_FOLDER} (agora só são baixados com login).")
+elif os.path.isdir(armazem_anexos.PASTA_ANEXOS_ANTIGA):
+    print(f"⚠️ AVISO: static/uploads ainda existe e continua público; mova o conteúdo para {UPLOAD_FOLDER}.")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# 2. CONFIGURAÇÕES DA BASE DE DADOS
-DB_HOST = os.getenv('DB_HOST')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_NAME = os.getenv('DB_NAME')
-DB_PORT = int(os.getenv('DB_PORT', 3306))
+# Miniaturas dos anexos (imagens e 1ª página de PDFs) exibidas em ver_pedido/editar_pedido
+miniaturas_anexos = CacheMiniaturas(logger=app.logger)
+# O conteúdo de um anexo nunca muda (arquivo por hash): o navegador pode guardar o arquivo e a miniatura por 1 ano
+ANEXO_MAX_AGE = 365 * 24 * 3600
+
+# 2. CONFIGURAÇÕES DA BASE DE DADOS (pool compartilhado em banco_dados.py)
+DB_HOST = banco_dados.DB_HOST
+DB_USER = banco_dados.DB_USER
+
+# KPIs/gráficos do dashboard por combinação de filtros: paginar não recalcula o total
+cache_agregados = CacheTTL(ttl=60)
+
+# Listas dos combos (unidades, compradores, usuários): mudam raramente.
+# Invalidadas nas ações de admin_usuarios; o TTL cobre alterações feitas direto no banco.
+cache_referencias = CacheTTL(ttl=int(os.getenv('CACHE_REFERENCIAS_TTL', 600)))
 
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -86,41 +97,126 @@ def allowed_file(filename):
 
 def get_db_connection():
     try:
-        if not DB_HOST or not DB_USER:
+        if banco_dados.DB_BACKEND == 'mysql' and (not DB_HOST or not DB_USER):
             print("❌ ERRO CRÍTICO: Variáveis do .env não encontradas!")
             return None
 
-        conn = pymysql.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            port=DB_PORT,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor,
-            autocommit=True
-        )
-        return conn
+        # Empresta uma conexão do pool; conn.close() devolve ao pool
+        conn = banco_dados.obter_conexao()
     except Exception as e:
         app.logger.error(f"Falha ao conectar na Base de Dados: {e}")
         print(f"❌ Erro ao conectar na Base de Dados: {e}")
         return None
+    # Se a rota quebrar antes do conn.close(), o teardown devolve a conexão (com rollback)
+    g.setdefault('conexoes_db', []).append(conn)
+    return conn
+
+@app.teardown_appcontext
+def devolver_conexoes(exc):
+    for conn in g.pop('conexoes_db', []):
+        conn.close()
+    # Arquivos postos no disco por uma transação que não chegou ao commit (o close acima já desfez)
+    pendentes = g.pop('anexos_novos', None)
+    if pendentes:
+        try:
+            conn = banco_dados.obter_conexao()
+            try:
+                armazem_anexos.remover_orfaos(conn, [(a['nome_arquivo'], a['hash_conteudo']) for a in pendentes],
+                                              app.config['UPLOAD_FOLDER'])
+            finally:
+                conn.close()
+        except Exception as e:
+            app.logger.error(f"Falha ao limpar anexos de transação desfeita: {e}")
 
 def salvar_anexos_multiplos(conn, pedido_id, files):
+    """Grava os uploads na transação do pedido. Depois do commit, chame confirmar_anexos_novos()."""
     cursor = conn.cursor()
+    novos = g.setdefault('anexos_novos', [])
     for arq in files:
         if arq and allowed_file(arq.filename) and arq.filename != '':
-            nome_original = arq.filename
-            nome_seguro = secure_filename(f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{nome_original}")
-            caminho_completo = os.path.join(app.config['UPLOAD_FOLDER'], nome_seguro)
-            arq.save(caminho_completo)
-            
-            cursor.execute('''
-                INSERT INTO pedidos_anexos (pedido_id, nome_arquivo, nome_original) 
-                VALUES (%s, %s, %s)
-            ''', (pedido_id, nome_seguro, nome_original))
+            # Conteúdo repetido (mesma NF em vários pedidos) reaproveita o arquivo já guardado
+            gravado = armazem_anexos.salvar(cursor, pedido_id, arq, app.config['UPLOAD_FOLDER'])
+            if gravado['novo']:
+                novos.append(gravado)
     cursor.close()
 
+def confirmar_anexos_novos():
+    """Commit feito: os arquivos novos ficam (o teardown não os apaga) e ganham miniatura."""
+    for gravado in g.pop('anexos_novos', []):
+        miniaturas_anexos.agendar(armazem_anexos.caminho_absoluto(gravado['nome_arquivo'], app.config['UPLOAD_FOLDER']),
+                                  gravado['hash_conteudo'])
+
+def ler_pedido(cursor, pedido_id, bloquear=False):
+    cursor.execute('SELECT * FROM acompanhamento_compras WHERE id = %s' + (' FOR UPDATE' if bloquear else ''), (pedido_id,))
+    return cursor.fetchone()
+
+def registrar_alteracao_pedido(cursor, antes, depois):
+    """
+    Atualiza as estruturas derivadas de um pedido (contadores do dashboard e fatos diários
+    da performance) na mesma transação da escrita. `antes`/`depois` são as linhas
+    completas (None em criação/exclusão).
+    """
+    contadores.registrar(cursor, antes, depois)
+    fatos_performance.atualizar_dias(cursor, fatos_performance.dias_do_pedido(antes, depois))
+
+def _como_quantidade(valor):
+    try:
+        return int(float(valor))
+    except (TypeError, ValueError):
+        return valor
+
+def gravar_itens_pedido(cursor, pedido_id, form, novo=False):
+    """
+    Grava os itens do formulário comparando com o que já está no banco: só linhas novas,
+    alteradas ou removidas geram escrita, em lote (executemany / DELETE ... IN). Deve rodar
+    na mesma transação do cabeçalho. Devolve True se algum item mudou.
+    """
+    ids = form.getlist('item_id[]')
+    nomes = form.getlist('nome_item[]')
+    qtds = form.getlist('qtd[]')
+    unids = form.getlist('unidade[]')
+    vals = form.getlist('valor[]')
+
+    atuais = {}
+    if not novo:
+        cursor.execute('SELECT id, nome_item, quantidade, unidade_medida, valor_unitario FROM pedidos_itens WHERE pedido_id = %s',
+                       (pedido_id,))
+        atuais = {str(r['id']): r for r in cursor.fetchall()}
+
+    # Só ids deste pedido: o formulário não pode apagar nem alterar item de outro pedido
+    remover = [i for i in (form.get('itens_para_remover') or '').split(',') if i in atuais]
+
+    inserir = []
+    alterar = []
+    for i in range(len(nomes)):
+        if not nomes[i].strip():
+            continue
+        val = safe_float(vals[i]) if i < len(vals) else 0.0
+        item_id = ids[i] if i < len(ids) else ''
+        if item_id in atuais:
+            if item_id in remover:
+                continue
+            atual = atuais[item_id]
+            if (atual['nome_item'], _como_quantidade(atual['quantidade']), atual['unidade_medida'],
+                    round(float(atual['valor_unitario'] or 0), 2)) != (nomes[i], _como_quantidade(qtds[i]), unids[i], round(val, 2)):
+                alterar.append((nomes[i], qtds[i], unids[i], val, item_id, pedido_id))
+        elif not item_id:
+            inserir.append((pedido_id, nomes[i], qtds[i], unids[i], val))
+
+    if remover:
+        cursor.execute(f"DELETE FROM pedidos_itens WHERE pedido_id = %s AND id IN ({', '.join(['%s'] * len(remover))})",
+                       [pedido_id] + remover)
+    if alterar:
+        cursor.executemany('''UPDATE pedidos_itens
+            SET nome_item=%s, quantidade=%s, unidade_medida=%s, valor_unitario=%s
+            WHERE id=%s AND pedido_id=%s''', alterar)
+    if inserir:
+        # O PyMySQL junta este executemany em um único INSERT de várias linhas
+        cursor.executemany('''INSERT INTO pedidos_itens
+            (pedido_id, nome_item, quantidade, unidade_medida, valor_unitario)
+            VALUES (%s, %s, %s, %s, %s)''', inserir)
+    return bool(remover or alterar or inserir)
+
 def safe_float(valor_str):
     if not valor_str: 
         return 0.0
@@ -130,6 +226,268 @@ def safe_float(valor_str):
     except:
         return 0.0
 
+# Tamanho mínimo de palavra indexada pelo FULLTEXT do InnoDB (innodb_ft_min_token_size)
+FT_TAMANHO_MINIMO = int(os.getenv('FT_TAMANHO_MINIMO', 3))
+
+def montar_busca_fulltext(busca):
+    """
+    Converte o texto digitado em uma consulta FULLTEXT em modo booleano:
+    cada palavra vira obrigatória e com prefixo ("+1234*"), o que cobre busca por
+    início de número e de nome sem varrer a tabela. Devolve None se nenhuma palavra
+    tiver o tamanho mínimo indexado.
+    """
+    palavras = [p for p in re.findall(r'\w+', busca) if len(p) >= FT_TAMANHO_MINIMO]
+    if not palavras:
+        return None
+    return ' '.join(f'+{p}*' for p in palavras)
+
+def montar_filtros_dashboard(args):
+    """
+    Monta JOINs, condições e parâmetros dos filtros do dashboard a partir da query string.
+    Os parâmetros de JOIN (busca) vêm antes dos do WHERE, na mesma ordem do SQL.
+    """
+    busca = args.get('busca', '').strip()
+    f_solicitacao = args.get('f_solicitacao', '')
+    f_empresa = args.get('f_empresa', '')
+    f_comprador = args.get('f_comprador', '')
+    f_status = args.get('f_status', '')
+    f_data_inicio = args.get('f_data_inicio', '')
+    f_data_fim = args.get('f_data_fim', '')
+
+    join_busca = ""
+    conditions = []
+    params = []
+
+    if busca and banco_dados.DB_BACKEND == 'sqlite':
+        # SQLite (unidades pequenas): sem FULLTEXT, a busca é por trecho nos mesmos campos
+        join_busca = """
+            JOIN (
+                SELECT id AS pedido_id, 1 AS relevancia FROM acompanhamento_compras
+                WHERE numero_solicitacao LIKE %s OR numero_pedido LIKE %s OR fornecedor LIKE %s OR item_comprado LIKE %s
+                UNION
+                SELECT pedido_id, 1 FROM pedidos_itens WHERE nome_item LIKE %s
+            ) busca ON busca.pedido_id = c.id
+        """
+        t = '%' + busca.replace('%', '').replace('_', '') + '%'
+        params.extend([t] * 5)
+    elif busca:
+        termos = montar_busca_fulltext(busca)
+        if termos:
+            # Índices FULLTEXT em acompanhamento_compras e pedidos_itens (migracoes/0001_busca_fulltext.sql)
+            join_busca = """
+                JOIN (
+                    SELECT pedido_id, MAX(relevancia) AS relevancia FROM (
+                        SELECT id AS pedido_id,
+                               MATCH(numero_solicitacao, numero_pedido, fornecedor, item_comprado) AGAINST (%s IN BOOLEAN MODE) AS relevancia
+                        FROM acompanhamento_compras
+                        WHERE MATCH(numero_solicitacao, numero_pedido, fornecedor, item_comprado) AGAINST (%s IN BOOLEAN MODE)
+                        UNION ALL
+                        SELECT pedido_id, MATCH(nome_item) AGAINST (%s IN BOOLEAN MODE)
+                        FROM pedidos_itens
+                        WHERE MATCH(nome_item) AGAINST (%s IN BOOLEAN MODE)
+                    ) achados
+                    GROUP BY pedido_id
+                ) busca ON busca.pedido_id = c.id
+            """
+            params.extend([termos] * 4)
+        else:
+            # Termo curto demais para o FULLTEXT (ex: "12"): prefixo nos números, que usa índice B-tree
+            join_busca = """
+                JOIN (
+                    SELECT id AS pedido_id, 1 AS relevancia FROM acompanhamento_compras WHERE numero_solicitacao LIKE %s
+                    UNION
+                    SELECT id, 1 FROM acompanhamento_compras WHERE numero_pedido LIKE %s
+                ) busca ON busca.pedido_id = c.id
+            """
+            t = busca.replace('%', '').replace('_', '') + '%'
+            params.extend([t, t])
+    
+    if f_solicitacao:
+        conditions.append("c.numero_solicitacao LIKE %s")
+        params.append(f'%{f_solicitacao}%')
+
+    if f_empresa:
+        conditions.append("c.codi_empresa = %s")
+        params.append(f_empresa)
+    
+    if f_comprador:
+        conditions.append("c.id_comprador_responsavel = %s")
+        params.append(f_comprador)
+        
+    if f_status:
+        conditions.append("c.status_compra = %s")
+        params.append(f_status)
+    
+    if f_data_inicio:
+        conditions.append("c.data_registro >= %s")
+        params.append(f_data_inicio + ' 00:00:00')
+    
+    if f_data_fim:
+        conditions.append("c.data_registro <= %s")
+        params.append(f_data_fim + ' 23:59:59')
+
+    sql_joins = f"""
+        FROM acompanhamento_compras c 
+        {join_busca}
+        JOIN empresas_compras e ON c.codi_empresa = e.codi_empresa 
+        LEFT JOIN usuarios u2 ON c.id_comprador_responsavel = u2.id
+    """
+
+    return {
+        'sql_joins': sql_joins,
+        'conditions': conditions,
+        'params': params,
+        'where_clause': "WHERE " + " AND ".join(conditions) if conditions else "",
+        'relevancia': bool(join_busca),
+    }
+
+PARTES_DASHBOARD = ('kpi', 'status', 'fornecedor', 'comprador', 'semana')
+
+def agregar_dashboard(cursor, sql_joins, where_clause, params, partes=PARTES_DASHBOARD):
+    """
+    Calcula KPIs, distribuição por status, top 5 fornecedores, volume por comprador
+    e a linha do tempo semanal em UMA consulta (UNION ALL), sem trazer os pedidos
+    para o Python. Cada bloco devolve linhas no formato (tipo, chave, qtd, abertos, atrasados).
+    `partes` permite pedir só alguns blocos (ex: quando os contadores já cobrem o resto).
+    """
+    hoje = date.today().isoformat()
+    where_aberto = (where_clause + " AND " if where_clause else "WHERE ") + "c.em_aberto = 1"
+    data_prevista = "COALESCE(c.data_entrega_reprogramada, c.prazo_entrega)"
+
+    blocos = {
+        'kpi': (f"""
+            SELECT 'kpi' AS tipo, '' AS chave, COUNT(*) AS qtd,
+                   COALESCE(SUM(c.em_aberto), 0) AS abertos,
+                   COALESCE(SUM(CASE WHEN c.em_aberto = 1 AND {data_prevista} <= %s THEN 1 ELSE 0 END), 0) AS atrasados
+            {sql_joins} {where_clause}
+        """, [hoje] + params),
+        'status': (f"SELECT 'status' AS tipo, c.status_compra AS chave, COUNT(*) AS qtd, 0 AS abertos, 0 AS atrasados {sql_joins} {where_clause} GROUP BY c.status_compra", params),
+        # Em tabela derivada: o SQLite não aceita ORDER BY/LIMIT num SELECT entre parênteses do UNION
+        'fornecedor': (f"SELECT * FROM (SELECT 'fornecedor' AS tipo, c.fornecedor AS chave, COUNT(*) AS qtd, 0 AS abertos, 0 AS atrasados {sql_joins} {where_aberto} GROUP BY c.fornecedor ORDER BY qtd DESC LIMIT 5) top_fornecedores", params),
+        'comprador': (f"SELECT 'comprador' AS tipo, u2.nome_completo AS chave, COUNT(*) AS qtd, 0 AS abertos, 0 AS atrasados {sql_joins} {where_aberto} GROUP BY u2.nome_completo", params),
+        'semana': (f"""
+            SELECT 'semana' AS tipo, YEARWEEK({data_prevista}, 3) AS chave, COUNT(*) AS qtd, 0 AS abertos, 0 AS atrasados
+            {sql_joins} {where_aberto} AND {data_prevista} IS NOT NULL
+            GROUP BY YEARWEEK({data_prevista}, 3)
+        """, params),
+    }
+    selecionados = [blocos[p] for p in PARTES_DASHBOARD if p in partes]
+    sql = "\nUNION ALL\n".join(b[0] for b in selecionados)
+    cursor.execute(sql, [v for b in selecionados for v in b[1]])
+
+    resultado = {'kpis': {'total': 0, 'abertos': 0, 'atrasados': 0},
+                 'status': [], 'fornecedores': [], 'compradores': [], 'timeline': []}
+    for r in cursor.fetchall():
+        tipo = r['tipo']
+        if tipo == 'kpi':
+            resultado['kpis'] = {'total': int(r['qtd']), 'abertos': int(r['abertos']), 'atrasados': int(r['atrasados'])}
+        elif tipo == 'status':
+            resultado['status'].append(r)
+        elif tipo == 'fornecedor':
+            resultado['fornecedores'].append(r)
+        elif tipo == 'comprador':
+            resultado['compradores'].append(r)
+        elif tipo == 'semana' and r['chave']:
+            # YEARWEEK modo 3 = semana ISO (segunda-feira), igual ao agrupamento antigo feito em Python
+            ano_semana = int(r['chave'])
+            inicio_semana = date.fromisocalendar(ano_semana // 100, ano_semana % 100, 1)
+            resultado['timeline'].append((inicio_semana, int(r['qtd'])))
+
+    resultado['fornecedores'].sort(key=lambda r: r['qtd'], reverse=True)
+    resultado['timeline'].sort()
+    return resultado
+
+def calcular_agregados_dashboard(cursor, filtros, args):
+    """
+    Sem busca textual nem filtro de datas, KPIs, status e compradores vêm dos contadores
+    (leitura O(1)); só fornecedores e a linha do tempo, restritos aos pedidos em aberto,
+    são agregados na tabela principal. Nos demais filtros, tudo vem de agregar_dashboard.
+    """
+    filtros_simples = not any(args.get(k) for k in ('busca', 'f_solicitacao', 'f_data_inicio', 'f_data_fim'))
+    if not filtros_simples:
+        return agregar_dashboard(cursor, filtros['sql_joins'], filtros['where_clause'], filtros['params'])
+
+    resultado = agregar_dashboard(cursor, filtros['sql_joins'], filtros['where_clause'], filtros['params'],
+                                  partes=('fornecedor', 'semana'))
+    resultado.update(contadores.ler_resumo(cursor, args.get('f_empresa'), args.get('f_comprador'), args.get('f_status')))
+    return resultado
+
+def buscar_pagina_pedidos(cursor, sql_joins, conditions, params, itens_por_pagina, apos_id=None, antes_id=None, pagina=1,
+                          ordem_relevancia=False):
+    """
+    Busca uma página de pedidos ordenada por c.id DESC usando keyset (seek):
+    o custo é o mesmo na página 1 ou na 500, pois o índice da PK pula direto para o cursor.
+    Lê um registro a mais para saber se existe próxima/anterior sem precisar de count(*).
+    """
+    if ordem_relevancia:
+        # Resultado da busca textual: ordenado pela relevância do índice FULLTEXT.
+        # O conjunto já vem filtrado pelo índice, então a paginação por OFFSET é barata aqui.
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        offset = (pagina - 1) * itens_por_pagina
+        cursor.execute(f'''SELECT c.*, e.nome_empresa, u2.nome_completo as nome_comprador {sql_joins} {where}
+                           ORDER BY busca.relevancia DESC, c.id DESC LIMIT %s OFFSET %s''',
+                       list(params) + [itens_por_pagina + 1, offset])
+        pedidos = list(cursor.fetchall())
+        return pedidos[:itens_por_pagina], pagina > 1, len(pedidos) > itens_por_pagina
+
+    conds = list(conditions)
+    valores = list(params)
+    ordem = "DESC"
+
+    if apos_id:
+        conds.append("c.id < %s")
+        valores.append(apos_id)
+    elif antes_id:
+        conds.append("c.id > %s")
+        valores.append(antes_id)
+        ordem = "ASC"
+
+    where = "WHERE " + " AND ".join(conds) if conds else ""
+    sql = f'SELECT c.*, e.nome_empresa, u2.nome_completo as nome_comprador {sql_joins} {where} ORDER BY c.id {ordem} LIMIT %s'
+
+    if apos_id or antes_id or pagina <= 1:
+        cursor.execute(sql, valores + [itens_por_pagina + 1])
+        offset = 0
+    else:
+        # Links antigos com ?page=N (sem cursor) continuam funcionando via OFFSET
+        offset = (pagina - 1) * itens_por_pagina
+        cursor.execute(sql + ' OFFSET %s', valores + [itens_por_pagina + 1, offset])
+    pedidos = list(cursor.fetchall())
+
+    sobrou = len(pedidos) > itens_por_pagina
+    pedidos = pedidos[:itens_por_pagina]
+
+    if antes_id:
+        pedidos.reverse()
+        return pedidos, sobrou, True
+    return pedidos, bool(apos_id) or offset > 0, sobrou
+
+
+# --- DADOS DE REFERÊNCIA (EM CACHE) ---
+# O cursor só é usado quando o cache está vazio ou expirado.
+
+def listar_empresas(cursor):
+    def consultar():
+        cursor.execute("SELECT * FROM empresas_compras ORDER BY nome_empresa")
+        return cursor.fetchall()
+    return cache_referencias.obter('empresas', consultar)
+
+def listar_compradores(cursor):
+    def consultar():
+        cursor.execute("SELECT id, nome_completo, email, nivel_acesso, aprovado FROM usuarios WHERE nivel_acesso IN ('comprador', 'admin') ORDER BY nome_completo")
+        return cursor.fetchall()
+    return cache_referencias.obter('compradores', consultar)
+
+def listar_usuarios_aprovados(cursor):
+    def consultar():
+        cursor.execute("SELECT id, nome_completo, email, nivel_acesso, aprovado FROM usuarios WHERE aprovado = 1 ORDER BY nome_completo")
+        return cursor.fetchall()
+    return cache_referencias.obter('usuarios_aprovados', consultar)
+
+def invalidar_referencias():
+    """Chamar sempre que usuários ou unidades (empresas_compras) forem alterados."""
+    cache_referencias.invalidar()
+
 # --- ROTAS DE AUTENTICAÇÃO ---
 
 @app.route('/', methods=['GET', 'POST'])
@@ -173,6 +531,7 @@ def registro():
                             (nome, email, generate_password_hash(senha)))
                 cursor.close()
                 conn.close()
+                invalidar_referencias()
                 flash('Aguarde aprovação.')
                 return redirect(url_for('login'))
         except Exception as e:
@@ -213,112 +572,47 @@ def dashboard():
     f_data_inicio = request.args.get('f_data_inicio', '')
     f_data_fim = request.args.get('f_data_fim', '')
     
-    pagina = request.args.get('page', 1, type=int)
+    # Paginação por cursor (keyset): 'apos' = último id visto (próxima), 'antes' = primeiro id visto (anterior).
+    # 'page' só serve para exibir o número da página; sem cursor, cai no modo antigo por OFFSET.
+    pagina = max(request.args.get('page', 1, type=int), 1)
+    apos_id = request.args.get('apos', type=int)
+    antes_id = request.args.get('antes', type=int)
     itens_por_pagina = 10
-    offset = (pagina - 1) * itens_por_pagina
 
-    conditions = []
-    params = []
-
-    if busca:
-        conditions.append("(c.numero_solicitacao LIKE %s OR c.numero_pedido LIKE %s OR c.fornecedor LIKE %s OR c.item_comprado LIKE %s)")
-        t = f'%{busca}%'
-        params.extend([t, t, t, t])
-    
-    if f_solicitacao:
-        conditions.append("c.numero_solicitacao LIKE %s")
-        params.append(f'%{f_solicitacao}%')
-
-    if f_empresa:
-        conditions.append("c.codi_empresa = %s")
-        params.append(f_empresa)
-    
-    if f_comprador:
-        conditions.append("c.id_comprador_responsavel = %s")
-        params.append(f_comprador)
-        
-    if f_status:
-        conditions.append("c.status_compra = %s")
-        params.append(f_status)
-    
-    if f_data_inicio:
-        conditions.append("c.data_registro >= %s")
-        params.append(f_data_inicio + ' 00:00:00')
-    
-    if f_data_fim:
-        conditions.append("c.data_registro <= %s")
-        params.append(f_data_fim + ' 23:59:59')
-
-    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
-    
-    sql_joins = """
-        FROM acompanhamento_compras c 
-        JOIN empresas_compras e ON c.codi_empresa = e.codi_empresa 
-        LEFT JOIN usuarios u1 ON c.id_responsavel_chamado = u1.id 
-        LEFT JOIN usuarios u2 ON c.id_comprador_responsavel = u2.id
-    """
+    filtros = montar_filtros_dashboard(request.args)
+    sql_joins = filtros['sql_joins']
+    conditions = filtros['conditions']
+    params = filtros['params']
+    where_clause = filtros['where_clause']
 
     cursor = conn.cursor()
 
-    cursor.execute(f'SELECT count(*) as total {sql_joins} {where_clause}', params)
-    total_registros = cursor.fetchone()['total']
-    total_paginas = math.ceil(total_registros / itens_por_pagina)
+    # KPIs e gráficos calculados no banco, em uma única ida e volta (em cache por filtro)
+    chave_cache = (where_clause, tuple(params), date.today())
+    agregados = cache_agregados.obter(chave_cache, lambda: calcular_agregados_dashboard(cursor, filtros, request.args))
+    kpis = agregados['kpis']
+    total_paginas = max(math.ceil(kpis['total'] / itens_por_pagina), 1)
     
-    cursor.execute(f'SELECT c.*, e.nome_empresa, u2.nome_completo as nome_comprador {sql_joins} {where_clause} ORDER BY c.id DESC LIMIT %s OFFSET %s', params + [itens_por_pagina, offset])
-    pedidos = cursor.fetchall()
+    pedidos, tem_anterior, tem_proxima = buscar_pagina_pedidos(cursor, sql_joins, conditions, params, itens_por_pagina,
+                                                               apos_id=apos_id, antes_id=antes_id, pagina=pagina,
+                                                               ordem_relevancia=filtros['relevancia'])
 
-    cursor.execute(f"SELECT c.status_compra, COUNT(*) as qtd {sql_joins} {where_clause} GROUP BY c.status_compra", params)
-    dados_status = cursor.fetchall()
-    
-    where_forn = where_clause + " AND " if where_clause else "WHERE "
-    cursor.execute(f"SELECT c.fornecedor, COUNT(*) as qtd {sql_joins} {where_forn} c.status_compra NOT LIKE '%%Entregue%%' GROUP BY c.fornecedor ORDER BY qtd DESC LIMIT 5", params)
-    dados_forn = cursor.fetchall()
-    
-    cursor.execute(f"SELECT u2.nome_completo, COUNT(*) as qtd {sql_joins} {where_forn} c.status_compra NOT LIKE '%%Entregue%%' GROUP BY u2.nome_completo", params)
-    dados_comp = cursor.fetchall()
-
-    cursor.execute(f"SELECT c.status_compra, c.prazo_entrega, c.data_entrega_reprogramada {sql_joins} {where_clause}", params)
-    all_orders = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM empresas_compras ORDER BY nome_empresa")
-    lista_empresas = cursor.fetchall()
-    cursor.execute("SELECT * FROM usuarios WHERE nivel_acesso IN ('comprador', 'admin') ORDER BY nome_completo")
-    lista_compradores = cursor.fetchall()
+    lista_empresas = listar_empresas(cursor)
+    lista_compradores = listar_compradores(cursor)
     
     cursor.close()
     conn.close()
 
-    kpis = {'total': len(all_orders), 'abertos': 0, 'atrasados': 0}
-    timeline_data = defaultdict(int)
     hoje = date.today()
     
-    for r in all_orders:
-        if 'Entregue' not in r['status_compra']:
-            kpis['abertos'] += 1
-            dt_val = r['data_entrega_reprogramada'] or r['prazo_entrega']
-            if dt_val:
-                try:
-                    if isinstance(dt_val, str):
-                        dt_obj = datetime.strptime(dt_val, '%Y-%m-%d').date()
-                    else:
-                        dt_obj = dt_val
-                    
-                    if (dt_obj - hoje).days <= 0:
-                        kpis['atrasados'] += 1
-                    start_week = dt_obj - timedelta(days=dt_obj.weekday())
-                    timeline_data[start_week] += 1
-                except:
-                    pass
-
-    sorted_dates = sorted(timeline_data.keys())
-    
     for p in pedidos:
         s = p['status_compra']
-        if s == 'Aguardando Aprovação':
+        codigo = p['codigo_status']
+        if codigo == situacao.AGUARDANDO_APROVACAO:
             p.update({'cor_s': '#9b59b6', 'txt_s': 'ORÇAMENTO'})
-        elif s in ['Confirmado', 'Orçamento', 'Em Trânsito']:
+        elif codigo in (situacao.CONFIRMADO, situacao.ORCAMENTO, situacao.EM_TRANSITO):
             p.update({'cor_s': '#3c7ea8', 'txt_s': 'COMPRADO'}) # Azul Oceano
-        elif 'Entregue' in s:
+        elif not p['em_aberto']:
             p.update({'cor_s': '#0ca956', 'txt_s': 'ENTREGUE'}) # Verde Nutrane
         else:
             p.update({'cor_s': '#95a5a6', 'txt_s': s})
@@ -331,7 +625,7 @@ def dashboard():
             else:
                 p_dt_obj = dt_val
 
-        if p_dt_obj and 'Entregue' not in s:
+        if p_dt_obj and p['em_aberto']:
             dias = (p_dt_obj - hoje).days
             if dias <= 0:
                 p.update({'cor_p': '#dc3545', 'txt_p': 'ATRASADO'}) # Vermelho Erro
@@ -351,16 +645,52 @@ def dashboard():
 
     colors = ['#3c7ea8', '#0ca956', '#f1c40f', '#dc3545', '#9b59b6', '#5d8db5']
 
+    filtros_url = {'busca': busca, 'f_solicitacao': f_solicitacao, 'f_empresa': f_empresa, 'f_comprador': f_comprador,
+                   'f_status': f_status, 'f_data_inicio': f_data_inicio, 'f_data_fim': f_data_fim}
+
     return render_template('dashboard.html', pedidos=pedidos, pagina=pagina, total_paginas=total_paginas,
+                           tem_anterior=tem_anterior, tem_proxima=tem_proxima, filtros_url=filtros_url,
+                           primeiro_id=pedidos[0]['id'] if pedidos else None, ultimo_id=pedidos[-1]['id'] if pedidos else None,
                            busca=busca, f_solicitacao=f_solicitacao, f_empresa=f_empresa, f_comprador=f_comprador, f_status=f_status,
                            f_data_inicio=f_data_inicio, f_data_fim=f_data_fim,
                            lista_empresas=lista_empresas, lista_compradores=lista_compradores, 
-                           lista_status=["Aguardando Aprovação", "Orçamento", "Confirmado", "Em Trânsito", "Entregue Parcialmente", "Entregue Totalmente"],
+                           lista_status=situacao.LISTA_STATUS,
                            kpis=kpis,
-                           graf_status={'labels': [r['status_compra'] for r in dados_status], 'values': [r['qtd'] for r in dados_status], 'colors': colors},
-                           graf_forn={'labels': [r['fornecedor'] for r in dados_forn], 'values': [r['qtd'] for r in dados_forn]},
-                           graf_comp={'labels': [r['nome_completo'] or 'Sem' for r in dados_comp], 'values': [r['qtd'] for r in dados_comp]},
-                           graf_timeline={'labels': [d.strftime('%d/%m') for d in sorted_dates], 'values': [timeline_data[d] for d in sorted_dates]})
+                           graf_status={'labels': [r['chave'] for r in agregados['status']], 'values': [r['qtd'] for r in agregados['status']], 'colors': colors},
+                           graf_forn={'labels': [r['chave'] for r in agregados['fornecedores']], 'values': [r['qtd'] for r in agregados['fornecedores']]},
+                           graf_comp={'labels': [r['chave'] or 'Sem' for r in agregados['compradores']], 'values': [r['qtd'] for r in agregados['compradores']]},
+                           graf_timeline={'labels': [d.strftime('%d/%m') for d, _ in agregados['timeline']], 'values': [qtd for _, qtd in agregados['timeline']]})
+
+@app.route('/exportar_pedidos')
+def exportar_pedidos():
+    """Baixa a lista filtrada do dashboard (mesma query string) em CSV ou XLSX, em fluxo."""
+    if 'user_id' not in session: return redirect(url_for('login'))
+
+    formato = request.args.get('formato', 'csv')
+    if formato not in exportacao.FORMATOS:
+        flash('Erro: formato de exportação inválido.')
+        return redirect(url_for('dashboard'))
+
+    conn = get_db_connection()
+    if not conn: return "Erro Base de Dados"
+
+    gerar, tipo = exportacao.FORMATOS[formato]
+    linhas = exportacao.linhas_pedidos(conn, montar_filtros_dashboard(request.args))
+    estado = {'concluido': False}
+
+    def fluxo():
+        yield from gerar(linhas)
+        estado['concluido'] = True
+
+    resposta = Response(fluxo(), mimetype=tipo, headers={
+        'Content-Disposition': f'attachment; filename="pedidos_{datetime.now():%Y%m%d_%H%M}.{formato}"',
+        'Cache-Control': 'no-store',
+    })
+    # A conexão segue em uso depois da rota: sai do teardown e é liberada só no fim do envio.
+    # Download cancelado no meio: o resultado sem buffer ainda ocupa a conexão, então ela é descartada
+    g.conexoes_db.remove(conn)
+    resposta.call_on_close(lambda: conn.close() if estado['concluido'] else conn.descartar())
+    return resposta
 
 # --- ROTA DE PERFORMANCE ---
 @app.route('/performance')
@@ -374,71 +704,26 @@ def performance():
     f_inicio = request.args.get('inicio', '')
     f_fim = request.args.get('fim', '')
     
-    where_base = ""
-    params = []
-    
-    if f_inicio and f_fim:
-        where_base = " AND data_registro BETWEEN %s AND %s"
-        params = [f_inicio, f_fim]
-    elif f_inicio:
-        where_base = " AND data_registro >= %s"
-        params = [f_inicio]
-    elif f_fim:
-        where_base = " AND data_registro <= %s"
-        params = [f_fim]
+    where_base, params = fatos_performance.filtro_registro(f_inicio, f_fim, 'data_registro')
 
-    cursor.execute(f"""
-        SELECT AVG(DATEDIFF(data_entrega_real, data_registro)) as media 
-        FROM acompanhamento_compras 
-        WHERE data_entrega_real IS NOT NULL {where_base}
-    """, params)
-    res_lead = cursor.fetchone()
-    lead_time = round(res_lead['media'] or 0)
+    # Lead time, OTIF, backlog e atraso por unidade vêm da tabela de fatos diária
+    fatos_performance.garantir_atualizacao_diaria(conn)
+    resumo = fatos_performance.resumo_periodo(cursor, f_inicio, f_fim)
+    lead_time = resumo['lead_time']
 
-    cursor.execute(f"""
-        SELECT 
-            COUNT(*) as total,
-            SUM(CASE WHEN entrega_conforme = 1 THEN 1 ELSE 0 END) as perfeitas,
-            SUM(CASE WHEN entrega_conforme = 0 THEN 1 ELSE 0 END) as problemas
-        FROM acompanhamento_compras 
-        WHERE status_compra LIKE '%%Entregue%%' {where_base}
-    """, params)
-    dados_otif = cursor.fetchone()
-    
-    total_entregue = dados_otif['total'] if dados_otif and dados_otif['total'] else 0
-    perfeitas = dados_otif['perfeitas'] or 0
-    problemas = dados_otif['problemas'] or 0
+    total_entregue = resumo['entregues']
+    perfeitas = resumo['perfeitas']
+    problemas = resumo['problemas']
     pct_otif = round((perfeitas / total_entregue) * 100, 1) if total_entregue > 0 else 0
     nao_avaliados = total_entregue - perfeitas - problemas
     if nao_avaliados < 0: nao_avaliados = 0
 
-    cursor.execute(f"""
-        SELECT SUM(i.quantidade * i.valor_unitario) as total_money
-        FROM pedidos_itens i
-        JOIN acompanhamento_compras c ON i.pedido_id = c.id
-        WHERE c.status_compra NOT LIKE '%%Entregue%%' {where_base.replace('data_registro', 'c.data_registro')}
-    """, params)
-    res_backlog = cursor.fetchone()
-    backlog_val = res_backlog['total_money'] or 0.0
+    backlog_val = resumo['backlog']
     backlog_fmt = "{:,.2f}".format(backlog_val).replace(',', 'X').replace('.', ',').replace('X', '.')
 
-    cursor.execute(f"""
-        SELECT 
-            e.nome_empresa,
-            COUNT(*) as total_pedidos,
-            SUM(CASE WHEN c.prazo_entrega < CURDATE() AND c.status_compra NOT LIKE '%%Entregue%%' THEN 1 ELSE 0 END) as atrasados
-        FROM acompanhamento_compras c
-        JOIN empresas_compras e ON c.codi_empresa = e.codi_empresa
-        WHERE 1=1 {where_base.replace('AND', 'AND c.')}
-        GROUP BY e.nome_empresa
-        HAVING total_pedidos > 0
-        ORDER BY atrasados DESC
-    """, params)
-    unidades = cursor.fetchall()
-    
     labels_atraso = []
     values_atraso = []
-    for u in unidades:
+    for u in resumo['unidades']:
         taxa = (u['atrasados'] / u['total_pedidos']) * 100 if u['total_pedidos'] > 0 else 0
         labels_atraso.append(u['nome_empresa'])
         values_atraso.append(round(taxa, 1))
@@ -462,6 +747,53 @@ def performance():
                            filtro_inicio=f_inicio, 
                            filtro_fim=f_fim)
 
+def gerar_pdf_performance(f_inicio, f_fim):
+    """Consulta os dados e renderiza o relatório. Roda na thread da fila de relatórios."""
+    with app.app_context():
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Erro Base de Dados")
+        cursor = conn.cursor()
+
+        where_base, params = fatos_performance.filtro_registro(f_inicio, f_fim)
+
+        try:
+            resumo = fatos_performance.resumo_periodo(cursor, f_inicio, f_fim)
+            lead_time = resumo['lead_time']
+            total_otif = resumo['entregues']
+            otif = round((resumo['perfeitas'] / total_otif * 100), 1) if total_otif > 0 else 0
+
+            cursor.execute(f"""
+                SELECT c.id, e.nome_empresa, c.fornecedor, c.data_compra, c.prazo_entrega, c.data_entrega_real, c.entrega_conforme, c.detalhes_entrega,
+                c.valor_total
+                FROM acompanhamento_compras c
+                JOIN empresas_compras e ON c.codi_empresa = e.codi_empresa
+                WHERE c.em_aberto = 0 {where_base}
+                ORDER BY c.data_entrega_real DESC
+            """, params)
+            entregas = cursor.fetchall()
+
+            cursor.execute(f"""
+                SELECT c.id, e.nome_empresa, c.fornecedor, c.prazo_entrega, DATEDIFF(CURDATE(), c.prazo_entrega) as dias_atraso,
+                c.valor_total
+                FROM acompanhamento_compras c
+                JOIN empresas_compras e ON c.codi_empresa = e.codi_empresa
+                WHERE c.em_aberto = 1 AND c.prazo_entrega < CURDATE() {where_base}
+                ORDER BY dias_atraso DESC
+            """, params)
+            atrasos = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+
+        html = render_template('pdf_relatorio.html', kpis={'lead_time': lead_time, 'otif': otif}, entregas=entregas, atrasos=atrasos, hoje=date.today().strftime('%d/%m/%Y'))
+        pdf_io = BytesIO()
+        with metricas.medir('pdf', 'relatorio_performance'):
+            pisa.CreatePDF(html, dest=pdf_io)
+        return pdf_io.getvalue()
+
+fila_relatorios = FilaRelatorios(gerar_pdf_performance, logger=app.logger)
+
 @app.route('/download_performance_pdf')
 def download_performance_pdf():
     if 'user_id' not in session: return redirect(url_for('login'))
@@ -471,63 +803,94 @@ def download_performance_pdf():
 
     f_inicio = request.args.get('inicio', '')
     f_fim = request.args.get('fim', '')
-    where_base = ""
-    params = []
-    if f_inicio and f_fim:
-        where_base = " AND data_registro BETWEEN %s AND %s"
-        params = [f_inicio, f_fim]
-    elif f_inicio:
-        where_base = " AND data_registro >= %s"
-        params = [f_inicio]
-    elif f_fim:
-        where_base = " AND data_registro <= %s"
-        params = [f_fim]
-
-    cursor.execute(f"SELECT AVG(DATEDIFF(data_entrega_real, data_registro)) as lead_time FROM acompanhamento_compras WHERE data_entrega_real IS NOT NULL {where_base}", params)
-    res_lead = cursor.fetchone()
-    lead_time = round(res_lead['lead_time'] or 0)
-
-    cursor.execute(f"SELECT COUNT(*) as total, SUM(CASE WHEN entrega_conforme = 1 THEN 1 ELSE 0 END) as perfeitas FROM acompanhamento_compras WHERE status_compra LIKE '%%Entregue%%' {where_base}", params)
-    d_otif = cursor.fetchone()
-    total_otif = d_otif['total'] if d_otif and d_otif['total'] else 0
-    perfeitas = d_otif['perfeitas'] if d_otif and d_otif['perfeitas'] else 0
-    otif = round((perfeitas / total_otif * 100), 1) if total_otif > 0 else 0
 
-    cursor.execute(f"""
-        SELECT c.id, e.nome_empresa, c.fornecedor, c.data_compra, c.prazo_entrega, c.data_entrega_real, c.entrega_conforme, c.detalhes_entrega,
-        (SELECT COALESCE(SUM(i.quantidade * i.valor_unitario), 0) FROM pedidos_itens i WHERE i.pedido_id = c.id) as valor_total
-        FROM acompanhamento_compras c
-        JOIN empresas_compras e ON c.codi_empresa = e.codi_empresa
-        WHERE c.status_compra LIKE '%%Entregue%%' {where_base.replace('AND', 'AND c.')}
-        ORDER BY c.data_entrega_real DESC
-    """, params)
-    entregas = cursor.fetchall()
-
-    cursor.execute(f"""
-        SELECT c.id, e.nome_empresa, c.fornecedor, c.prazo_entrega, DATEDIFF(CURDATE(), c.prazo_entrega) as dias_atraso,
-        (SELECT COALESCE(SUM(i.quantidade * i.valor_unitario), 0) FROM pedidos_itens i WHERE i.pedido_id = c.id) as valor_total
-        FROM acompanhamento_compras c
-        JOIN empresas_compras e ON c.codi_empresa = e.codi_empresa
-        WHERE c.prazo_entrega < CURDATE() AND c.status_compra NOT LIKE '%%Entregue%%' {where_base.replace('AND', 'AND c.')}
-        ORDER BY dias_atraso DESC
-    """, params)
-    atrasos = cursor.fetchall()
-    
+    # A versão dos dados entra na chave: o mesmo período sem alterações reaproveita o PDF pronto
+    fatos_performance.garantir_atualizacao_diaria(conn)
+    versao = fatos_performance.versao_periodo(cursor, f_inicio, f_fim)
     cursor.close()
     conn.close()
 
-    html = render_template('pdf_relatorio.html', kpis={'lead_time': lead_time, 'otif': otif}, entregas=entregas, atrasos=atrasos, hoje=date.today().strftime('%d/%m/%Y'))
-    pdf_io = BytesIO()
-    pisa.CreatePDF(html, dest=pdf_io)
-    pdf_io.seek(0)
-    
     nome_arquivo = f"Relatorio_Performance_{f_inicio}_ate_{f_fim}.pdf" if f_inicio else f"Relatorio_Geral_{date.today()}.pdf"
-    
-    return send_file(pdf_io, download_name=nome_arquivo, as_attachment=True)
+    tarefa = fila_relatorios.solicitar(f_inicio, f_fim, versao, nome_arquivo)
+
+    if tarefa['status'] == STATUS_PRONTO:
+        return send_file(fila_relatorios.caminho_pdf(tarefa['chave']), download_name=nome_arquivo, as_attachment=True)
+    return redirect(url_for('status_relatorio', tarefa_id=tarefa['id']))
+
+@app.route('/relatorios/<tarefa_id>')
+def status_relatorio(tarefa_id):
+    if 'user_id' not in session: return redirect(url_for('login'))
+    tarefa = fila_relatorios.consultar(tarefa_id)
+    if not tarefa:
+        flash('Relatório não encontrado. Solicite novamente.')
+        return redirect(url_for('performance'))
+    return render_template('aguardando_tarefa.html',
+                           titulo='📄 Gerando Relatório PDF',
+                           mensagem='Estamos montando o seu relatório. Você pode continuar usando o sistema; o link aparece aqui assim que ficar pronto.',
+                           url_status=url_for('status_relatorio_json', tarefa_id=tarefa_id),
+                           texto_resultado='Baixar Relatório PDF',
+                           url_voltar=url_for('performance', inicio=tarefa['inicio'], fim=tarefa['fim']))
+
+@app.route('/relatorios/<tarefa_id>/status')
+def status_relatorio_json(tarefa_id):
+    if 'user_id' not in session: return jsonify({'status': STATUS_ERRO, 'erro': 'Sessão expirada.'}), 401
+    tarefa = fila_relatorios.consultar(tarefa_id)
+    if not tarefa:
+        return jsonify({'status': STATUS_ERRO, 'erro': 'Relatório não encontrado.'}), 404
+    resposta = {'status': tarefa['status'], 'erro': tarefa.get('erro')}
+    if tarefa['status'] == STATUS_PRONTO:
+        resposta['url_resultado'] = url_for('baixar_relatorio', tarefa_id=tarefa_id)
+    return jsonify(resposta)
+
+@app.route('/relatorios/<tarefa_id>/baixar')
+def baixar_relatorio(tarefa_id):
+    if 'user_id' not in session: return redirect(url_for('login'))
+    tarefa = fila_relatorios.consultar(tarefa_id)
+    caminho = fila_relatorios.pdf_pronto(tarefa['chave']) if tarefa and tarefa['status'] == STATUS_PRONTO else None
+    if not caminho:
+        return redirect(url_for('status_relatorio', tarefa_id=tarefa_id))
+    return send_file(caminho, download_name=tarefa['nome_download'], as_attachment=True)
 
 # --- FUNÇÃO PRINCIPAL DE IMPORTAÇÃO (HÍBRIDA + TESSERACT PORTÁTIL) ---
+# PDFs digitalizados vão para o pool de processos do OCR; a tela consulta o andamento.
+fila_ocr = FilaOCR(logger=app.logger)
+# Texto já extraído por hash do arquivo: reenviar o mesmo PDF não roda pdfplumber/Tesseract de novo
+# (mudar o pré-processamento do OCR invalida as entradas antigas)
+cache_importacao = CacheImportacao(versao=f"{VERSAO_EXTRACAO}|{assinatura_preprocessamento()}")
+
+def renderizar_importacao(text, layout_text, origem):
+    # Se ainda não tiver texto, não tem o que fazer
+    if not text:
+        flash('Erro: PDF vazio ou ilegível.')
+        return redirect(url_for('nova_compra'))
+
+    resultado = parser_solicitacao.interpretar(text, layout_text)
+    dados_pdf = resultado.dados_formulario()
+    itens_pdf = resultado.itens_formulario()
+
+    if itens_pdf:
+        flash(f'✅ Sucesso! {len(itens_pdf)} itens importados via {origem}.')
+    else:
+        flash('⚠️ PDF processado, mas nenhum item identificado no padrão.')
+
+    # Carrega dados para o formulário
+    conn = get_db_connection()
+    empresas = []
+    usuarios = []
+    if conn:
+        try:
+            cursor = conn.cursor()
+            empresas = listar_empresas(cursor)
+            usuarios = listar_usuarios_aprovados(cursor)
+            cursor.close()
+            conn.close()
+        except: pass
+    
+    return render_template('nova_compra.html', empresas=empresas, usuarios=usuarios, dados_form=dados_pdf, itens_preenchidos=itens_pdf)
+
 @app.route('/importar_solicitacao', methods=['POST'])
 def importar_solicitacao():
+    if 'user_id' not in session: return redirect(url_for('login'))
     if 'arquivo_pdf' not in request.files or request.files['arquivo_pdf'].filename == '':
         flash('Erro no ficheiro.')
         return redirect(url_for('nova_compra'))
@@ -536,162 +899,361 @@ def importar_solicitacao():
     
     # Lê ficheiro para memória (para poder ser lido 2 vezes)
     file_bytes = file.read()
+    hash_pdf = hash_arquivo(file_bytes)
+
+    em_cache = cache_importacao.obter(hash_pdf)
+    if em_cache:
+        return renderizar_importacao(em_cache['texto'], em_cache['layout'], f"{em_cache['origem']} (já importado antes)")
     
-    # 1. TENTATIVA RÁPIDA: Texto direto via pdfplumber
-    file_obj_plumber = BytesIO(file_bytes)
+    # 1. TENTATIVA RÁPIDA: Texto direto via pdfplumber (todas as páginas da tabela de itens)
     text = ""
     layout_text = ""
-    origem = "Texto Digital (Rápido)"
     
     try:
-        with pdfplumber.open(file_obj_plumber) as pdf:
-            if len(pdf.pages) > 0:
-                page = pdf.pages[0]
-                text = page.extract_text() or ""
-                layout_text = page.extract_text(layout=True) or ""
+        with metricas.medir('pdf', 'extrair_texto'):
+            text, layout_text = parser_solicitacao.ler_texto_pdf(file_bytes)
     except Exception as e:
         app.logger.error(f"Erro pdfplumber: {e}")
 
-    # 2. TENTATIVA OCR: Se não achou texto (menos de 10 caracteres), usa Tesseract
+    # 2. TENTATIVA OCR: Se não achou texto (menos de 10 caracteres), envia para a fila do Tesseract
     if len(text.strip()) < 10:
         if HAS_OCR:
-            app.logger.warning("⚠️ Texto vazio. Ativando Tesseract Portátil...")
+            app.logger.warning("⚠️ Texto vazio. Enviando para o Tesseract Portátil...")
             try:
-                file_obj_ocr = BytesIO(file_bytes)
-                leitor_pdf = PdfReader(file_obj_ocr)
-                
-                if len(leitor_pdf.pages) > 0:
-                    pagina = leitor_pdf.pages[0]
-                    # Extrai imagens de dentro do PDF
-                    if len(pagina.images) > 0:
-                        full_ocr_text = ""
-                        for imagem_obj in pagina.images:
-                            imagem_pil = Image.open(BytesIO(imagem_obj.data))
-                            # Leitura com Tesseract
-                            full_ocr_text += pytesseract.image_to_string(imagem_pil, lang='por') + "\n"
-                        
-                        text = full_ocr_text
-                        layout_text = full_ocr_text # OCR não tem layout perfeito, mas serve
-                        origem = "Tesseract Portátil (Imagem)"
-                    else:
-                        app.logger.warning("PDF sem texto e sem imagens extraíveis.")
+                tarefa_id = fila_ocr.enviar(file_bytes, dono=session['user_id'], extras={'hash_pdf': hash_pdf},
+                                            hash_conteudo=hash_pdf)
             except Exception as e_ocr:
                 app.logger.error(f"Erro no Tesseract: {e_ocr}")
-        else:
-            app.logger.warning("OCR não disponível (Pasta Tesseract-OCR não encontrada).")
-
-    # --- 3. PROCESSAMENTO INTELIGENTE (REGEX ATUALIZADA) ---
-    dados_pdf = {}
-    itens_pdf = []
-    lista_obs = [] 
-    # ADICIONADO: "MT" e "MT GERAL" na lista de unidades conhecidas
-    unidades_conhecidas = ['UN', 'PC', 'CX', 'KG', 'M', 'L', 'LITRO', 'METRO', 'PAR', 'UN GERAL', 'MT', 'MT GERAL']
-
-    # Se ainda não tiver texto, não tem o que fazer
-    if not text:
-        flash('Erro: PDF vazio ou ilegível.')
+                flash('Erro: PDF vazio ou ilegível.')
+                return redirect(url_for('nova_compra'))
+            return render_template('aguardando_tarefa.html',
+                                   titulo='🔍 Lendo PDF Digitalizado',
+                                   mensagem='O arquivo não tem texto digital e está passando pelo OCR. O formulário abre sozinho quando a leitura terminar.',
+                                   url_status=url_for('status_importacao_json', tarefa_id=tarefa_id),
+                                   texto_resultado='Abrir Formulário',
+                                   url_voltar=url_for('nova_compra'),
+                                   redirecionar=True)
+        app.logger.warning("OCR não disponível (Pasta Tesseract-OCR não encontrada).")
+    else:
+        cache_importacao.guardar(hash_pdf, text, layout_text, ORIGEM_TEXTO_DIGITAL)
+
+    return renderizar_importacao(text, layout_text, ORIGEM_TEXTO_DIGITAL)
+
+@app.route('/importar_solicitacao/<tarefa_id>/status')
+def status_importacao_json(tarefa_id):
+    if 'user_id' not in session: return jsonify({'status': STATUS_ERRO, 'erro': 'Sessão expirada.'}), 401
+    tarefa = fila_ocr.consultar(tarefa_id, dono=session['user_id'])
+    if not tarefa:
+        return jsonify({'status': STATUS_ERRO, 'erro': 'Importação não encontrada. Envie o PDF novamente.'}), 404
+    resposta = {'status': tarefa['status'], 'erro': tarefa['erro']}
+    if tarefa['partes'] > 1:
+        resposta['progresso'] = f"{tarefa['partes_prontas']} de {tarefa['partes']} páginas lidas"
+    if tarefa['status'] == STATUS_PRONTO:
+        # OCR nunca repete para o mesmo arquivo: o texto vai para o cache assim que fica pronto
+        # (só no primeiro status pronto; as consultas seguintes não regravam o arquivo)
+        hash_pdf = tarefa['extras']['hash_pdf']
+        if not cache_importacao.contem(hash_pdf):
+            texto_ocr = tarefa['texto'] or ""
+            cache_importacao.guardar(hash_pdf, texto_ocr, texto_ocr, ORIGEM_OCR)
+        resposta['url_resultado'] = url_for('resultado_importacao', tarefa_id=tarefa_id)
+    return jsonify(resposta)
+
+@app.route('/importar_solicitacao/<tarefa_id>/resultado')
+def resultado_importacao(tarefa_id):
+    if 'user_id' not in session: return redirect(url_for('login'))
+    tarefa = fila_ocr.consultar(tarefa_id, dono=session['user_id'])
+    if not tarefa or tarefa['status'] == STATUS_ERRO:
+        flash('Erro: não foi possível ler o PDF digitalizado.')
+        return redirect(url_for('nova_compra'))
+    if tarefa['status'] != STATUS_PRONTO:
         return redirect(url_for('nova_compra'))
 
-    # A) Extração de Metadados
-    if m := re.search(r'Solicitação de Compra:\s*(\d+)', text):
-        dados_pdf['solicitacao'] = m.group(1)
-    
-    if m := re.search(r'Data:\s*(\d{2}/\d{2}/\d{4})', text): 
-        try:
-            dados_pdf['data_registro'] = datetime.strptime(m.group(1), '%d/%m/%Y').strftime('%Y-%m-%d')
-        except: pass
-    
-    if m := re.search(r'Empresa:\s*(\d+)', text):
-        dados_pdf['empresa'] = m.group(1)
-    
-    # B) Extração do Requerente (Via Layout - Só funciona bem no modo digital)
-    if "Requerente" in layout_text:
-        linhas_layout = layout_text.split('\n')
-        for i, linha in enumerate(linhas_layout):
-            if "Requerente" in linha:
-                for offset in range(1, 4):
-                    if i + offset < len(linhas_layout):
-                        linha_alvo = linhas_layout[i+offset].strip()
-                        if linha_alvo: 
-                            partes = re.split(r'\s{2,}', linha_alvo)
-                            dados_pdf['solicitante_real'] = partes[0]
-                            break
-                break
-
-    # C) Extração de Observações e Itens
-    lines = text.split('\n')
-    for line in lines:
-        # Observação
-        if "Observação:" in line:
+    fila_ocr.descartar(tarefa_id)
+    if tarefa['paginas_ignoradas']:
+        flash(f"⚠️ Só as primeiras {OCR_MAX_PAGINAS} páginas do PDF foram lidas "
+              f"({tarefa['paginas_ignoradas']} ignorada(s)). Confira os itens do final.")
+    texto_ocr = tarefa['texto'] or ""
+    # OCR não tem layout perfeito, mas serve
+    return renderizar_importacao(texto_ocr, texto_ocr, ORIGEM_OCR)
+
+# --- IMPORTAÇÃO EM LOTE (VÁRIOS PDFs OU ZIP) ---
+LOTE_MAX_ARQUIVOS = int(os.getenv('LOTE_MAX_ARQUIVOS', 100))
+LOTE_MAX_MB_ARQUIVO = int(os.getenv('LOTE_MAX_MB_ARQUIVO', 20))
+LOTE_MAX_MB_TOTAL = int(os.getenv('LOTE_MAX_MB_TOTAL', 200))
+PASTA_LOTES = os.getenv('LOTE_PASTA', 'lotes_recebidos')
+
+def copiar_com_limite(origem, caminho, limite):
+    """Copia o fluxo para `caminho` em blocos. Devolve (sha256, tamanho) ou None se passar de `limite` bytes."""
+    hasher = hashlib.sha256()
+    tamanho = 0
+    try:
+        with open(caminho, 'wb') as destino:
+            while True:
+                bloco = origem.read(armazem_anexos.TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                tamanho += len(bloco)
+                if tamanho > limite:
+                    break
+                hasher.update(bloco)
+                destino.write(bloco)
+    except BaseException:
+        os.remove(caminho)
+        raise
+    if tamanho > limite:
+        os.remove(caminho)
+        return None
+    return hasher.hexdigest(), tamanho
+
+def arquivos_do_lote(files, pasta):
+    """
+    Copia cada PDF enviado (abrindo ZIPs) para `pasta`, sem carregar o lote na memória.
+    Devolve ([(nome, caminho, sha256)], avisos). Vale LOTE_MAX_MB_ARQUIVO por arquivo e
+    LOTE_MAX_MB_TOTAL para o lote: o tamanho declarado (ZIP ou upload) é conferido antes
+    de ler, e o real durante a cópia.
+    """
+    limite_arquivo = LOTE_MAX_MB_ARQUIVO * 1024 * 1024
+    restante = LOTE_MAX_MB_TOTAL * 1024 * 1024
+    arquivos = []
+    avisos = []
+    excedentes = 0
+    sem_espaco = 0
+
+    def copiar(nome, origem, declarado):
+        nonlocal restante, excedentes, sem_espaco
+        if len(arquivos) >= LOTE_MAX_ARQUIVOS:
+            excedentes += 1
+            return
+        if declarado > limite_arquivo:
+            avisos.append(f"{nome}: maior que {LOTE_MAX_MB_ARQUIVO} MB, ignorado.")
+            return
+        if declarado > restante:
+            sem_espaco += 1
+            return
+        caminho = os.path.join(pasta, f"{len(arquivos):04d}.pdf")
+        copiado = copiar_com_limite(origem, caminho, min(limite_arquivo, restante))
+        if copiado is None:
+            if restante < limite_arquivo:
+                sem_espaco += 1
+            else:
+                avisos.append(f"{nome}: maior que {LOTE_MAX_MB_ARQUIVO} MB, ignorado.")
+            return
+        hash_pdf, tamanho = copiado
+        restante -= tamanho
+        arquivos.append((nome, caminho, hash_pdf))
+
+    for file in files:
+        if not file or not file.filename:
+            continue
+        nome = secure_filename(file.filename) or file.filename
+        if nome.lower().endswith('.zip'):
             try:
-                obs_texto = line.split("Observação:", 1)[1].strip()
-                obs_texto = obs_texto.replace('"', '').replace("'", "")
-                if obs_texto:
-                    lista_obs.append(obs_texto)
-            except: pass
-    
-        # Itens (Padrão: 00.00.0000 Descrição...)
-        if m := re.search(r'^(\d{2}\.\d{2}\.\d{4})\s+(.+)', line):
-            codigo = m.group(1)
-            resto = m.group(2)
-            
-            tokens = resto.split()
-            qtd = "1"
-            unid = "UN"
-            desc_parts = []
-            encontrou_unidade = False
-            
-            for token in tokens:
-                token_upper = token.upper()
-                
-                # CORREÇÃO CRUCIAL: Aceita ponto no meio (1.500,00)
-                if re.match(r'^[\d\.]+,\d+$', token):
-                    # Limpa o ponto de milhar antes de salvar
-                    qtd = token.split(',')[0].replace('.', '')
-                    break 
-                
-                # Se for unidade conhecida
-                elif token_upper in unidades_conhecidas or (token_upper == 'UN' and 'UN' in token_upper):
-                    encontrou_unidade = True
-                    if "UN" in token_upper: unid = "UN"
-                    elif token_upper == "PC": unid = "PCT"
-                    elif "MT" in token_upper: unid = "M" # Converte MT para M
-                    else: unid = token_upper
-                    continue 
-                
-                if encontrou_unidade: continue 
-                
-                # Se não for saldo numérico (com vírgula), é parte do nome
-                if not re.match(r'\d+,\d+', token): 
-                    desc_parts.append(token)
-            
-            nome_final = f"{codigo} - {' '.join(desc_parts)}"
-            itens_pdf.append({'nome_item': nome_final, 'quantidade': qtd, 'unidade_medida': unid})
+                with zipfile.ZipFile(file.stream) as pacote:
+                    for info in pacote.infolist():
+                        nome_interno = os.path.basename(info.filename)
+                        if info.is_dir() or not nome_interno.lower().endswith('.pdf') or info.filename.startswith('__MACOSX'):
+                            continue
+                        # Tamanho declarado no ZIP barra o arquivo gigante antes de descompactar (zip bomb)
+                        with pacote.open(info) as origem:
+                            copiar(nome_interno, origem, info.file_size)
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError):
+                avisos.append(f"{nome}: ZIP inválido.")
+        elif nome.lower().endswith('.pdf'):
+            # content_length da parte só vem quando o navegador informa; senão vale a conferência na cópia
+            copiar(nome, file.stream, file.content_length or 0)
+        else:
+            avisos.append(f"{nome}: só PDF ou ZIP.")
+
+    if excedentes:
+        avisos.append(f"Limite de {LOTE_MAX_ARQUIVOS} arquivos por lote: {excedentes} ignorado(s).")
+    if sem_espaco:
+        avisos.append(f"Limite de {LOTE_MAX_MB_TOTAL} MB por lote: {sem_espaco} arquivo(s) ignorado(s).")
+    return arquivos, avisos
+
+def titulo_pedido(nomes):
+    title = nomes[0] if nomes else "Pedido"
+    if len(nomes) > 1:
+        title += f" (+ {len(nomes)-1} itens)"
+    return title
+
+@app.route('/importar_lote', methods=['GET', 'POST'])
+def importar_lote():
+    if 'user_id' not in session: return redirect(url_for('login'))
+    if request.method == 'GET':
+        return render_template('importar_lote.html')
 
-    if lista_obs:
-        dados_pdf['observacao'] = "\n".join(lista_obs)
+    # Recusa antes de ler o corpo: request.files já gravaria o envio inteiro em disco
+    if request.content_length and request.content_length > LOTE_MAX_MB_TOTAL * 1024 * 1024:
+        flash(f'Erro: o envio passa de {LOTE_MAX_MB_TOTAL} MB. Divida o lote em partes menores.')
+        return redirect(url_for('importar_lote'))
 
-    if itens_pdf:
-        flash(f'✅ Sucesso! {len(itens_pdf)} itens importados via {origem}.')
-    else:
-        flash('⚠️ PDF processado, mas nenhum item identificado no padrão.')
+    # Os PDFs ficam em disco até os processos do pool lerem; a FilaOCR apaga a pasta ao terminar
+    pasta = os.path.join(PASTA_LOTES, uuid.uuid4().hex)
+    os.makedirs(pasta, exist_ok=True)
+    try:
+        arquivos, avisos = arquivos_do_lote(request.files.getlist('arquivos'), pasta)
+        for aviso in avisos:
+            flash(f'⚠️ {aviso}')
+        if not arquivos:
+            shutil.rmtree(pasta, ignore_errors=True)
+            flash('Erro: nenhum PDF encontrado no envio.')
+            return redirect(url_for('importar_lote'))
+
+        # Arquivos já importados antes saem do cache; só os novos vão para o pool de processos
+        lista = []
+        pendentes = []
+        for nome, caminho, hash_pdf in arquivos:
+            lista.append({'nome': nome, 'hash_pdf': hash_pdf, 'em_cache': cache_importacao.obter(hash_pdf)})
+            if not lista[-1]['em_cache']:
+                lista[-1]['indice_resultado'] = len(pendentes)
+                pendentes.append(caminho)
+
+        tarefa_id = fila_ocr.enviar_lote(pendentes, dono=session['user_id'], extras={'arquivos': lista},
+                                         pasta_temporaria=pasta)
+    except BaseException:
+        shutil.rmtree(pasta, ignore_errors=True)
+        raise
+    return render_template('aguardando_tarefa.html',
+                           titulo=f'📚 Lendo {len(arquivos)} Solicitações',
+                           mensagem='Os PDFs estão sendo lidos em paralelo. A tela de conferência abre sozinha quando todos terminarem.',
+                           url_status=url_for('status_lote_json', tarefa_id=tarefa_id),
+                           texto_resultado='Conferir Lote',
+                           url_voltar=url_for('importar_lote'),
+                           redirecionar=True)
+
+@app.route('/importar_lote/<tarefa_id>/status')
+def status_lote_json(tarefa_id):
+    if 'user_id' not in session: return jsonify({'status': STATUS_ERRO, 'erro': 'Sessão expirada.'}), 401
+    tarefa = fila_ocr.consultar(tarefa_id, dono=session['user_id'])
+    if not tarefa:
+        return jsonify({'status': STATUS_ERRO, 'erro': 'Lote não encontrado. Envie os arquivos novamente.'}), 404
+    resposta = {'status': tarefa['status'], 'erro': tarefa['erro']}
+    if tarefa['partes']:
+        resposta['progresso'] = f"{tarefa['partes_prontas']} de {tarefa['partes']} arquivos lidos"
+    if tarefa['status'] == STATUS_PRONTO:
+        resposta['url_resultado'] = url_for('revisar_lote', tarefa_id=tarefa_id)
+    return jsonify(resposta)
+
+@app.route('/importar_lote/<tarefa_id>/revisao')
+def revisar_lote(tarefa_id):
+    if 'user_id' not in session: return redirect(url_for('login'))
+    tarefa = fila_ocr.consultar(tarefa_id, dono=session['user_id'])
+    if not tarefa or tarefa['status'] == STATUS_ERRO:
+        flash('Erro: não foi possível ler o lote.')
+        return redirect(url_for('importar_lote'))
+    if tarefa['status'] != STATUS_PRONTO:
+        return redirect(url_for('importar_lote'))
+
+    linhas = []
+    falhas = []
+    for arquivo in tarefa['extras']['arquivos']:
+        extraido = arquivo['em_cache'] or tarefa['resultados'][arquivo['indice_resultado']]
+        if extraido.get('erro') or not extraido['texto'].strip():
+            falhas.append({'nome': arquivo['nome'], 'erro': extraido.get('erro') or 'PDF vazio ou ilegível.'})
+            continue
+        if not arquivo['em_cache']:
+            cache_importacao.guardar(arquivo['hash_pdf'], extraido['texto'], extraido['layout'], extraido['origem'])
+        if extraido.get('paginas_ignoradas'):
+            flash(f"⚠️ {arquivo['nome']}: só as primeiras {OCR_MAX_PAGINAS} páginas foram lidas "
+                  f"({extraido['paginas_ignoradas']} ignorada(s)).")
+
+        resultado = parser_solicitacao.interpretar(extraido['texto'], extraido['layout'])
+        if not resultado.itens:
+            falhas.append({'nome': arquivo['nome'], 'erro': 'Nenhum item identificado no padrão.'})
+            continue
+        linhas.append({'arquivo': arquivo['nome'], 'origem': extraido['origem'],
+                       'dados': resultado.dados_formulario(), 'itens': resultado.itens_formulario()})
 
-    # Carrega dados para o formulário
     conn = get_db_connection()
-    empresas = []
-    usuarios = []
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM empresas_compras')
-            empresas = cursor.fetchall()
-            cursor.execute('SELECT * FROM usuarios WHERE aprovado = 1')
-            usuarios = cursor.fetchall()
-            cursor.close()
-            conn.close()
-        except: pass
-    
-    return render_template('nova_compra.html', empresas=empresas, usuarios=usuarios, dados_form=dados_pdf, itens_preenchidos=itens_pdf)
+    if not conn: return "Erro de Base de Dados"
+    cursor = conn.cursor()
+    empresas = listar_empresas(cursor)
+    usuarios = listar_usuarios_aprovados(cursor)
+
+    # Solicitações que já viraram pedido: chegam desmarcadas na conferência
+    numeros = sorted({l['dados']['solicitacao'] for l in linhas if l['dados'].get('solicitacao')})
+    existentes = set()
+    if numeros:
+        cursor.execute(f"SELECT DISTINCT numero_solicitacao FROM acompanhamento_compras WHERE numero_solicitacao IN ({', '.join(['%s'] * len(numeros))})", numeros)
+        existentes = {str(r['numero_solicitacao']) for r in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+    for l in linhas:
+        l['duplicada'] = l['dados'].get('solicitacao') in existentes
+
+    fila_ocr.descartar(tarefa_id)
+    return render_template('revisar_lote.html', linhas=linhas, falhas=falhas, empresas=empresas, usuarios=usuarios)
+
+@app.route('/importar_lote/confirmar', methods=['POST'])
+def confirmar_lote():
+    if 'user_id' not in session: return redirect(url_for('login'))
+    f = request.form
+    conn = get_db_connection()
+    if not conn: return "Erro de Base de Dados"
+    cursor = conn.cursor()
+
+    criados = 0
+    falhas = []
+    # Uma transação para o lote; cada pedido em um SAVEPOINT para que a falha de um não desfaça os outros
+    conn.begin()
+    try:
+        for n in range(int(f.get('total_linhas', 0))):
+            if not f.get(f'incluir_{n}'):
+                continue
+            arquivo = f.get(f'arquivo_{n}', f'linha {n + 1}')
+            if not f.get(f'solicitacao_{n}') or not f.get(f'empresa_{n}'):
+                falhas.append(f"{arquivo}: informe o nº da solicitação e a unidade.")
+                continue
+            try:
+                itens = [i for i in json.loads(f.get(f'itens_{n}') or '[]') if i.get('nome_item', '').strip()]
+            except ValueError:
+                falhas.append(f"{arquivo}: itens inválidos.")
+                continue
+
+            cursor.execute(f'SAVEPOINT lote_{n}')
+            try:
+                cursor.execute('''
+                    INSERT INTO acompanhamento_compras 
+                    (data_registro, numero_solicitacao, item_comprado, categoria, fornecedor, observacao, codi_empresa,
+                     id_comprador_responsavel, status_compra, solicitante_real) 
+                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                ''', (
+                    f.get(f'data_registro_{n}') or None, f.get(f'solicitacao_{n}'),
+                    titulo_pedido([i['nome_item'] for i in itens]), None, f.get(f'fornecedor_{n}') or None,
+                    f.get(f'observacao_{n}'), f.get(f'empresa_{n}'), f.get(f'resp_comprador_{n}') or None,
+                    f.get(f'status_{n}') or 'Aguardando Aprovação', f.get(f'solicitante_real_{n}')
+                ))
+                pedido_id = cursor.lastrowid
+
+                # Um único INSERT com várias linhas (o PyMySQL agrupa o executemany)
+                cursor.executemany('''
+                    INSERT INTO pedidos_itens (pedido_id, nome_item, quantidade, unidade_medida, valor_unitario) 
+                    VALUES (%s, %s, %s, %s, %s)
+                ''', [(pedido_id, i['nome_item'], i.get('quantidade') or 1, i.get('unidade_medida') or 'UN', 0.0) for i in itens])
+
+                totais_pedido.recalcular(cursor, pedido_id)
+                registrar_alteracao_pedido(cursor, None, ler_pedido(cursor, pedido_id))
+                cursor.execute(f'RELEASE SAVEPOINT lote_{n}')
+                criados += 1
+            except Exception as e:
+                cursor.execute(f'ROLLBACK TO SAVEPOINT lote_{n}')
+                app.logger.error(f"Erro ao gravar {arquivo} no lote: {e}")
+                falhas.append(f"{arquivo}: {e}")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Erro no lote: {e}", exc_info=True)
+        flash('Erro ao gravar o lote. Nenhum pedido foi criado.')
+        return redirect(url_for('importar_lote'))
+    finally:
+        cursor.close()
+        conn.close()
+
+    cache_agregados.invalidar()
+    for falha in falhas:
+        flash(f'❌ {falha}')
+    flash(f'✅ {criados} pedido(s) criado(s) pelo lote.')
+    return redirect(url_for('dashboard'))
 
 # --- ROTAS DE CADASTRO E EDIÇÃO ---
 
@@ -705,20 +1267,18 @@ def nova_compra():
         return "Erro de Base de Dados"
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM empresas_compras')
-    empresas = cursor.fetchall()
-    cursor.execute('SELECT * FROM usuarios WHERE aprovado = 1')
-    usuarios = cursor.fetchall()
+    empresas = listar_empresas(cursor)
+    usuarios = listar_usuarios_aprovados(cursor)
     
     dados_form = {}
     
     if request.method == 'POST':
         f = request.form
-        names = f.getlist('nome_item[]')
-        title = names[0] if names else "Pedido"
-        if len(names) > 1: 
-            title += f" (+ {len(names)-1} itens)"
+        title = titulo_pedido(f.getlist('nome_item[]'))
         
+        # Cabeçalho, itens e contadores gravados na mesma transação
+        conn.begin()
+
         # Insere a data manual do input no banco
         cursor.execute('''
             INSERT INTO acompanhamento_compras 
@@ -736,20 +1296,14 @@ def nova_compra():
         
         pedido_id = cursor.lastrowid
         
-        nomes = f.getlist('nome_item[]')
-        qtds = f.getlist('qtd[]')
-        unids = f.getlist('unidade[]')
-        valores = f.getlist('valor[]') 
-        
-        for i in range(len(nomes)):
-            if nomes[i].strip():
-                val = safe_float(valores[i]) if i < len(valores) else 0.0
-                cursor.execute('''
-                    INSERT INTO pedidos_itens (pedido_id, nome_item, quantidade, unidade_medida, valor_unitario) 
-                    VALUES (%s, %s, %s, %s, %s)
-                ''', (pedido_id, nomes[i], qtds[i], unids[i], val))
-        
+        gravar_itens_pedido(cursor, pedido_id, f, novo=True)
+
+        totais_pedido.recalcular(cursor, pedido_id)
+        registrar_alteracao_pedido(cursor, None, ler_pedido(cursor, pedido_id))
         salvar_anexos_multiplos(conn, pedido_id, request.files.getlist('arquivo'))
+        conn.commit()
+        confirmar_anexos_novos()
+        cache_agregados.invalidar()
         
         cursor.close()
         conn.close()
@@ -769,22 +1323,22 @@ def editar_pedido(id):
     
     cursor.execute('SELECT * FROM acompanhamento_compras WHERE id = %s', (id,))
     pedido = cursor.fetchone()
-    cursor.execute('SELECT * FROM usuarios WHERE aprovado = 1 ORDER BY nome_completo')
-    usuarios = cursor.fetchall()
+    usuarios = listar_usuarios_aprovados(cursor)
     
     if request.method == 'POST':
         f = request.form
         
-        names = f.getlist('nome_item[]')
-        title = names[0] if names else "Pedido"
-        if len(names) > 1: 
-            title += f" (+ {len(names)-1} itens)"
+        title = titulo_pedido(f.getlist('nome_item[]'))
         
         ent_conf = f.get('entrega_conforme')
         if ent_conf == '1': ent_conf = 1
         elif ent_conf == '0': ent_conf = 0
         else: ent_conf = None
 
+        # Relê o pedido travado para que os contadores partam do estado real
+        conn.begin()
+        antes = ler_pedido(cursor, id, bloquear=True)
+
         cursor.execute('''
             UPDATE acompanhamento_compras SET 
             data_registro=%s, data_abertura=%s, numero_solicitacao=%s, numero_orcamento=%s, numero_pedido=%s, item_comprado=%s, 
@@ -805,29 +1359,13 @@ def editar_pedido(id):
             id
         ))
         
-        ids = f.getlist('item_id[]')
-        nomes = f.getlist('nome_item[]')
-        qtds = f.getlist('qtd[]')
-        unids = f.getlist('unidade[]')
-        vals = f.getlist('valor[]')
-
-        if f.get('itens_para_remover'):
-            for rem_id in f.get('itens_para_remover').split(','):
-                if rem_id: cursor.execute('DELETE FROM pedidos_itens WHERE id=%s', (rem_id,))
-        
-        for i in range(len(nomes)):
-            if nomes[i].strip():
-                val = safe_float(vals[i]) if i < len(vals) else 0.0
-                if ids[i]: 
-                    cursor.execute('''UPDATE pedidos_itens 
-                        SET nome_item=%s, quantidade=%s, unidade_medida=%s, valor_unitario=%s 
-                        WHERE id=%s''', (nomes[i], qtds[i], unids[i], val, ids[i]))
-                else: 
-                    cursor.execute('''INSERT INTO pedidos_itens 
-                        (pedido_id, nome_item, quantidade, unidade_medida, valor_unitario) 
-                        VALUES (%s, %s, %s, %s, %s)''', (id, nomes[i], qtds[i], unids[i], val))
-        
+        if gravar_itens_pedido(cursor, id, f):
+            totais_pedido.recalcular(cursor, id)
+        registrar_alteracao_pedido(cursor, antes, ler_pedido(cursor, id))
         salvar_anexos_multiplos(conn, id, request.files.getlist('arquivo'))
+        conn.commit()
+        confirmar_anexos_novos()
+        cache_agregados.invalidar()
         cursor.close()
         conn.close()
         flash('✅ Atualizado com sucesso!')
@@ -849,15 +1387,21 @@ def excluir_pedido(id):
     if not conn: return "Erro Base de Dados"
     cursor = conn.cursor()
     
-    cursor.execute('SELECT nome_arquivo FROM pedidos_anexos WHERE pedido_id=%s',(id,))
-    anexos = cursor.fetchall()
-    for anexo in anexos:
-        try:
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], anexo['nome_arquivo']))
-        except:
-            pass
+    conn.begin()
+    antes = ler_pedido(cursor, id, bloquear=True)
+
+    cursor.execute('SELECT nome_arquivo, hash_conteudo FROM pedidos_anexos WHERE pedido_id=%s',(id,))
+    anexos_pedido = cursor.fetchall()
+    cursor.execute('DELETE FROM pedidos_anexos WHERE pedido_id=%s',(id,))
+    # Só some do disco o arquivo que não é usado por nenhum outro pedido, e só depois do commit
+    orfaos = armazem_anexos.liberar(cursor, anexos_pedido)
         
     cursor.execute('DELETE FROM acompanhamento_compras WHERE id=%s',(id,))
+    if antes:
+        registrar_alteracao_pedido(cursor, antes, None)
+    conn.commit()
+    armazem_anexos.remover_orfaos(conn, orfaos, app.config['UPLOAD_FOLDER'])
+    cache_agregados.invalidar()
     cursor.close()
     conn.close()
     flash('Excluído!')
@@ -868,15 +1412,15 @@ def excluir_anexo(anexo_id):
     if 'user_id' not in session: return redirect(url_for('login'))
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT pedido_id, nome_arquivo FROM pedidos_anexos WHERE id=%s',(anexo_id,))
+    conn.begin()
+    cursor.execute('SELECT pedido_id, nome_arquivo, hash_conteudo FROM pedidos_anexos WHERE id=%s FOR UPDATE',(anexo_id,))
     anexo = cursor.fetchone()
     
     if anexo:
-        try:
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], anexo['nome_arquivo']))
-        except:
-            pass
         cursor.execute('DELETE FROM pedidos_anexos WHERE id=%s',(anexo_id,))
+        orfaos = armazem_anexos.liberar(cursor, [anexo])
+        conn.commit()
+        armazem_anexos.remover_orfaos(conn, orfaos, app.config['UPLOAD_FOLDER'])
         cursor.close()
         conn.close()
         flash('Anexo removido!')
@@ -886,6 +1430,66 @@ def excluir_anexo(anexo_id):
     conn.close()
     return redirect(url_for('dashboard'))
 
+@app.route('/anexo/<int:anexo_id>')
+def baixar_anexo(anexo_id):
+    """
+    Entrega um anexo só para usuários logados. Arquivos guardados por hash nunca mudam, então o
+    ETag é o próprio hash e o navegador guarda a cópia como imutável. If-None-Match e Range (PDF
+    grande aberto por partes) ficam com o send_file, que manda o arquivo pelo wsgi.file_wrapper
+    do Waitress, em blocos, sem carregá-lo na memória.
+    """
+    if 'user_id' not in session: return redirect(url_for('login'))
+    conn = get_db_connection()
+    if not conn: return "Erro Base de Dados"
+    cursor = conn.cursor()
+    cursor.execute('SELECT nome_arquivo, nome_original, hash_conteudo FROM pedidos_anexos WHERE id=%s', (anexo_id,))
+    anexo = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if not anexo: abort(404)
+
+    caminho = os.path.abspath(armazem_anexos.caminho_absoluto(anexo['nome_arquivo'], app.config['UPLOAD_FOLDER']))
+    if not os.path.isfile(caminho): abort(404)
+
+    resposta = send_file(caminho,
+                         mimetype=mimetypes.guess_type(anexo['nome_arquivo'])[0] or 'application/octet-stream',
+                         as_attachment=request.args.get('baixar') == '1',
+                         download_name=anexo['nome_original'] or os.path.basename(caminho),
+                         etag=anexo['hash_conteudo'] or True,
+                         max_age=ANEXO_MAX_AGE, conditional=True)
+    resposta.cache_control.public = False
+    resposta.cache_control.private = True
+    resposta.cache_control.immutable = True
+    resposta.headers['X-Content-Type-Options'] = 'nosniff'
+    return resposta
+
+@app.route('/anexo/<int:anexo_id>/miniatura')
+def miniatura_anexo(anexo_id):
+    if 'user_id' not in session: return redirect(url_for('login'))
+    conn = get_db_connection()
+    if not conn: return "Erro Base de Dados"
+    cursor = conn.cursor()
+    cursor.execute('SELECT nome_arquivo, hash_conteudo FROM pedidos_anexos WHERE id=%s', (anexo_id,))
+    anexo = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if not anexo: abort(404)
+
+    try:
+        caminho = miniaturas_anexos.obter(armazem_anexos.caminho_absoluto(anexo['nome_arquivo'], app.config['UPLOAD_FOLDER']),
+                                          anexo['hash_conteudo'])
+    except Exception as e:
+        app.logger.error(f"Falha ao gerar miniatura do anexo {anexo_id}: {e}")
+        caminho = None
+    # Sem prévia (tipo sem miniatura ou arquivo ilegível): a página esconde a imagem e mostra só o nome
+    if not caminho: abort(404)
+
+    resposta = send_file(os.path.abspath(caminho), mimetype='image/jpeg', max_age=ANEXO_MAX_AGE)
+    resposta.cache_control.public = False
+    resposta.cache_control.private = True
+    resposta.cache_control.immutable = True
+    return resposta
+
 @app.route('/ver_pedido/<int:id>')
 def ver_pedido(id):
     if 'user_id' not in session: return redirect(url_for('login'))
@@ -933,11 +1537,20 @@ def admin_usuarios():
                 cursor.execute('UPDATE usuarios SET aprovado=1 WHERE id=%s', (target_id,))
                 flash('✅ Usuário aprovado com sucesso!')
             elif acao == 'excluir':
-                try:
-                    cursor.execute('DELETE FROM usuarios WHERE id=%s', (target_id,))
-                    flash('🗑️ Usuário excluído permanentemente.')
-                except Exception as e:
+                # Conferido aqui e não só pela FK: bancos criados com ON DELETE SET NULL apagariam
+                # o usuário e deixariam pedidos (e contadores) sem responsável
+                cursor.execute('''
+                    SELECT 1 FROM acompanhamento_compras
+                    WHERE id_comprador_responsavel = %s OR id_responsavel_chamado = %s LIMIT 1
+                ''', (target_id, target_id))
+                if cursor.fetchone():
                     flash('Erro ao excluir: Usuário possui registos vinculados.')
+                else:
+                    try:
+                        cursor.execute('DELETE FROM usuarios WHERE id=%s', (target_id,))
+                        flash('🗑️ Usuário excluído permanentemente.')
+                    except Exception as e:
+                        flash('Erro ao excluir: Usuário possui registos vinculados.')
             elif acao == 'promover':
                 cursor.execute("UPDATE usuarios SET nivel_acesso='admin' WHERE id=%s", (target_id,))
                 flash('👮 Usuário promovido a ADMIN!')
@@ -946,6 +1559,7 @@ def admin_usuarios():
                 flash('⬇️ Usuário rebaixado para Comprador.')
 
             conn.commit()
+            invalidar_referencias()
             return redirect(url_for('admin_usuarios'))
     
     cursor.execute('SELECT * FROM usuarios WHERE aprovado=0')
@@ -959,5 +1573,89 @@ def admin_usuarios():
     
     return render_template('admin_usuarios.html', pendentes=pendentes, ativos=ativos)
 
+def ao_concluir_planilha():
+    cache_agregados.invalidar()
+
+fila_planilhas = FilaPlanilhas(banco_dados.obter_conexao, logger=app.logger, ao_concluir=ao_concluir_planilha)
+
+@app.route('/admin/importar_planilha', methods=['GET', 'POST'])
+def admin_importar_planilha():
+    if session.get('user_nivel') != 'admin': 
+        return redirect(url_for('dashboard'))
+    if request.method == 'GET':
+        return render_template('admin_importar_planilha.html', resultado=None)
+
+    file = request.files.get('planilha')
+    extensao = os.path.splitext(file.filename)[1].lower() if file and file.filename else ''
+    if extensao not in ('.xlsx', '.xlsm', '.csv'):
+        flash('Erro: envie um arquivo .xlsx ou .csv.')
+        return redirect(url_for('admin_importar_planilha'))
+
+    # Vai para o disco: o openpyxl lê o XLSX em fluxo a partir do arquivo, sem carregar tudo na memória
+    os.makedirs(PASTA_PLANILHAS, exist_ok=True)
+    caminho = os.path.join(PASTA_PLANILHAS, f"{uuid.uuid4().hex}{extensao}")
+    file.save(caminho)
+
+    simular = bool(request.form.get('simular'))
+    tarefa_id = fila_planilhas.enviar(caminho, secure_filename(file.filename), session['user_id'],
+                                      aba=request.form.get('aba') or None,
+                                      status_padrao=request.form.get('status_padrao') or 'Entregue',
+                                      simular=simular)
+    return render_template('aguardando_tarefa.html',
+                           titulo='📥 Importando Planilha',
+                           mensagem='A planilha está sendo lida e gravada em lotes. Planilhas grandes levam alguns minutos.',
+                           url_status=url_for('status_planilha_json', tarefa_id=tarefa_id),
+                           texto_resultado='Ver Resultado',
+                           url_voltar=url_for('admin_importar_planilha'),
+                           redirecionar=True)
+
+@app.route('/admin/importar_planilha/<tarefa_id>/status')
+def status_planilha_json(tarefa_id):
+    if session.get('user_nivel') != 'admin': return jsonify({'status': STATUS_ERRO, 'erro': 'Acesso negado.'}), 403
+    tarefa = fila_planilhas.consultar(tarefa_id)
+    if not tarefa:
+        return jsonify({'status': STATUS_ERRO, 'erro': 'Importação não encontrada.'}), 404
+    resposta = {'status': tarefa['status'], 'erro': tarefa['erro'],
+                'url_resultado': url_for('resultado_planilha', tarefa_id=tarefa_id)}
+    if tarefa['linhas']:
+        resposta['progresso'] = f"{tarefa['linhas']} linhas lidas, {tarefa['pedidos']} pedidos gravados"
+    return jsonify(resposta)
+
+@app.route('/admin/importar_planilha/<tarefa_id>/resultado')
+def resultado_planilha(tarefa_id):
+    if session.get('user_nivel') != 'admin': 
+        return redirect(url_for('dashboard'))
+    tarefa = fila_planilhas.consultar(tarefa_id)
+    if not tarefa or tarefa['status'] not in (STATUS_PRONTO, STATUS_ERRO):
+        return redirect(url_for('admin_importar_planilha'))
+    return render_template('admin_importar_planilha.html', resultado=tarefa,
+                           simulacao=tarefa['resumo'] is not None and tarefa['resumo'].get('simulacao'))
+
+@app.route('/admin/pool_db')
+def admin_pool_db():
+    if session.get('user_nivel') != 'admin': 
+        return redirect(url_for('dashboard'))
+    return jsonify(banco_dados.estatisticas_pool())
+
+@app.route('/admin/metrics', methods=['GET', 'POST'])
+def admin_metricas():
+    if session.get('user_nivel') != 'admin': 
+        return redirect(url_for('dashboard'))
+    if request.method == 'POST' and request.form.get('acao') == 'zerar':
+        metricas.metricas.zerar()
+        flash('Métricas zeradas.')
+        return redirect(url_for('admin_metricas'))
+    return render_template('admin_metricas.html', resumo=metricas.metricas.resumo(), habilitado=metricas.HABILITADO,
+                           desde=datetime.fromtimestamp(metricas.metricas.desde).strftime('%d/%m/%Y %H:%M'),
+                           pool=banco_dados.estatisticas_pool())
+
+@app.route('/admin/metrics/prometheus')
+def admin_metricas_prometheus():
+    autorizacao = request.headers.get('Authorization', '')
+    token_ok = bool(METRICAS_TOKEN) and hmac.compare_digest(autorizacao, f"Bearer {METRICAS_TOKEN}")
+    if session.get('user_nivel') != 'admin' and not token_ok:
+        abort(403)
+    return Response(metricas.metricas.texto_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=8080)
\ No newline at end of file
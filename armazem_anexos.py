@@ -0,0 +1,216 @@
+"""
+Armazenamento dos anexos por conteúdo (SHA-256).
+
+- O upload vai para o disco em blocos, calculando o hash no caminho (nada fica inteiro na memória).
+- O arquivo final fica em <pasta>/<2 hex>/<2 hex>/<sha256>.<ext>: a mesma NF ou cotação anexada
+  em vários pedidos ocupa o disco uma vez só, e nomes nunca colidem.
+- Cada linha de pedidos_anexos com o mesmo hash_conteudo é uma referência ao arquivo; ele só é
+  apagado do disco depois do commit que tirou a última referência (liberar() + remover_orfaos()).
+- Linhas antigas (hash_conteudo NULL, nome "timestamp_nome") continuam funcionando; para trazê-las
+  para o novo formato: python armazem_anexos.py --migrar-legado
+
+Requer a migração migracoes/0005_anexos_por_conteudo.sql.
+"""
+import os
+import sys
+import uuid
+import shutil
+import hashlib
+
+# Fora de static/: os anexos só saem pela rota /anexo/<id>, que exige login
+PASTA_ANEXOS = os.getenv('PASTA_ANEXOS', 'uploads')
+PASTA_ANEXOS_ANTIGA = os.path.join('static', 'uploads')
+TAMANHO_BLOCO = 1024 * 1024
+EXTENSOES_EQUIVALENTES = {'jpeg': 'jpg'}
+
+
+def extensao(nome):
+    ext = nome.rsplit('.', 1)[1].lower() if '.' in nome else ''
+    return EXTENSOES_EQUIVALENTES.get(ext, ext)
+
+
+def nome_por_conteudo(hash_conteudo, ext):
+    """Caminho relativo guardado em pedidos_anexos.nome_arquivo (com '/', serve direto na URL)."""
+    nome = f"{hash_conteudo}.{ext}" if ext else hash_conteudo
+    return f"{hash_conteudo[:2]}/{hash_conteudo[2:4]}/{nome}"
+
+
+def caminho_absoluto(nome_arquivo, pasta=PASTA_ANEXOS):
+    return os.path.join(pasta, *nome_arquivo.split('/'))
+
+
+def mover_pasta_antiga(pasta=PASTA_ANEXOS, antiga=PASTA_ANEXOS_ANTIGA):
+    """
+    Na primeira subida após a mudança, move os anexos de static/uploads (onde qualquer um baixava
+    sem login) para a pasta nova. Os nomes guardados no banco são relativos, então nada muda nele.
+    """
+    if os.path.isdir(antiga) and not os.path.exists(pasta):
+        os.rename(antiga, pasta)
+        return True
+    return False
+
+
+def _remover(caminho):
+    try:
+        os.remove(caminho)
+        return True
+    except OSError:
+        return False
+
+
+def gravar_temporario(fluxo, pasta=PASTA_ANEXOS):
+    """Copia o fluxo para <pasta>/tmp em blocos. Devolve (caminho temporário, sha256, tamanho)."""
+    pasta_tmp = os.path.join(pasta, 'tmp')
+    os.makedirs(pasta_tmp, exist_ok=True)
+    temporario = os.path.join(pasta_tmp, uuid.uuid4().hex)
+    hasher = hashlib.sha256()
+    tamanho = 0
+    try:
+        with open(temporario, 'wb') as destino:
+            while True:
+                bloco = fluxo.read(TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                hasher.update(bloco)
+                destino.write(bloco)
+                tamanho += len(bloco)
+    except BaseException:
+        _remover(temporario)
+        raise
+    return temporario, hasher.hexdigest(), tamanho
+
+
+def salvar(cursor, pedido_id, arquivo, pasta=PASTA_ANEXOS):
+    """
+    Grava um upload (FileStorage do Flask) como anexo do pedido. Devolve {'nome_arquivo',
+    'hash_conteudo', 'novo'}; 'novo' é False quando reaproveitou um arquivo já guardado.
+
+    Deve rodar dentro da transação do pedido. O INSERT vem antes de pôr o arquivo no lugar: se
+    outra requisição estiver apagando a última referência do mesmo conteúdo, o INSERT espera a
+    trava de remover_orfaos() e, ao seguir, o arquivo é recolocado. Se a transação for desfeita,
+    quem chamou passa os anexos com 'novo' True para remover_orfaos().
+    """
+    temporario, hash_conteudo, tamanho = gravar_temporario(arquivo.stream, pasta)
+    nome_arquivo = nome_por_conteudo(hash_conteudo, extensao(arquivo.filename))
+    try:
+        cursor.execute('''
+            INSERT INTO pedidos_anexos (pedido_id, nome_arquivo, nome_original, hash_conteudo, tamanho)
+            VALUES (%s, %s, %s, %s, %s)
+        ''', (pedido_id, nome_arquivo, arquivo.filename, hash_conteudo, tamanho))
+
+        gravado = {'nome_arquivo': nome_arquivo, 'hash_conteudo': hash_conteudo, 'novo': False}
+        destino = caminho_absoluto(nome_arquivo, pasta)
+        if os.path.exists(destino):
+            return gravado
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(temporario, destino)
+        temporario = None
+        gravado['novo'] = True
+        return gravado
+    finally:
+        if temporario:
+            _remover(temporario)
+
+
+def _referencias(cursor, nome_arquivo, hash_conteudo):
+    cursor.execute('''
+        SELECT COUNT(*) AS referencias FROM pedidos_anexos
+        WHERE hash_conteudo = %s AND nome_arquivo = %s FOR UPDATE
+    ''', (hash_conteudo, nome_arquivo))
+    return cursor.fetchone()['referencias']
+
+
+def liberar(cursor, anexos):
+    """
+    Dos `anexos` (linhas com nome_arquivo e hash_conteudo), devolve [(nome_arquivo, hash_conteudo)]
+    dos que ficaram sem referência. Chamar depois do DELETE em pedidos_anexos, na mesma transação.
+    Nada é apagado aqui: se a transação for desfeita, as linhas voltam e o arquivo precisa estar lá.
+    Depois do commit, passe a lista para remover_orfaos().
+    """
+    orfaos = []
+    for nome_arquivo, hash_conteudo in {(a['nome_arquivo'], a.get('hash_conteudo')) for a in anexos}:
+        if hash_conteudo and _referencias(cursor, nome_arquivo, hash_conteudo):
+            continue
+        orfaos.append((nome_arquivo, hash_conteudo))
+    return orfaos
+
+
+def remover_orfaos(conn, arquivos, pasta=PASTA_ANEXOS):
+    """
+    Apaga do disco os `arquivos` [(nome_arquivo, hash_conteudo)] que continuam sem referência:
+    os de liberar() depois do commit, ou os recém-gravados por salvar() numa transação desfeita.
+    Cada um é reconferido com SELECT ... FOR UPDATE numa transação curta, então um upload
+    simultâneo do mesmo conteúdo espera e recoloca o arquivo, ou já conta como referência.
+    Devolve quantos arquivos foram removidos.
+    """
+    removidos = 0
+    cursor = conn.cursor()
+    try:
+        for nome_arquivo, hash_conteudo in arquivos:
+            conn.begin()
+            try:
+                if not (hash_conteudo and _referencias(cursor, nome_arquivo, hash_conteudo)):
+                    if _remover(caminho_absoluto(nome_arquivo, pasta)):
+                        removidos += 1
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        cursor.close()
+    return removidos
+
+
+def _hash_arquivo_disco(caminho):
+    hasher = hashlib.sha256()
+    with open(caminho, 'rb') as origem:
+        for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+            hasher.update(bloco)
+    return hasher.hexdigest()
+
+
+def migrar_legado(conn, pasta=PASTA_ANEXOS):
+    """
+    Move os anexos antigos para o armazenamento por conteúdo, unificando duplicados.
+    Pode ser interrompido e rodado de novo. Devolve {'migrados', 'duplicados', 'faltando'}.
+    """
+    resumo = {'migrados': 0, 'duplicados': 0, 'faltando': 0}
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT id, nome_arquivo FROM pedidos_anexos WHERE hash_conteudo IS NULL ORDER BY id')
+        for anexo in cursor.fetchall():
+            origem = caminho_absoluto(anexo['nome_arquivo'], pasta)
+            if not os.path.exists(origem):
+                resumo['faltando'] += 1
+                continue
+            hash_conteudo = _hash_arquivo_disco(origem)
+            nome_arquivo = nome_por_conteudo(hash_conteudo, extensao(anexo['nome_arquivo']))
+            destino = caminho_absoluto(nome_arquivo, pasta)
+            if os.path.exists(destino):
+                resumo['duplicados'] += 1
+            else:
+                # Copia antes de atualizar a linha: uma interrupção nunca deixa o anexo sem arquivo
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                shutil.copy2(origem, destino)
+                resumo['migrados'] += 1
+            cursor.execute('UPDATE pedidos_anexos SET nome_arquivo = %s, hash_conteudo = %s, tamanho = %s WHERE id = %s',
+                           (nome_arquivo, hash_conteudo, os.path.getsize(destino), anexo['id']))
+            _remover(origem)
+    finally:
+        cursor.close()
+    return resumo
+
+
+if __name__ == '__main__':
+    if '--migrar-legado' not in sys.argv:
+        print("Uso: python armazem_anexos.py --migrar-legado")
+        sys.exit(1)
+
+    import banco_dados
+    conn = banco_dados.obter_conexao()
+    try:
+        r = migrar_legado(conn)
+        print(f"✅ {r['migrados']} arquivo(s) movido(s), {r['duplicados']} duplicado(s) unificado(s),"
+              f" {r['faltando']} anexo(s) sem arquivo no disco.")
+    finally:
+        conn.close()
@@ -0,0 +1,325 @@
+import os
+import time
+import threading
+import weakref
+from collections import deque
+import pymysql
+import pymysql.cursors
+from pymysql.constants import SERVER_STATUS
+from dotenv import load_dotenv
+
+import metricas
+
+# 1. CARREGA AS CONFIGURAÇÕES DO BANCO (compartilhadas por app.py e Usuario.py)
+load_dotenv()
+
+DB_HOST = os.getenv('DB_HOST')
+DB_USER = os.getenv('DB_USER')
+DB_PASSWORD = os.getenv('DB_PASSWORD')
+DB_NAME = os.getenv('DB_NAME')
+DB_PORT = int(os.getenv('DB_PORT', 3306))
+
+# 'mysql' (servidor MariaDB/MySQL) ou 'sqlite' (arquivo local em modo WAL, ver banco_sqlite.py)
+DB_BACKEND = os.getenv('DB_BACKEND', 'mysql').strip().lower()
+
+# 2. CONFIGURAÇÕES DO POOL
+# O tamanho padrão acompanha o número de threads do Waitress (Run.py), pois
+# cada thread atende uma requisição por vez e nunca precisa de mais de uma conexão.
+# As filas em segundo plano (relatórios PDF, planilhas) também emprestam daqui: o Run.py
+# soma os workers delas ao tamanho.
+POOL_TAMANHO = int(os.getenv('DB_POOL_TAMANHO', 6))
+POOL_ESPERA_MAX = float(os.getenv('DB_POOL_ESPERA_MAX', 10))     # Segundos aguardando uma conexão livre
+POOL_VIDA_MAX = float(os.getenv('DB_POOL_VIDA_MAX', 1800))       # Recicla conexões com mais de 30 minutos
+POOL_PING_OCIOSA = float(os.getenv('DB_POOL_PING_OCIOSA', 5))    # Testa (ping) conexões paradas há mais de X segundos
+
+
+class PoolEsgotado(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo máximo de espera."""
+
+
+def _abrir_conexao_mysql():
+    return pymysql.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        port=DB_PORT,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor,
+        autocommit=True
+    )
+
+
+def _abrir_conexao_sqlite():
+    import banco_sqlite
+    return banco_sqlite.abrir_conexao()
+
+
+def _em_transacao(bruta):
+    if hasattr(bruta, 'em_transacao'):
+        return bruta.em_transacao()
+    return bool(bruta.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS)
+
+
+def somar_no_conflito(tabela, chave, coluna):
+    """
+    Fim de um INSERT que, se a linha já existir (mesma `chave`), soma o valor novo de
+    `coluna` ao atual. MySQL: ON DUPLICATE KEY UPDATE; SQLite: ON CONFLICT (precisa da chave
+    e, em INSERT ... SELECT, de um WHERE no SELECT).
+    """
+    if DB_BACKEND == 'sqlite':
+        return f"ON CONFLICT ({', '.join(chave)}) DO UPDATE SET {coluna} = {tabela}.{coluna} + excluded.{coluna}"
+    return f"ON DUPLICATE KEY UPDATE {coluna} = {tabela}.{coluna} + VALUES({coluna})"
+
+
+class CursorMedido:
+    """Cursor que mede cada execute/executemany para metricas.py; o resto vai direto ao cursor real."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def execute(self, sql, params=None):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            metricas.registrar_sql(sql, time.perf_counter() - inicio)
+
+    def executemany(self, sql, seq_params):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, seq_params)
+        finally:
+            metricas.registrar_sql(sql, time.perf_counter() - inicio)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._cursor.close()
+
+
+class ConexaoPool:
+    """
+    Conexão emprestada do pool. Repassa tudo para a conexão real (PyMySQL ou SQLite),
+    mas close() devolve a conexão ao pool em vez de encerrar o socket,
+    assim as rotas continuam usando o mesmo padrão conn.close() de sempre.
+    Se o close() nunca acontecer (exceção no meio do caminho), a vaga volta ao pool
+    quando o objeto for coletado, e o caso é contado em 'esquecidas'.
+    """
+
+    def __init__(self, pool, bruta, criada_em):
+        self._pool = pool
+        self._bruta = bruta
+        self._criada_em = criada_em
+        self._esquecida = weakref.finalize(self, pool.devolver_esquecida, bruta, criada_em)
+
+    def __getattr__(self, nome):
+        return getattr(self._bruta, nome)
+
+    def cursor(self, *args):
+        cursor = self._bruta.cursor(*args)
+        return CursorMedido(cursor) if metricas.HABILITADO else cursor
+
+    def close(self):
+        # detach() devolve None se a conexão já foi devolvida: close() repetido não faz nada
+        if self._esquecida.detach():
+            self._pool.devolver(self._bruta, self._criada_em)
+
+    def descartar(self):
+        """Fecha o socket em vez de devolver ao pool (ex: leitura sem buffer interrompida no meio)."""
+        if self._esquecida.alive:
+            PoolConexoes._fechar_silencioso(self._bruta)
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PoolConexoes:
+    def __init__(self, fabrica, tamanho=POOL_TAMANHO, espera_max=POOL_ESPERA_MAX,
+                 vida_max=POOL_VIDA_MAX, ping_ociosa=POOL_PING_OCIOSA):
+        self.fabrica = fabrica
+        self.tamanho = max(1, int(tamanho))
+        self.espera_max = espera_max
+        self.vida_max = vida_max
+        self.ping_ociosa = ping_ociosa
+
+        self._cond = threading.Condition()
+        self._livres = deque()   # (conexao, criada_em, devolvida_em)
+        self._abertas = 0
+        self._em_uso = 0
+        self._stats = {
+            'emprestimos': 0, 'criadas': 0, 'recicladas': 0, 'descartadas': 0,
+            'esperas': 0, 'timeouts': 0, 'esquecidas': 0, 'tempo_espera_total': 0.0,
+        }
+
+    def obter(self):
+        inicio = time.monotonic()
+        item = None
+        with self._cond:
+            esperou = False
+            while True:
+                if self._livres:
+                    # LIFO: reaproveita a conexão mais "quente" e deixa as antigas envelhecerem
+                    item = self._livres.pop()
+                    break
+                if self._abertas < self.tamanho:
+                    self._abertas += 1
+                    break
+                restante = self.espera_max - (time.monotonic() - inicio)
+                if restante <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolEsgotado(f"Nenhuma conexão livre após {self.espera_max}s (pool com {self.tamanho}).")
+                esperou = True
+                self._cond.wait(restante)
+
+            self._em_uso += 1
+            self._stats['emprestimos'] += 1
+            if esperou:
+                self._stats['esperas'] += 1
+                self._stats['tempo_espera_total'] += time.monotonic() - inicio
+
+        try:
+            bruta, criada_em = self._validar(item) if item else (None, None)
+            if bruta is None:
+                bruta = self.fabrica()
+                criada_em = time.monotonic()
+                with self._cond:
+                    self._stats['criadas'] += 1
+        except Exception:
+            with self._cond:
+                self._abertas -= 1
+                self._em_uso -= 1
+                self._cond.notify()
+            raise
+
+        return ConexaoPool(self, bruta, criada_em)
+
+    def _validar(self, item):
+        """Health-check no empréstimo: recicla conexões velhas e testa as ociosas."""
+        bruta, criada_em, devolvida_em = item
+        agora = time.monotonic()
+
+        if agora - criada_em > self.vida_max:
+            self._fechar_silencioso(bruta)
+            with self._cond:
+                self._stats['recicladas'] += 1
+            return None, None
+
+        if agora - devolvida_em > self.ping_ociosa:
+            try:
+                bruta.ping(reconnect=False)
+            except Exception:
+                self._fechar_silencioso(bruta)
+                with self._cond:
+                    self._stats['descartadas'] += 1
+                return None, None
+
+        return bruta, criada_em
+
+    def devolver(self, bruta, criada_em):
+        reaproveitar = bool(getattr(bruta, 'open', False))
+
+        if reaproveitar:
+            try:
+                # Nunca devolve ao pool uma transação pela metade (ex: erro antes do commit)
+                if _em_transacao(bruta):
+                    bruta.rollback()
+                if not bruta.get_autocommit():
+                    bruta.autocommit(True)
+            except Exception:
+                reaproveitar = False
+
+        with self._cond:
+            self._em_uso -= 1
+            if reaproveitar:
+                self._livres.append((bruta, criada_em, time.monotonic()))
+            else:
+                self._abertas -= 1
+                self._stats['descartadas'] += 1
+            self._cond.notify()
+
+        if not reaproveitar:
+            self._fechar_silencioso(bruta)
+
+    def devolver_esquecida(self, bruta, criada_em):
+        """Chamada pelo coletor quando uma ConexaoPool some sem close()."""
+        with self._cond:
+            self._stats['esquecidas'] += 1
+        self.devolver(bruta, criada_em)
+
+    def fechar_todas(self):
+        with self._cond:
+            livres = list(self._livres)
+            self._livres.clear()
+            self._abertas -= len(livres)
+        for bruta, _, _ in livres:
+            self._fechar_silencioso(bruta)
+
+    def estatisticas(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'tamanho': self.tamanho,
+                'abertas': self._abertas,
+                'em_uso': self._em_uso,
+                'livres': len(self._livres),
+                'espera_max_s': self.espera_max,
+                'vida_max_s': self.vida_max,
+            })
+        esperas = stats.pop('tempo_espera_total')
+        stats['espera_media_ms'] = round(esperas / stats['esperas'] * 1000, 2) if stats['esperas'] else 0.0
+        return stats
+
+    @staticmethod
+    def _fechar_silencioso(bruta):
+        try:
+            bruta.close()
+        except Exception:
+            pass
+
+
+# --- POOL GLOBAL (criado sob demanda na primeira conexão) ---
+
+_pool = None
+_pool_lock = threading.Lock()
+_config_pool = {}
+
+
+def configurar_pool(**opcoes):
+    """Ajusta o pool antes do primeiro uso (ex: configurar_pool(tamanho=THREADS) no Run.py)."""
+    global _pool
+    with _pool_lock:
+        _config_pool.update(opcoes)
+        if _pool is not None:
+            _pool.fechar_todas()
+            _pool = None
+
+
+def _obter_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                fabrica = _abrir_conexao_sqlite if DB_BACKEND == 'sqlite' else _abrir_conexao_mysql
+                _pool = PoolConexoes(fabrica, **_config_pool)
+    return _pool
+
+
+def obter_conexao():
+    """Empresta uma conexão do pool. Lança exceção em caso de falha."""
+    return _obter_pool().obter()
+
+
+def estatisticas_pool():
+    return _obter_pool().estatisticas()
@@ -0,0 +1,222 @@
+"""
+Banco SQLite embutido (DB_BACKEND=sqlite) para unidades pequenas, testes e benchmarks
+sem servidor MySQL. As rotas continuam escrevendo o SQL do MySQL; esta camada imita
+a parte do PyMySQL que o app usa:
+
+- Parâmetros %s viram ?, e '%%' volta a ser '%' (como o PyMySQL faz quando há parâmetros).
+- DATEDIFF, CURDATE e YEARWEEK são registradas como funções do SQLite.
+- FOR UPDATE é removido: conn.begin() abre BEGIN IMMEDIATE, que já reserva a escrita
+  do arquivo inteiro até o commit (o SQLite só tem um escritor por vez).
+- Linhas voltam como dict; colunas DATE/DATETIME/DECIMAL voltam como date/datetime/Decimal.
+- Upsert e busca textual têm sintaxe própria: veja banco_dados.somar_no_conflito e
+  a busca do dashboard (LIKE em vez de FULLTEXT).
+
+Modo WAL: leitores não bloqueiam o escritor, então as threads do Waitress leem em paralelo
+enquanto uma grava. A estrutura do banco é criada pelo init_db.py.
+"""
+import os
+import re
+import sqlite3
+from decimal import Decimal
+from datetime import date, datetime
+from functools import lru_cache
+
+SQLITE_CAMINHO = os.getenv('DB_SQLITE_CAMINHO', 'database.db')
+SQLITE_ESPERA_MS = int(os.getenv('DB_SQLITE_ESPERA_MS', 5000))     # busy_timeout: espera pelo escritor da vez
+SQLITE_CACHE_MB = int(os.getenv('DB_SQLITE_CACHE_MB', 64))         # Cache de páginas por conexão
+SQLITE_MMAP_MB = int(os.getenv('DB_SQLITE_MMAP_MB', 256))          # Leitura do arquivo via memória mapeada
+
+RE_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\b', re.IGNORECASE)
+
+
+# --- TIPOS (date/datetime/Decimal nos dois sentidos) ---
+
+def _texto(valor):
+    return valor.decode('utf-8') if isinstance(valor, bytes) else str(valor)
+
+
+def _converter_data(valor):
+    texto = _texto(valor)
+    try:
+        return date.fromisoformat(texto[:10])
+    except ValueError:
+        return texto
+
+
+def _converter_data_hora(valor):
+    texto = _texto(valor)
+    try:
+        return datetime.fromisoformat(texto)
+    except ValueError:
+        return texto
+
+
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(' '))
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter('DATE', _converter_data)
+sqlite3.register_converter('DATETIME', _converter_data_hora)
+sqlite3.register_converter('TIMESTAMP', _converter_data_hora)
+sqlite3.register_converter('DECIMAL', lambda v: Decimal(_texto(v)))
+
+
+# --- FUNÇÕES DO MYSQL USADAS PELO APP ---
+
+def _como_dia(valor):
+    if valor is None:
+        return None
+    try:
+        return date.fromisoformat(str(valor)[:10])
+    except ValueError:
+        return None
+
+
+def _datediff(fim, inicio):
+    fim, inicio = _como_dia(fim), _como_dia(inicio)
+    if fim is None or inicio is None:
+        return None
+    return (fim - inicio).days
+
+
+def _yearweek(valor, modo=0):
+    # O app só usa o modo 3 (semana ISO, começando na segunda-feira)
+    dia = _como_dia(valor)
+    if dia is None:
+        return None
+    ano, semana, _ = dia.isocalendar()
+    return ano * 100 + semana
+
+
+def _linha_dict(cursor, linha):
+    return {coluna[0]: valor for coluna, valor in zip(cursor.description, linha)}
+
+
+@lru_cache(maxsize=512)
+def traduzir(sql, com_parametros=True):
+    """SQL do MySQL -> SQLite (placeholders e FOR UPDATE). Em cache: as rotas repetem os mesmos textos."""
+    sql = RE_FOR_UPDATE.sub('', sql)
+    if com_parametros:
+        sql = sql.replace('%%', '\0').replace('%s', '?').replace('\0', '%')
+    return sql
+
+
+class CursorSQLite:
+    def __init__(self, conexao):
+        self.connection = conexao
+        self._cursor = conexao._bruta.cursor()
+
+    def execute(self, sql, params=None):
+        if params is None:
+            self._cursor.execute(traduzir(sql, False))
+        else:
+            self._cursor.execute(traduzir(sql), tuple(params))
+        return self._cursor.rowcount
+
+    def executemany(self, sql, seq_params):
+        self._cursor.executemany(traduzir(sql), [tuple(p) for p in seq_params])
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, tamanho=1):
+        return self._cursor.fetchmany(tamanho)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConexaoSQLite:
+    """Mesma interface da conexão PyMySQL usada pelo pool e pelas rotas (autocommit fora de begin())."""
+
+    def __init__(self, bruta):
+        self._bruta = bruta
+        self.open = True
+
+    def cursor(self, *_):
+        # O tipo de cursor do PyMySQL (ex: SSDictCursor) não se aplica: o SQLite já entrega linha a linha
+        return CursorSQLite(self)
+
+    def begin(self):
+        if self._bruta.in_transaction:
+            self._bruta.execute('COMMIT')     # Igual ao MySQL: BEGIN encerra a transação anterior
+        self._bruta.execute('BEGIN IMMEDIATE')
+
+    def commit(self):
+        if self._bruta.in_transaction:
+            self._bruta.execute('COMMIT')
+
+    def rollback(self):
+        if self._bruta.in_transaction:
+            self._bruta.execute('ROLLBACK')
+
+    def em_transacao(self):
+        return self._bruta.in_transaction
+
+    def get_autocommit(self):
+        return True
+
+    def autocommit(self, valor):
+        pass
+
+    def ping(self, reconnect=False):
+        self._bruta.execute('SELECT 1')
+
+    def close(self):
+        if self.open:
+            self.open = False
+            try:
+                # Atualiza as estatísticas do planejador das tabelas que mudaram bastante
+                self._bruta.execute('PRAGMA optimize')
+            finally:
+                self._bruta.close()
+
+
+def conectar_bruta(caminho=SQLITE_CAMINHO):
+    """Conexão sqlite3 com WAL, pragmas de desempenho e as funções do MySQL registradas."""
+    bruta = sqlite3.connect(caminho, timeout=SQLITE_ESPERA_MS / 1000, isolation_level=None,
+                            check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+    bruta.execute('PRAGMA journal_mode = WAL')
+    # Em WAL, NORMAL não corrompe o banco numa queda de energia; só pode perder os últimos commits
+    bruta.execute('PRAGMA synchronous = NORMAL')
+    bruta.execute('PRAGMA foreign_keys = ON')
+    bruta.execute(f'PRAGMA busy_timeout = {SQLITE_ESPERA_MS}')
+    bruta.execute(f'PRAGMA cache_size = {-SQLITE_CACHE_MB * 1024}')
+    bruta.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}')
+    bruta.execute('PRAGMA temp_store = MEMORY')
+
+    bruta.create_function('DATEDIFF', 2, _datediff, deterministic=True)
+    bruta.create_function('YEARWEEK', 2, _yearweek, deterministic=True)
+    bruta.create_function('YEARWEEK', 1, _yearweek, deterministic=True)
+    bruta.create_function('CURDATE', 0, lambda: date.today().isoformat())
+    return bruta
+
+
+def abrir_conexao(caminho=SQLITE_CAMINHO):
+    bruta = conectar_bruta(caminho)
+    bruta.row_factory = _linha_dict
+    return ConexaoSQLite(bruta)
@@ -0,0 +1,115 @@
+"""
+Compara o OCR com e sem pré-processamento das imagens (tempo por página e acerto).
+
+Coloque PDFs digitalizados em benchmarks/ocr/ (não versionados: costumam ter dados
+reais). Para medir acerto, crie ao lado um <nome>.json no mesmo formato do corpus
+do parser ({"dados": {...}, "itens": [...]}); sem ele só o tempo é medido.
+
+Uso:
+    python benchmarks/benchmark_ocr.py [--pasta benchmarks/ocr] [--dpi 300 --janela 15 --offset 12 --recorte 0,0,1,1]
+
+Precisa do Tesseract-OCR na pasta do sistema (o mesmo do servidor): rode a partir
+da raiz do projeto.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import ocr_worker
+import parser_solicitacao
+from benchmark_parser import comparar
+
+PASTA_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ocr')
+
+
+def medir(paginas, config):
+    """Devolve (texto, segundos por página, segundos de pré-processamento por página)."""
+    texto = ""
+    tempo_preparo = 0.0
+    inicio = time.perf_counter()
+    for pagina in paginas:
+        for dados in pagina['imagens']:
+            imagem = Image.open(BytesIO(dados))
+            if config['ativo']:
+                t = time.perf_counter()
+                imagem = ocr_worker.preprocessar_imagem(imagem, pagina['largura_pol'], config)
+                tempo_preparo += time.perf_counter() - t
+                texto += ocr_worker.pytesseract.image_to_string(imagem, lang='por', config=f"--dpi {config['dpi_alvo']}") + "\n"
+            else:
+                texto += ocr_worker.pytesseract.image_to_string(imagem, lang='por') + "\n"
+    quantidade = max(1, len(paginas))
+    return texto, (time.perf_counter() - inicio) / quantidade, tempo_preparo / quantidade
+
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument('--pasta', default=PASTA_PADRAO)
+    argumentos.add_argument('--dpi', type=int, default=ocr_worker.CONFIG_PREPROCESSAMENTO['dpi_alvo'])
+    argumentos.add_argument('--janela', type=int, default=ocr_worker.CONFIG_PREPROCESSAMENTO['limiar_janela'])
+    argumentos.add_argument('--offset', type=int, default=ocr_worker.CONFIG_PREPROCESSAMENTO['limiar_offset'])
+    argumentos.add_argument('--recorte', default=ocr_worker.CONFIG_PREPROCESSAMENTO['recorte'])
+    opcoes = argumentos.parse_args()
+
+    if not ocr_worker.HAS_OCR:
+        print("Tesseract não disponível.")
+        return 1
+    if not os.path.isdir(opcoes.pasta):
+        print(f"Pasta {opcoes.pasta} não encontrada: coloque PDFs digitalizados nela.")
+        return 1
+
+    configs = {
+        'sem pré-processamento': dict(ocr_worker.CONFIG_PREPROCESSAMENTO, ativo=False),
+        'com pré-processamento': dict(ocr_worker.CONFIG_PREPROCESSAMENTO, ativo=True, dpi_alvo=opcoes.dpi,
+                                      limiar_janela=opcoes.janela, limiar_offset=opcoes.offset,
+                                      recorte=opcoes.recorte),
+    }
+    totais = {nome: {'tempo': 0.0, 'preparo': 0.0, 'certos': 0, 'campos': 0} for nome in configs}
+
+    pdfs = sorted(n for n in os.listdir(opcoes.pasta) if n.lower().endswith('.pdf'))
+    for nome_pdf in pdfs:
+        base = os.path.join(opcoes.pasta, nome_pdf[:-4])
+        with open(base + '.pdf', 'rb') as f:
+            paginas = [p for p in ocr_worker.imagens_por_pagina(f.read())[0] if p['imagens']]
+        esperado = None
+        if os.path.exists(base + '.json'):
+            with open(base + '.json', encoding='utf-8') as f:
+                esperado = json.load(f)
+
+        print(f"📄 {nome_pdf} ({len(paginas)} página(s))")
+        for nome, config in configs.items():
+            texto, por_pagina, preparo = medir(paginas, config)
+            totais[nome]['tempo'] += por_pagina
+            totais[nome]['preparo'] += preparo
+            linha = f"   {nome:<24} {por_pagina:6.2f} s/página"
+            if config['ativo']:
+                linha += f" (pré-processamento {preparo:.2f} s)"
+            if esperado:
+                certos, campos, _ = comparar(parser_solicitacao.interpretar(texto, texto), esperado)
+                totais[nome]['certos'] += certos
+                totais[nome]['campos'] += campos
+                linha += f" | acerto {certos}/{campos}"
+            print(linha)
+
+    if not pdfs:
+        print("Nenhum PDF na pasta.")
+        return 1
+
+    print("-" * 60)
+    for nome, t in totais.items():
+        acerto = f"{100.0 * t['certos'] / t['campos']:.1f}%" if t['campos'] else "sem gabarito"
+        print(f"{nome:<24} média {t['tempo'] / len(pdfs):6.2f} s/página | acerto {acerto}")
+    base, novo = totais['sem pré-processamento']['tempo'], totais['com pré-processamento']['tempo']
+    if novo:
+        print(f"Ganho: {base / novo:.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Mede velocidade e acerto do parser_solicitacao sobre o corpus de exemplo.
+
+Cada documento em benchmarks/solicitacoes/ tem:
+    <nome>.txt         texto extraído (page.extract_text ou saída do OCR)
+    <nome>.layout.txt  texto com layout (opcional; sem ele o texto é usado, como no OCR)
+    <nome>.pdf         alternativa aos .txt: o PDF exportado do ERP
+    <nome>.json        resultado esperado: {"dados": {...}, "itens": [...]}
+
+Uso:
+    python benchmarks/benchmark_parser.py [--repeticoes 500] [--pasta benchmarks/solicitacoes]
+
+Quando o layout do ERP mudar, adicione um exemplo novo com o .json esperado e
+rode de novo: o acerto mostra o que quebrou e docs/s mostra se ficou mais lento.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser_solicitacao
+
+PASTA_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'solicitacoes')
+
+
+def _ler(caminho):
+    with open(caminho, encoding='utf-8') as f:
+        return f.read()
+
+
+def carregar_corpus(pasta):
+    """Lista de (nome, texto, texto_layout, esperado)."""
+    corpus = []
+    for nome_arquivo in sorted(os.listdir(pasta)):
+        if not nome_arquivo.endswith('.json'):
+            continue
+        nome = nome_arquivo[:-5]
+        base = os.path.join(pasta, nome)
+        esperado = json.loads(_ler(base + '.json'))
+
+        if os.path.exists(base + '.txt'):
+            texto = _ler(base + '.txt')
+            texto_layout = _ler(base + '.layout.txt') if os.path.exists(base + '.layout.txt') else texto
+        elif os.path.exists(base + '.pdf'):
+            with open(base + '.pdf', 'rb') as f:
+                texto, texto_layout = parser_solicitacao.ler_texto_pdf(f.read())
+        else:
+            print(f"⚠️ {nome}: sem .txt nem .pdf, ignorado.")
+            continue
+        corpus.append((nome, texto, texto_layout, esperado))
+    return corpus
+
+
+def comparar(resultado, esperado):
+    """Devolve (campos certos, campos avaliados, lista de diferenças)."""
+    obtidos = resultado.dados_formulario()
+    dados_esperados = esperado.get('dados', {})
+    diferencas = []
+    certos = 0
+    total = 0
+
+    for campo in sorted(set(obtidos) | set(dados_esperados)):
+        total += 1
+        if obtidos.get(campo) == dados_esperados.get(campo):
+            certos += 1
+        else:
+            diferencas.append(f"{campo}: esperado {dados_esperados.get(campo)!r}, obtido {obtidos.get(campo)!r}")
+
+    itens_obtidos = resultado.itens_formulario()
+    itens_esperados = esperado.get('itens', [])
+    for i in range(max(len(itens_obtidos), len(itens_esperados))):
+        total += 1
+        obtido = itens_obtidos[i] if i < len(itens_obtidos) else None
+        item_esperado = itens_esperados[i] if i < len(itens_esperados) else None
+        if obtido == item_esperado:
+            certos += 1
+        else:
+            diferencas.append(f"item {i + 1}: esperado {item_esperado}, obtido {obtido}")
+
+    return certos, total, diferencas
+
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos.add_argument('--pasta', default=PASTA_PADRAO)
+    argumentos.add_argument('--repeticoes', type=int, default=500)
+    opcoes = argumentos.parse_args()
+
+    corpus = carregar_corpus(opcoes.pasta)
+    if not corpus:
+        print("Nenhum documento no corpus.")
+        return 1
+
+    # 1. ACERTO
+    total_certos = total_campos = docs_perfeitos = 0
+    for nome, texto, texto_layout, esperado in corpus:
+        certos, total, diferencas = comparar(parser_solicitacao.interpretar(texto, texto_layout), esperado)
+        total_certos += certos
+        total_campos += total
+        if diferencas:
+            print(f"❌ {nome} ({certos}/{total})")
+            for diferenca in diferencas:
+                print(f"     {diferenca}")
+        else:
+            docs_perfeitos += 1
+            print(f"✅ {nome} ({certos}/{total})")
+
+    # 2. VELOCIDADE (só o parser; a extração do PDF não entra na conta)
+    inicio = time.perf_counter()
+    for _ in range(opcoes.repeticoes):
+        for _, texto, texto_layout, _ in corpus:
+            parser_solicitacao.interpretar(texto, texto_layout)
+    duracao = time.perf_counter() - inicio
+    documentos = opcoes.repeticoes * len(corpus)
+
+    print("-" * 60)
+    print(f"Documentos: {len(corpus)} | perfeitos: {docs_perfeitos}")
+    print(f"Acerto por campo/item: {100.0 * total_certos / total_campos:.1f}% ({total_certos}/{total_campos})")
+    print(f"Velocidade: {documentos / duracao:,.0f} docs/s ({1e6 * duracao / documentos:.1f} µs/doc)")
+    return 0 if docs_perfeitos == len(corpus) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
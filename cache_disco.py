@@ -0,0 +1,113 @@
+"""
+Cache em disco com limite de tamanho e de quantidade de arquivos (LRU).
+
+Base do cache de texto das importações (cache_importacao.py) e das miniaturas
+de anexos (miniaturas.py).
+
+- Arquivos em <pasta>/<2 primeiros hex da chave>/<chave><extensão>
+- LRU pelo horário de modificação: cada acerto "toca" o arquivo; quando o total
+  passa de max_bytes ou de max_itens, os menos usados são removidos.
+"""
+import os
+import threading
+
+
+class CacheDisco:
+    EXTENSAO = ''
+
+    def __init__(self, pasta, max_bytes, max_itens):
+        self.pasta = pasta
+        self.max_bytes = max_bytes
+        self.max_itens = max_itens
+        self._lock = threading.Lock()
+        self._tamanho = None    # (bytes, itens) em disco; calculado no primeiro uso
+
+    def _caminho(self, chave):
+        return os.path.join(self.pasta, chave[:2], f"{chave}{self.EXTENSAO}")
+
+    def caminho_existente(self, chave):
+        """Devolve o caminho do arquivo em cache (marcando-o como usado) ou None."""
+        caminho = self._caminho(chave)
+        try:
+            os.utime(caminho)   # Marca como usado agora (LRU)
+            return caminho
+        except OSError:
+            return None
+
+    def ler(self, chave):
+        caminho = self.caminho_existente(chave)
+        if caminho is None:
+            return None
+        try:
+            with open(caminho, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def gravar(self, chave, conteudo):
+        """Grava os bytes de forma atômica e despeja os menos usados se passar dos limites. Devolve o caminho."""
+        caminho = self._caminho(chave)
+        with self._lock:
+            self._medir()
+            existente = os.path.getsize(caminho) if os.path.exists(caminho) else None
+
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            temporario = f"{caminho}.{threading.get_ident()}.tmp"
+            with open(temporario, 'wb') as f:
+                f.write(conteudo)
+            os.replace(temporario, caminho)
+
+            tamanho, itens = self._tamanho
+            if existente is None:
+                self._tamanho = (tamanho + len(conteudo), itens + 1)
+            else:
+                self._tamanho = (tamanho + len(conteudo) - existente, itens)
+
+            if self._tamanho[0] > self.max_bytes or self._tamanho[1] > self.max_itens:
+                self._despejar()
+        return caminho
+
+    def _entradas(self):
+        entradas = []
+        for raiz, _, nomes in os.walk(self.pasta):
+            for nome in nomes:
+                if not nome.endswith(self.EXTENSAO) or nome.endswith('.tmp'):
+                    continue
+                caminho = os.path.join(raiz, nome)
+                try:
+                    info = os.stat(caminho)
+                except OSError:
+                    continue
+                entradas.append((info.st_mtime, info.st_size, caminho))
+        return entradas
+
+    def _medir(self):
+        # Chamado com self._lock adquirido
+        if self._tamanho is None:
+            entradas = self._entradas()
+            self._tamanho = (sum(e[1] for e in entradas), len(entradas))
+
+    def _despejar(self):
+        """Remove os menos usados até ficar em 90% dos limites (evita despejar a cada gravação)."""
+        entradas = sorted(self._entradas())
+        tamanho = sum(e[1] for e in entradas)
+        itens = len(entradas)
+        for _, tamanho_arquivo, caminho in entradas:
+            if tamanho <= self.max_bytes * 0.9 and itens <= self.max_itens * 0.9:
+                break
+            try:
+                os.remove(caminho)
+            except OSError:
+                continue
+            tamanho -= tamanho_arquivo
+            itens -= 1
+        self._tamanho = (tamanho, itens)
+
+    def limpar(self):
+        with self._lock:
+            for _, _, caminho in self._entradas():
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+            self._tamanho = (0, 0)
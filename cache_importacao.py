@@ -0,0 +1,56 @@
+"""
+Cache em disco do texto extraído dos PDFs importados, por conteúdo (SHA-256).
+
+Comprador que reenvia a mesma solicitação não paga de novo o pdfplumber nem o
+Tesseract: o texto (e o texto com layout) fica guardado pelo hash dos bytes do
+arquivo. O parser roda de novo a cada importação (é barato), então melhorias nele
+valem também para arquivos já em cache.
+
+- Arquivos em <pasta>/<2 primeiros hex>/<hash>.json, com despejo LRU (cache_disco.py).
+"""
+import os
+import json
+import hashlib
+
+from cache_disco import CacheDisco
+
+PASTA_CACHE_IMPORTACAO = os.getenv('IMPORTACAO_CACHE_PASTA', 'cache_importacao')
+IMPORTACAO_CACHE_MAX_MB = int(os.getenv('IMPORTACAO_CACHE_MAX_MB', 200))
+IMPORTACAO_CACHE_MAX_ITENS = int(os.getenv('IMPORTACAO_CACHE_MAX_ITENS', 5000))
+
+# Aumente quando a extração mudar (ex.: pré-processamento do OCR): entradas antigas deixam de valer
+VERSAO_EXTRACAO = 1
+
+
+def hash_arquivo(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+class CacheImportacao(CacheDisco):
+    EXTENSAO = '.json'
+
+    def __init__(self, pasta=PASTA_CACHE_IMPORTACAO, max_bytes=IMPORTACAO_CACHE_MAX_MB * 1024 * 1024,
+                 max_itens=IMPORTACAO_CACHE_MAX_ITENS, versao=VERSAO_EXTRACAO):
+        super().__init__(pasta, max_bytes, max_itens)
+        self.versao = versao
+
+    def _chave(self, hash_conteudo):
+        return hashlib.sha256(f"{self.versao}|{hash_conteudo}".encode('utf-8')).hexdigest()
+
+    def obter(self, hash_conteudo):
+        """Devolve {'texto', 'layout', 'origem'} ou None."""
+        conteudo = self.ler(self._chave(hash_conteudo))
+        if conteudo is None:
+            return None
+        try:
+            return json.loads(conteudo.decode('utf-8'))
+        except ValueError:
+            return None
+
+    def contem(self, hash_conteudo):
+        """Só confere se o arquivo existe (sem ler o JSON)."""
+        return self.caminho_existente(self._chave(hash_conteudo)) is not None
+
+    def guardar(self, hash_conteudo, texto, layout, origem):
+        conteudo = json.dumps({'texto': texto, 'layout': layout, 'origem': origem}, ensure_ascii=False).encode('utf-8')
+        self.gravar(self._chave(hash_conteudo), conteudo)
@@ -0,0 +1,49 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class CacheTTL:
+    """
+    Cache em memória, seguro entre as threads do Waitress.
+    Cada valor expira após `ttl` segundos; acima de `max_itens` descarta o menos usado.
+    Um valor calculado enquanto alguém chamava invalidar() não é guardado (pode ser anterior à escrita).
+    """
+
+    def __init__(self, ttl, max_itens=256):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+        self._geracao = 0   # Sobe a cada invalidar()
+
+    def obter(self, chave, calcular):
+        """Devolve o valor em cache ou chama calcular() e guarda o resultado."""
+        agora = time.monotonic()
+        with self._lock:
+            item = self._dados.get(chave)
+            if item and item[0] > agora:
+                self._dados.move_to_end(chave)
+                return item[1]
+            geracao = self._geracao
+
+        # Calcula fora do lock para não travar as outras threads durante a consulta
+        valor = calcular()
+
+        with self._lock:
+            if geracao != self._geracao:
+                return valor
+            self._dados[chave] = (time.monotonic() + self.ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+        return valor
+
+    def invalidar(self, chave=None):
+        """Remove uma chave específica ou, sem argumento, limpa tudo."""
+        with self._lock:
+            self._geracao += 1
+            if chave is None:
+                self._dados.clear()
+            else:
+                self._dados.pop(chave, None)
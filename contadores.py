@@ -0,0 +1,238 @@
+"""
+Contadores de pedidos por (unidade, comprador, status, faixa de prazo).
+
+Mantidos a cada escrita de pedido (nova_compra, editar_pedido, excluir_pedido) dentro
+da mesma transação, para que os cards "Totais / Abertos / Atrasados", o gráfico de
+status e o volume por comprador sejam lidos de uma tabela minúscula em vez de varrer
+acompanhamento_compras.
+
+A faixa de prazo é a data prevista (reprogramada ou prazo) em 'AAAA-MM-DD',
+'SEM_PRAZO' ou 'VENCIDO'. Uma vez por dia as datas que já chegaram são somadas
+na faixa 'VENCIDO' (rolar_vencidos), então "atrasados" é só a faixa VENCIDO.
+
+Uso pela linha de comando:
+    python contadores.py --reconstruir
+"""
+import sys
+import threading
+from datetime import date, datetime
+
+import banco_dados
+import situacao
+
+FAIXA_SEM_PRAZO = 'SEM_PRAZO'
+FAIXA_VENCIDO = 'VENCIDO'
+
+CHAVE_CONTADOR = ('codi_empresa', 'id_comprador', 'status_compra', 'faixa_prazo')
+SOMAR_QTD = banco_dados.somar_no_conflito('contadores_pedidos', CHAVE_CONTADOR, 'qtd')
+
+_rollover_lock = threading.Lock()
+_ultimo_rollover = None
+
+
+def _como_data(valor):
+    if not valor:
+        return None
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    try:
+        return datetime.strptime(str(valor)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def faixa_prazo(pedido, hoje=None):
+    hoje = hoje or date.today()
+    prevista = _como_data(pedido.get('data_entrega_reprogramada')) or _como_data(pedido.get('prazo_entrega'))
+    if prevista is None:
+        return FAIXA_SEM_PRAZO
+    # Mesma regra do dashboard: vence no dia (dias <= 0) já conta como atrasado
+    if prevista <= hoje:
+        return FAIXA_VENCIDO
+    return prevista.isoformat()
+
+
+def chave_contador(pedido, hoje=None):
+    return (
+        int(pedido['codi_empresa']),
+        int(pedido.get('id_comprador_responsavel') or 0),
+        pedido['status_compra'] or '',
+        faixa_prazo(pedido, hoje),
+    )
+
+
+def _somar(cursor, chave, delta):
+    cursor.execute(f'''
+        INSERT INTO contadores_pedidos (codi_empresa, id_comprador, status_compra, faixa_prazo, qtd)
+        VALUES (%s, %s, %s, %s, %s)
+        {SOMAR_QTD}
+    ''', chave + (delta,))
+
+
+def registrar(cursor, antes, depois):
+    """
+    Aplica a mudança de um pedido nos contadores. `antes`/`depois` são as linhas de
+    acompanhamento_compras (None em criação/exclusão). Chamar dentro da transação da escrita.
+    """
+    hoje = date.today()
+    garantir_rollover(cursor, hoje, em_transacao=True)
+
+    chave_antes = chave_contador(antes, hoje) if antes else None
+    chave_depois = chave_contador(depois, hoje) if depois else None
+    if chave_antes == chave_depois:
+        return
+    if chave_antes:
+        _somar(cursor, chave_antes, -1)
+    if chave_depois:
+        _somar(cursor, chave_depois, 1)
+
+
+def rolar_vencidos(cursor, hoje):
+    """Move para a faixa VENCIDO tudo que tem data prevista até hoje."""
+    cursor.execute(f'''
+        INSERT INTO contadores_pedidos (codi_empresa, id_comprador, status_compra, faixa_prazo, qtd)
+        SELECT codi_empresa, id_comprador, status_compra, %s, total FROM (
+            SELECT codi_empresa, id_comprador, status_compra, SUM(qtd) AS total
+            FROM contadores_pedidos
+            WHERE faixa_prazo NOT IN (%s, %s) AND faixa_prazo <= %s
+            GROUP BY codi_empresa, id_comprador, status_compra
+        ) vencidos
+        WHERE total <> 0
+        {SOMAR_QTD}
+    ''', (FAIXA_VENCIDO, FAIXA_VENCIDO, FAIXA_SEM_PRAZO, hoje.isoformat()))
+    cursor.execute('''
+        DELETE FROM contadores_pedidos
+        WHERE (faixa_prazo NOT IN (%s, %s) AND faixa_prazo <= %s) OR qtd = 0
+    ''', (FAIXA_VENCIDO, FAIXA_SEM_PRAZO, hoje.isoformat()))
+
+
+def garantir_rollover(cursor, hoje=None, em_transacao=False):
+    """
+    Roda rolar_vencidos no máximo uma vez por dia neste processo (a operação é idempotente).
+
+    Com em_transacao=True (dentro da escrita de um pedido) o dia não é marcado como feito:
+    se a escrita for desfeita, o rollover some junto. Só a chamada com commit próprio
+    (ler_resumo, no próximo dashboard) marca o dia; até lá as escritas repetem a operação.
+    """
+    global _ultimo_rollover
+    hoje = hoje or date.today()
+    if _ultimo_rollover == hoje:
+        return
+    if em_transacao:
+        rolar_vencidos(cursor, hoje)
+        return
+    with _rollover_lock:
+        if _ultimo_rollover == hoje:
+            return
+        conn = cursor.connection
+        conn.begin()
+        try:
+            rolar_vencidos(cursor, hoje)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        _ultimo_rollover = hoje
+
+
+def ler_resumo(cursor, codi_empresa=None, id_comprador=None, status=None):
+    """
+    KPIs, distribuição por status e pedidos em aberto por comprador lidos dos contadores.
+    Mesmo formato devolvido por app.agregar_dashboard.
+    """
+    garantir_rollover(cursor)
+
+    conds = []
+    params = []
+    if codi_empresa:
+        conds.append("ct.codi_empresa = %s")
+        params.append(codi_empresa)
+    if id_comprador:
+        conds.append("ct.id_comprador = %s")
+        params.append(id_comprador)
+    if status:
+        conds.append("ct.status_compra = %s")
+        params.append(status)
+    where = "WHERE " + " AND ".join(conds) if conds else ""
+
+    cursor.execute(f'''
+        SELECT ct.status_compra, ct.faixa_prazo, ct.id_comprador, u.nome_completo, ct.qtd
+        FROM contadores_pedidos ct
+        LEFT JOIN usuarios u ON u.id = ct.id_comprador
+        {where}
+    ''', params)
+
+    kpis = {'total': 0, 'abertos': 0, 'atrasados': 0}
+    por_status = {}
+    por_comprador = {}
+    for r in cursor.fetchall():
+        qtd = int(r['qtd'])
+        if not qtd:
+            continue
+        kpis['total'] += qtd
+        por_status[r['status_compra']] = por_status.get(r['status_compra'], 0) + qtd
+        if situacao.em_aberto(r['status_compra']):
+            kpis['abertos'] += qtd
+            if r['faixa_prazo'] == FAIXA_VENCIDO:
+                kpis['atrasados'] += qtd
+            por_comprador[r['nome_completo']] = por_comprador.get(r['nome_completo'], 0) + qtd
+
+    return {
+        'kpis': kpis,
+        'status': [{'chave': k, 'qtd': v} for k, v in por_status.items()],
+        'compradores': [{'chave': k, 'qtd': v} for k, v in por_comprador.items()],
+    }
+
+
+def reconstruir(conn):
+    """
+    Recalcula todos os contadores a partir de acompanhamento_compras (carga inicial ou reparo).
+
+    O DELETE vem antes da leitura, na mesma transação: ele trava as linhas (e os intervalos)
+    de contadores_pedidos, então um pedido gravado durante a reconstrução espera o COMMIT
+    para somar o seu contador, e um gravado antes já aparece na leitura.
+    """
+    hoje = date.today()
+    cursor = conn.cursor()
+    conn.begin()
+    try:
+        cursor.execute('DELETE FROM contadores_pedidos')
+        cursor.execute('''
+            SELECT codi_empresa, id_comprador_responsavel, status_compra,
+                   data_entrega_reprogramada, prazo_entrega, COUNT(*) AS qtd
+            FROM acompanhamento_compras
+            GROUP BY codi_empresa, id_comprador_responsavel, status_compra,
+                     data_entrega_reprogramada, prazo_entrega
+        ''')
+        totais = {}
+        for r in cursor.fetchall():
+            chave = chave_contador(r, hoje)
+            totais[chave] = totais.get(chave, 0) + int(r['qtd'])
+
+        if totais:
+            cursor.executemany('''
+                INSERT INTO contadores_pedidos (codi_empresa, id_comprador, status_compra, faixa_prazo, qtd)
+                VALUES (%s, %s, %s, %s, %s)
+            ''', [chave + (qtd,) for chave, qtd in totais.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(totais)
+
+
+if __name__ == '__main__':
+    if '--reconstruir' not in sys.argv:
+        print("Uso: python contadores.py --reconstruir")
+        sys.exit(1)
+
+    conn = banco_dados.obter_conexao()
+    try:
+        linhas = reconstruir(conn)
+        print(f"✅ Contadores reconstruídos ({linhas} combinações).")
+    finally:
+        conn.close()
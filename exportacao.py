@@ -0,0 +1,251 @@
+"""
+Exportação da lista de pedidos (com itens) em CSV ou XLSX, em fluxo.
+
+- A consulta roda num cursor sem buffer (SSDictCursor): o MySQL manda as linhas conforme
+  são lidas, então a memória do worker não cresce com o tamanho do resultado.
+- Os geradores devolvem pedaços de bytes de ~64 KB para um Response do Flask, e o
+  download começa assim que as primeiras linhas chegam.
+- O XLSX é montado à mão (zip + SpreadsheetML mínimo) porque o xlsxwriter/openpyxl só
+  entregam o arquivo depois da última linha. O zipfile do Python aceita saída sem seek.
+"""
+import os
+import io
+import re
+import csv
+import zipfile
+from decimal import Decimal
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+
+import pymysql.cursors
+
+import banco_dados
+
+# O MySQL desiste de enviar se o cliente ficar parado mais que net_write_timeout (padrão 60 s);
+# aqui o "cliente" é o navegador baixando, então a sessão da exportação ganha folga.
+EXPORTACAO_NET_WRITE_TIMEOUT = int(os.getenv('EXPORTACAO_NET_WRITE_TIMEOUT', 600))
+TAMANHO_PEDACO = 64 * 1024
+LINHAS_POR_LEITURA = 1000
+
+# (título da coluna, chave na linha do SELECT)
+COLUNAS = [
+    ('ID', 'id'),
+    ('Nº Solicitação', 'numero_solicitacao'),
+    ('Data Registro', 'data_registro'),
+    ('Unidade', 'nome_empresa'),
+    ('Orçamento', 'numero_orcamento'),
+    ('Pedido', 'numero_pedido'),
+    ('Título', 'item_comprado'),
+    ('Categoria', 'categoria'),
+    ('Fornecedor', 'fornecedor'),
+    ('Situação', 'status_compra'),
+    ('Comprador', 'nome_comprador'),
+    ('Solicitante', 'solicitante_real'),
+    ('Data Compra', 'data_compra'),
+    ('Prazo', 'prazo_entrega'),
+    ('Prazo Reprogramado', 'data_entrega_reprogramada'),
+    ('Data Entrega', 'data_entrega_real'),
+    ('Nota Fiscal', 'nota_fiscal'),
+    ('Série', 'serie_nota'),
+    ('Valor Total Pedido', 'valor_total'),
+    ('Item', 'nome_item'),
+    ('Qtd', 'quantidade'),
+    ('Unid', 'unidade_medida'),
+    ('Valor Unitário', 'valor_unitario'),
+]
+
+
+def linhas_pedidos(conn, filtros):
+    """
+    Gera uma linha por item (pedidos sem itens saem uma vez, com as colunas de item vazias),
+    aplicando os mesmos filtros do dashboard (montar_filtros_dashboard). A conexão fica
+    ocupada até o fim da leitura: não use outro cursor nela enquanto o gerador estiver aberto.
+    """
+    mysql = banco_dados.DB_BACKEND == 'mysql'
+    cursor = conn.cursor(pymysql.cursors.SSDictCursor)     # No SQLite todo cursor já lê sob demanda
+    if mysql:
+        cursor.execute('SET SESSION net_write_timeout = %s', (EXPORTACAO_NET_WRITE_TIMEOUT,))
+    cursor.execute(f'''
+        SELECT c.id, c.numero_solicitacao, c.data_registro, e.nome_empresa, c.numero_orcamento, c.numero_pedido,
+               c.item_comprado, c.categoria, c.fornecedor, c.status_compra, u2.nome_completo AS nome_comprador,
+               c.solicitante_real, c.data_compra, c.prazo_entrega, c.data_entrega_reprogramada, c.data_entrega_real,
+               c.nota_fiscal, c.serie_nota, c.valor_total,
+               i.nome_item, i.quantidade, i.unidade_medida, i.valor_unitario
+        {filtros['sql_joins']}
+        LEFT JOIN pedidos_itens i ON i.pedido_id = c.id
+        {filtros['where_clause']}
+        ORDER BY c.id DESC, i.id
+    ''', filtros['params'])
+    while True:
+        lote = cursor.fetchmany(LINHAS_POR_LEITURA)
+        if not lote:
+            break
+        yield from lote
+    # Sem try/finally de propósito: se o download for interrompido, fechar o cursor leria o
+    # resto do resultado do servidor. Quem chamou descarta a conexão (ConexaoPool.descartar).
+    if mysql:
+        cursor.execute('SET SESSION net_write_timeout = DEFAULT')
+    cursor.close()
+
+
+# --- CSV ---
+
+# Texto que começa com estes caracteres vira fórmula ao abrir o CSV no Excel (CSV injection)
+_INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _valor_csv(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return valor.strftime('%d/%m/%Y %H:%M')
+    if isinstance(valor, date):
+        return valor.strftime('%d/%m/%Y')
+    if isinstance(valor, (Decimal, float)):
+        # Planilha em português: vírgula decimal (o separador de campo é ';')
+        return f'{valor:.2f}'.replace('.', ',')
+    if isinstance(valor, str) and valor.startswith(_INICIO_FORMULA):
+        # O apóstrofo faz o Excel tratar a célula como texto (o XLSX já grava texto em inlineStr)
+        return "'" + valor
+    return valor
+
+
+def gerar_csv(linhas):
+    """CSV com ';' e BOM UTF-8, como o Excel em português espera."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    escritor.writerow([titulo for titulo, _ in COLUNAS])
+    for linha in linhas:
+        escritor.writerow([_valor_csv(linha.get(chave)) for _, chave in COLUNAS])
+        if buffer.tell() >= TAMANHO_PEDACO:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+# --- XLSX ---
+
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_NS_PLANILHA = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_NS_DOC = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+_PARTES_FIXAS = {
+    '[Content_Types].xml': _XML + (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'),
+    '_rels/.rels': _XML + (
+        f'<Relationships xmlns="{_NS_REL}">'
+        f'<Relationship Id="rId1" Type="{_NS_DOC}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': _XML + (
+        f'<workbook xmlns="{_NS_PLANILHA}" xmlns:r="{_NS_DOC}">'
+        '<sheets><sheet name="Pedidos" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'),
+    'xl/_rels/workbook.xml.rels': _XML + (
+        f'<Relationships xmlns="{_NS_REL}">'
+        f'<Relationship Id="rId1" Type="{_NS_DOC}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{_NS_DOC}/styles" Target="styles.xml"/>'
+        '</Relationships>'),
+    # Estilos: 0 = padrão, 1 = data (numFmt 14), 2 = data e hora (numFmt 22), 3 = moeda (numFmt 4: #,##0.00)
+    'xl/styles.xml': _XML + (
+        f'<styleSheet xmlns="{_NS_PLANILHA}">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="5">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '</cellXfs>'
+        '</styleSheet>'),
+}
+
+# Caracteres de controle são proibidos no XML (aparecem em texto vindo de OCR/planilhas)
+_RE_CONTROLE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_EPOCA_EXCEL = datetime(1899, 12, 30)
+_MAX_TEXTO_CELULA = 32767
+
+
+class _SaidaFluxo:
+    """Arquivo só de escrita que acumula bytes até o gerador recolhê-los (sem seek/tell)."""
+
+    def __init__(self):
+        self._partes = []
+        self.tamanho = 0
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self.tamanho += len(dados)
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def recolher(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        self.tamanho = 0
+        return dados
+
+
+def _celula_xlsx(valor, estilo_texto=''):
+    if valor is None or valor == '':
+        return '<c/>'
+    if isinstance(valor, bool):
+        valor = int(valor)
+    if isinstance(valor, datetime):
+        serial = (valor - _EPOCA_EXCEL).total_seconds() / 86400
+        return f'<c s="2"><v>{serial:.6f}</v></c>'
+    if isinstance(valor, date):
+        return f'<c s="1"><v>{(valor - _EPOCA_EXCEL.date()).days}</v></c>'
+    if isinstance(valor, (Decimal, float)):
+        return f'<c s="3"><v>{valor}</v></c>'
+    if isinstance(valor, int):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_RE_CONTROLE.sub('', str(valor))[:_MAX_TEXTO_CELULA])
+    return f'<c t="inlineStr"{estilo_texto}><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def gerar_xlsx(linhas):
+    saida = _SaidaFluxo()
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo:
+        for nome, conteudo in _PARTES_FIXAS.items():
+            arquivo.writestr(nome, conteudo)
+        yield saida.recolher()
+
+        with arquivo.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilha:
+            cabecalho = ''.join(_celula_xlsx(titulo, ' s="4"') for titulo, _ in COLUNAS)
+            planilha.write((_XML + f'<worksheet xmlns="{_NS_PLANILHA}"><sheetViews><sheetView workbookViewId="0">'
+                            '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+                            f'<sheetData><row>{cabecalho}</row>').encode('utf-8'))
+            pendente = []
+            tamanho_pendente = 0
+            for linha in linhas:
+                xml = '<row>' + ''.join(_celula_xlsx(linha.get(chave)) for _, chave in COLUNAS) + '</row>'
+                pendente.append(xml)
+                tamanho_pendente += len(xml)
+                if tamanho_pendente >= TAMANHO_PEDACO:
+                    planilha.write(''.join(pendente).encode('utf-8'))
+                    pendente = []
+                    tamanho_pendente = 0
+                    if saida.tamanho:
+                        yield saida.recolher()
+            planilha.write((''.join(pendente) + '</sheetData></worksheet>').encode('utf-8'))
+    yield saida.recolher()
+
+
+FORMATOS = {
+    'csv': (gerar_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (gerar_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
@@ -0,0 +1,230 @@
+"""
+Tabela de fatos diária para a tela /performance e o relatório em PDF.
+
+Uma linha por (dia de registro, unidade, fornecedor) com somas e contagens:
+lead time, OTIF, valor em aberto e atrasos podem ser combinados para qualquer
+intervalo inicio/fim somando poucas linhas, sem varrer pedidos e itens.
+
+- Edição de pedido: atualizar_dias() recalcula só os dias afetados.
+- Atrasos dependem da data de hoje: uma vez por dia os dias que têm pedidos
+  abertos com prazo vencido são recalculados (garantir_atualizacao_diaria).
+
+Uso pela linha de comando:
+    python fatos_performance.py --reconstruir
+"""
+import sys
+import threading
+from datetime import date, datetime, timedelta
+
+_atualizacao_lock = threading.Lock()
+_ultima_atualizacao = None
+
+COLUNAS_FATOS = '''dia, codi_empresa, fornecedor, qtd_pedidos, qtd_entregues, qtd_conformes, qtd_nao_conformes,
+                   qtd_com_entrega_real, soma_lead_dias, qtd_abertos, qtd_atrasados, valor_aberto'''
+
+# Agrega um pedido por linha (subconsulta "p") nas métricas do dia. {filtro} restringe os dias.
+SQL_AGREGAR = '''
+    SELECT dia, codi_empresa, fornecedor,
+           COUNT(*),
+           SUM(entregue),
+           SUM(CASE WHEN entregue = 1 AND entrega_conforme = 1 THEN 1 ELSE 0 END),
+           SUM(CASE WHEN entregue = 1 AND entrega_conforme = 0 THEN 1 ELSE 0 END),
+           SUM(CASE WHEN data_entrega_real IS NOT NULL THEN 1 ELSE 0 END),
+           COALESCE(SUM(CASE WHEN data_entrega_real IS NOT NULL THEN DATEDIFF(data_entrega_real, data_registro) ELSE 0 END), 0),
+           SUM(1 - entregue),
+           SUM(CASE WHEN entregue = 0 AND prazo_entrega < %s THEN 1 ELSE 0 END),
+           COALESCE(SUM(CASE WHEN entregue = 0 THEN valor ELSE 0 END), 0)
+    FROM (
+        SELECT DATE(c.data_registro) AS dia, c.codi_empresa, COALESCE(c.fornecedor, '') AS fornecedor,
+               1 - c.em_aberto AS entregue,
+               c.entrega_conforme, c.data_entrega_real, c.data_registro, c.prazo_entrega,
+               c.valor_total AS valor
+        FROM acompanhamento_compras c
+        WHERE c.data_registro IS NOT NULL {filtro}
+    ) p
+    GROUP BY dia, codi_empresa, fornecedor
+'''
+
+
+def _como_dia(valor):
+    if not valor:
+        return None
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    try:
+        return datetime.strptime(str(valor)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def dias_do_pedido(*pedidos):
+    """Dias de registro tocados por uma escrita (antes e depois da alteração)."""
+    return {d for d in (_como_dia(p.get('data_registro')) for p in pedidos if p) if d}
+
+
+def atualizar_dias(cursor, dias, hoje=None):
+    """Recalcula as linhas dos dias informados. Chamar dentro da transação da escrita."""
+    dias = sorted(dias)
+    if not dias:
+        return
+    hoje = hoje or date.today()
+
+    faixas = []
+    params = []
+    for d in dias:
+        faixas.append("(c.data_registro >= %s AND c.data_registro < %s)")
+        params.extend([d.isoformat(), (d + timedelta(days=1)).isoformat()])
+
+    marcadores = ', '.join(['%s'] * len(dias))
+    cursor.execute(f'DELETE FROM fatos_diarios WHERE dia IN ({marcadores})', [d.isoformat() for d in dias])
+    cursor.execute(
+        f'INSERT INTO fatos_diarios ({COLUNAS_FATOS}) ' + SQL_AGREGAR.format(filtro='AND (' + ' OR '.join(faixas) + ')'),
+        [hoje.isoformat()] + params
+    )
+
+
+def garantir_atualizacao_diaria(conn, hoje=None):
+    """
+    Uma vez por dia (por processo) recalcula os dias que têm pedidos abertos com prazo
+    já vencido, para que qtd_atrasados reflita a data de hoje.
+    """
+    global _ultima_atualizacao
+    hoje = hoje or date.today()
+    if _ultima_atualizacao == hoje:
+        return
+    with _atualizacao_lock:
+        if _ultima_atualizacao == hoje:
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                SELECT DISTINCT DATE(data_registro) AS dia FROM acompanhamento_compras
+                WHERE em_aberto = 1 AND prazo_entrega < %s AND data_registro IS NOT NULL
+            ''', (hoje.isoformat(),))
+            dias = {_como_dia(r['dia']) for r in cursor.fetchall()}
+            conn.begin()
+            try:
+                # Em lotes para não montar um OR gigante quando o backlog vencido é grande
+                dias = sorted(d for d in dias if d)
+                for i in range(0, len(dias), 200):
+                    atualizar_dias(cursor, dias[i:i + 200], hoje)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        finally:
+            cursor.close()
+        _ultima_atualizacao = hoje
+
+
+def _filtro_periodo(inicio, fim, coluna='dia'):
+    inicio, fim = _como_dia(inicio), _como_dia(fim)
+    if inicio and fim:
+        return f" AND {coluna} BETWEEN %s AND %s", [inicio.isoformat(), fim.isoformat()]
+    if inicio:
+        return f" AND {coluna} >= %s", [inicio.isoformat()]
+    if fim:
+        return f" AND {coluna} <= %s", [fim.isoformat()]
+    return "", []
+
+
+def filtro_registro(inicio, fim, coluna='c.data_registro'):
+    """O mesmo período de resumo_periodo aplicado ao DATETIME data_registro.
+
+    BETWEEN '2024-01-01' AND '2024-01-31' pararia em 31/01 00:00:00; aqui o dia final
+    entra inteiro (< fim + 1 dia), para as listas baterem com os KPIs dos fatos.
+    """
+    inicio, fim = _como_dia(inicio), _como_dia(fim)
+    where, params = "", []
+    if inicio:
+        where += f" AND {coluna} >= %s"
+        params.append(inicio.isoformat())
+    if fim:
+        where += f" AND {coluna} < %s"
+        params.append((fim + timedelta(days=1)).isoformat())
+    return where, params
+
+
+def resumo_periodo(cursor, inicio='', fim=''):
+    """KPIs de performance e taxa de atraso por unidade somando os fatos do período."""
+    where, params = _filtro_periodo(inicio, fim)
+
+    cursor.execute(f'''
+        SELECT COALESCE(SUM(qtd_com_entrega_real), 0) AS qtd_lead,
+               COALESCE(SUM(soma_lead_dias), 0) AS soma_lead,
+               COALESCE(SUM(qtd_entregues), 0) AS entregues,
+               COALESCE(SUM(qtd_conformes), 0) AS perfeitas,
+               COALESCE(SUM(qtd_nao_conformes), 0) AS problemas,
+               COALESCE(SUM(valor_aberto), 0) AS backlog
+        FROM fatos_diarios WHERE 1=1 {where}
+    ''', params)
+    totais = cursor.fetchone()
+
+    cursor.execute(f'''
+        SELECT e.nome_empresa, SUM(f.qtd_pedidos) AS total_pedidos, SUM(f.qtd_atrasados) AS atrasados
+        FROM fatos_diarios f
+        JOIN empresas_compras e ON f.codi_empresa = e.codi_empresa
+        WHERE 1=1 {where.replace('dia', 'f.dia')}
+        GROUP BY e.nome_empresa
+        HAVING SUM(f.qtd_pedidos) > 0
+        ORDER BY atrasados DESC
+    ''', params)
+    unidades = cursor.fetchall()
+
+    qtd_lead = int(totais['qtd_lead'])
+    return {
+        'lead_time': round(float(totais['soma_lead']) / qtd_lead) if qtd_lead else 0,
+        'entregues': int(totais['entregues']),
+        'perfeitas': int(totais['perfeitas']),
+        'problemas': int(totais['problemas']),
+        'backlog': float(totais['backlog']),
+        'unidades': unidades,
+    }
+
+
+def versao_periodo(cursor, inicio='', fim=''):
+    """
+    Identifica o estado dos dados do período: muda sempre que algum dia do intervalo
+    é recalculado. Inclui a data de hoje porque os atrasos mudam com o calendário.
+    """
+    where, params = _filtro_periodo(inicio, fim)
+    cursor.execute(f'''
+        SELECT COUNT(*) AS linhas, MAX(atualizado_em) AS ultima, COALESCE(SUM(qtd_pedidos), 0) AS pedidos
+        FROM fatos_diarios WHERE 1=1 {where}
+    ''', params)
+    r = cursor.fetchone()
+    return f"{date.today()}:{r['linhas']}:{r['ultima']}:{r['pedidos']}"
+
+
+def reconstruir(conn):
+    """Apaga e recalcula a tabela inteira (carga inicial / backfill)."""
+    cursor = conn.cursor()
+    conn.begin()
+    try:
+        cursor.execute('DELETE FROM fatos_diarios')
+        cursor.execute(f'INSERT INTO fatos_diarios ({COLUNAS_FATOS}) ' + SQL_AGREGAR.format(filtro=''),
+                       [date.today().isoformat()])
+        linhas = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return linhas
+
+
+if __name__ == '__main__':
+    if '--reconstruir' not in sys.argv:
+        print("Uso: python fatos_performance.py --reconstruir")
+        sys.exit(1)
+
+    import banco_dados
+    conn = banco_dados.obter_conexao()
+    try:
+        linhas = reconstruir(conn)
+        print(f"✅ Fatos de performance reconstruídos ({linhas} linhas).")
+    finally:
+        conn.close()
@@ -0,0 +1,485 @@
+"""
+Carga do histórico das planilhas de follow-up (XLSX ou CSV) para acompanhamento_compras
+e pedidos_itens.
+
+- Leitura em fluxo: CSV linha a linha e XLSX com openpyxl em modo read_only; a memória
+  não cresce com o tamanho do arquivo.
+- Colunas reconhecidas pelo nome do cabeçalho (sem acento/maiúsculas), ver COLUNAS.
+- Uma linha por item: linhas seguidas com a mesma solicitação/unidade/pedido formam um
+  pedido (a planilha precisa estar agrupada por pedido, como no follow-up manual).
+- Unidade e comprador resolvidos por mapas em memória (código ou nome).
+- Gravação em lotes: um INSERT de várias linhas para os cabeçalhos, executemany para os itens e
+  um COMMIT por lote. valor_total/qtd_itens já vão calculados.
+- Pedidos que já existem (mesma solicitação/unidade/pedido) são pulados: importar a mesma
+  planilha de novo não duplica nada.
+- Ao final, contadores do dashboard e fatos de performance são reconstruídos uma vez,
+  mesmo se um lote falhar no meio (os lotes anteriores já estão gravados).
+
+Uso pela linha de comando:
+    python importador_planilhas.py historico.xlsx [--aba "Follow Up"] [--status-padrao Entregue] [--simular]
+"""
+import os
+import csv
+import sys
+import time
+import uuid
+import threading
+import unicodedata
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import banco_dados
+import contadores
+import fatos_performance
+
+PEDIDOS_POR_LOTE = int(os.getenv('PLANILHA_PEDIDOS_POR_LOTE', 1000))
+PASTA_PLANILHAS = os.getenv('PLANILHAS_PASTA', 'planilhas_recebidas')
+PLANILHAS_WORKERS = 1     # Uma importação por vez (cada uma já grava em lotes grandes)
+MAX_ERROS_LISTADOS = 200
+PROGRESSO_A_CADA_LINHAS = 1000   # Também avisa no meio de um lote (linhas ignoradas ou pedidos com muitos itens)
+
+# Campo interno -> nomes aceitos no cabeçalho (já normalizados)
+COLUNAS = {
+    'numero_solicitacao': ['solicitacao', 'n solicitacao', 'no solicitacao', 'numero solicitacao', 'num solicitacao', 'sc'],
+    'numero_orcamento': ['orcamento', 'n orcamento', 'no orcamento', 'numero orcamento'],
+    'numero_pedido': ['pedido', 'n pedido', 'no pedido', 'numero pedido', 'pc'],
+    'data_registro': ['data', 'data registro', 'data solicitacao', 'data abertura', 'data do documento'],
+    'empresa': ['unidade', 'empresa', 'loja', 'filial', 'codi empresa'],
+    'fornecedor': ['fornecedor'],
+    'categoria': ['categoria'],
+    'status_compra': ['status', 'situacao', 'status compra'],
+    'comprador': ['comprador', 'responsavel', 'responsavel compra'],
+    'solicitante_real': ['solicitante', 'requerente', 'solicitante real'],
+    'data_compra': ['data compra', 'data da compra'],
+    'prazo_entrega': ['prazo', 'prazo entrega', 'previsao entrega'],
+    'data_entrega_real': ['data entrega', 'entrega', 'data entrega real', 'entregue em'],
+    'nota_fiscal': ['nota', 'nota fiscal', 'nf'],
+    'serie_nota': ['serie', 'serie nota'],
+    'observacao': ['observacao', 'observacoes', 'obs'],
+    'nome_item': ['item', 'descricao', 'produto', 'material', 'nome item'],
+    'quantidade': ['quantidade', 'qtd', 'qtde', 'quant'],
+    'unidade_medida': ['unid', 'un', 'unidade medida', 'medida'],
+    'valor_unitario': ['valor unitario', 'valor unit', 'preco', 'preco unitario', 'valor'],
+}
+
+COLUNAS_CABECALHO = '''(data_registro, numero_solicitacao, numero_orcamento, numero_pedido, item_comprado, categoria,
+     fornecedor, data_compra, nota_fiscal, serie_nota, observacao, codi_empresa, id_comprador_responsavel,
+     prazo_entrega, data_entrega_real, status_compra, solicitante_real, valor_total, qtd_itens)'''
+
+
+class ErroPlanilha(Exception):
+    pass
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in texto.lower()).split())
+
+
+def mapear_cabecalho(cabecalho):
+    """Índice da coluna de cada campo conhecido. Colunas desconhecidas são ignoradas."""
+    apelidos = {apelido: campo for campo, lista in COLUNAS.items() for apelido in lista}
+    mapa = {}
+    for indice, titulo in enumerate(cabecalho):
+        campo = apelidos.get(normalizar(titulo))
+        if campo and campo not in mapa:
+            mapa[campo] = indice
+    faltando = [c for c in ('numero_solicitacao', 'empresa') if c not in mapa]
+    if faltando:
+        raise ErroPlanilha(f"Colunas obrigatórias não encontradas: {', '.join(faltando)}")
+    return mapa
+
+
+# --- LEITURA EM FLUXO ---
+
+def linhas_csv(caminho):
+    with open(caminho, newline='', encoding='utf-8-sig') as f:
+        amostra = f.read(8192)
+        f.seek(0)
+        try:
+            delimitador = csv.Sniffer().sniff(amostra, delimiters=';,\t').delimiter
+        except csv.Error:
+            delimitador = ';'   # Padrão do Excel em português
+        yield from csv.reader(f, delimiter=delimitador)
+
+
+def linhas_xlsx(caminho, aba=None):
+    from openpyxl import load_workbook
+    livro = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        planilha = livro[aba] if aba else livro.worksheets[0]
+        yield from planilha.iter_rows(values_only=True)
+    finally:
+        livro.close()
+
+
+def ler_linhas(caminho, aba=None):
+    if caminho.lower().endswith(('.xlsx', '.xlsm')):
+        return linhas_xlsx(caminho, aba)
+    if caminho.lower().endswith(('.csv', '.txt')):
+        return linhas_csv(caminho)
+    raise ErroPlanilha("Formato não suportado: use .xlsx ou .csv")
+
+
+# --- CONVERSÕES ---
+
+def como_data(valor):
+    if valor in (None, ''):
+        return None
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.isoformat()
+    texto = str(valor).strip()
+    for formato in ('%d/%m/%Y', '%d/%m/%y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(texto, formato).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    for formato in ('%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(texto, formato).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f"data inválida: {texto!r}")
+
+
+def como_numero(valor, padrao=0.0):
+    if valor in (None, ''):
+        return padrao
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    texto = str(valor).replace('R$', '').strip()
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')   # 1.234,56
+    return float(texto)
+
+
+def como_texto(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)   # Excel guarda "12345" como 12345.0
+    texto = str(valor).strip()
+    return texto or None
+
+
+# --- MAPAS DE REFERÊNCIA ---
+
+def carregar_mapas(cursor):
+    cursor.execute("SELECT codi_empresa, nome_empresa FROM empresas_compras")
+    empresas = {}
+    for r in cursor.fetchall():
+        empresas[str(r['codi_empresa'])] = r['codi_empresa']
+        empresas[normalizar(r['nome_empresa'])] = r['codi_empresa']
+    cursor.execute("SELECT id, nome_completo, email FROM usuarios")
+    usuarios = {}
+    for r in cursor.fetchall():
+        usuarios[normalizar(r['nome_completo'])] = r['id']
+        usuarios[normalizar(r['email'])] = r['id']
+    return empresas, usuarios
+
+
+def autoinc_consecutivo(cursor):
+    """
+    Com innodb_autoinc_lock_mode 0 ou 1, um INSERT de várias linhas recebe ids
+    consecutivos a partir de LAST_INSERT_ID(); no modo 2 (intercalado) não há garantia.
+    No SQLite o lastrowid é o da última linha: grava uma a uma (sem rede, custa pouco).
+    """
+    if banco_dados.DB_BACKEND == 'sqlite':
+        return False
+    cursor.execute("SELECT @@innodb_autoinc_lock_mode AS modo")
+    linha = cursor.fetchone()
+    return linha is not None and int(linha['modo']) in (0, 1)
+
+
+# --- IMPORTAÇÃO ---
+
+class ImportadorPlanilha:
+    def __init__(self, conn, status_padrao='Entregue', simular=False, progresso=None):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.status_padrao = status_padrao
+        self.simular = simular
+        self.progresso = progresso   # progresso(linhas_lidas, pedidos_gravados)
+        self.empresas, self.usuarios = carregar_mapas(self.cursor)
+        self.ids_consecutivos = autoinc_consecutivo(self.cursor)
+        self.resumo = {'linhas': 0, 'pedidos': 0, 'itens': 0, 'ignoradas': 0, 'duplicados': 0, 'erros': [],
+                       'simulacao': simular}
+
+    def _erro(self, numero_linha, mensagem):
+        self.resumo['ignoradas'] += 1
+        if len(self.resumo['erros']) < MAX_ERROS_LISTADOS:
+            self.resumo['erros'].append(f"Linha {numero_linha}: {mensagem}")
+
+    def _valor(self, linha, mapa, campo):
+        indice = mapa.get(campo)
+        return linha[indice] if indice is not None and indice < len(linha) else None
+
+    def _cabecalho_da_linha(self, linha, mapa):
+        empresa = como_texto(self._valor(linha, mapa, 'empresa'))
+        codi_empresa = self.empresas.get(empresa) or self.empresas.get(normalizar(empresa))
+        if codi_empresa is None:
+            raise ValueError(f"unidade desconhecida: {empresa!r}")
+        numero = como_texto(self._valor(linha, mapa, 'numero_solicitacao'))
+        if not numero:
+            raise ValueError("sem número de solicitação")
+        comprador = normalizar(self._valor(linha, mapa, 'comprador'))
+        return {
+            'data_registro': como_data(self._valor(linha, mapa, 'data_registro')),
+            'numero_solicitacao': numero,
+            'numero_orcamento': como_texto(self._valor(linha, mapa, 'numero_orcamento')),
+            'numero_pedido': como_texto(self._valor(linha, mapa, 'numero_pedido')),
+            'categoria': como_texto(self._valor(linha, mapa, 'categoria')),
+            'fornecedor': como_texto(self._valor(linha, mapa, 'fornecedor')),
+            'data_compra': como_data(self._valor(linha, mapa, 'data_compra')),
+            'nota_fiscal': como_texto(self._valor(linha, mapa, 'nota_fiscal')),
+            'serie_nota': como_texto(self._valor(linha, mapa, 'serie_nota')),
+            'observacao': como_texto(self._valor(linha, mapa, 'observacao')),
+            'codi_empresa': codi_empresa,
+            'id_comprador_responsavel': self.usuarios.get(comprador) if comprador else None,
+            'prazo_entrega': como_data(self._valor(linha, mapa, 'prazo_entrega')),
+            'data_entrega_real': como_data(self._valor(linha, mapa, 'data_entrega_real')),
+            'status_compra': como_texto(self._valor(linha, mapa, 'status_compra')) or self.status_padrao,
+            'solicitante_real': como_texto(self._valor(linha, mapa, 'solicitante_real')),
+            'itens': [],
+        }
+
+    def _item_da_linha(self, linha, mapa):
+        nome = como_texto(self._valor(linha, mapa, 'nome_item'))
+        if not nome:
+            return None
+        return (nome,
+                int(como_numero(self._valor(linha, mapa, 'quantidade'), 1)),
+                (como_texto(self._valor(linha, mapa, 'unidade_medida')) or 'UN').upper()[:10],
+                como_numero(self._valor(linha, mapa, 'valor_unitario')))
+
+    def pedidos(self, linhas):
+        """Agrupa as linhas seguidas do mesmo pedido. Gera um dict por pedido."""
+        linhas = iter(linhas)
+        try:
+            mapa = mapear_cabecalho(next(linhas))
+        except StopIteration:
+            raise ErroPlanilha("Planilha vazia.")
+
+        atual = None
+        chave_atual = None
+        for numero_linha, linha in enumerate(linhas, start=2):
+            self.resumo['linhas'] += 1
+            if self.resumo['linhas'] % PROGRESSO_A_CADA_LINHAS == 0:
+                self._avisar_progresso()
+            if not linha or all(v in (None, '') for v in linha):
+                continue
+            try:
+                cabecalho = self._cabecalho_da_linha(linha, mapa)
+                item = self._item_da_linha(linha, mapa)
+            except (ValueError, TypeError) as e:
+                self._erro(numero_linha, e)
+                continue
+
+            chave = (cabecalho['numero_solicitacao'], cabecalho['codi_empresa'], cabecalho['numero_pedido'])
+            if chave != chave_atual:
+                if atual:
+                    yield atual
+                atual, chave_atual = cabecalho, chave
+            if item:
+                atual['itens'].append(item)
+        if atual:
+            yield atual
+
+    def _sem_duplicados(self, lote):
+        """Tira do lote os pedidos cuja chave (solicitação, unidade, pedido) já está no banco ou repete no lote."""
+        numeros = sorted({p['numero_solicitacao'] for p in lote})
+        self.cursor.execute(f'''
+            SELECT numero_solicitacao, codi_empresa, numero_pedido FROM acompanhamento_compras
+            WHERE numero_solicitacao IN ({', '.join(['%s'] * len(numeros))})
+        ''', numeros)
+        existentes = {(r['numero_solicitacao'], r['codi_empresa'], r['numero_pedido'] or '') for r in self.cursor.fetchall()}
+        novos = []
+        for p in lote:
+            chave = (p['numero_solicitacao'], p['codi_empresa'], p['numero_pedido'] or '')
+            if chave in existentes:
+                self.resumo['duplicados'] += 1
+            else:
+                existentes.add(chave)
+                novos.append(p)
+        return novos
+
+    def _gravar_lote(self, lote):
+        lote = self._sem_duplicados(lote)
+        if not lote:
+            return
+        linhas = []
+        for p in lote:
+            nomes = [i[0] for i in p['itens']]
+            titulo = nomes[0] if nomes else "Pedido"
+            if len(nomes) > 1:
+                titulo += f" (+ {len(nomes)-1} itens)"
+            linhas.append((
+                p['data_registro'], p['numero_solicitacao'], p['numero_orcamento'], p['numero_pedido'], titulo,
+                p['categoria'], p['fornecedor'], p['data_compra'], p['nota_fiscal'], p['serie_nota'], p['observacao'],
+                p['codi_empresa'], p['id_comprador_responsavel'], p['prazo_entrega'], p['data_entrega_real'],
+                p['status_compra'], p['solicitante_real'],
+                round(sum(q * v for _, q, _, v in p['itens']), 2), len(p['itens'])
+            ))
+
+        marcadores = f"({', '.join(['%s'] * 19)})"
+        sql = f"INSERT INTO acompanhamento_compras {COLUNAS_CABECALHO} VALUES {marcadores}"
+        self.conn.begin()
+        try:
+            if self.ids_consecutivos:
+                # Um único INSERT de várias linhas (montado aqui: o executemany do PyMySQL pode
+                # quebrar em vários comandos e aí o lastrowid não vale para o lote inteiro).
+                # Os ids vêm em sequência a partir do primeiro.
+                self.cursor.execute(
+                    f"INSERT INTO acompanhamento_compras {COLUNAS_CABECALHO} VALUES {', '.join([marcadores] * len(linhas))}",
+                    [valor for valores in linhas for valor in valores]
+                )
+                primeiro_id = self.cursor.lastrowid
+                ids = range(primeiro_id, primeiro_id + len(linhas))
+            else:
+                ids = []
+                for valores in linhas:
+                    self.cursor.execute(sql, valores)
+                    ids.append(self.cursor.lastrowid)
+
+            itens = [(pedido_id,) + item for pedido_id, p in zip(ids, lote) for item in p['itens']]
+            if itens:
+                self.cursor.executemany('''
+                    INSERT INTO pedidos_itens (pedido_id, nome_item, quantidade, unidade_medida, valor_unitario)
+                    VALUES (%s, %s, %s, %s, %s)
+                ''', itens)
+
+            if self.simular:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.resumo['pedidos'] += len(lote)
+        self.resumo['itens'] += len(itens)
+
+    def _avisar_progresso(self):
+        if self.progresso:
+            self.progresso(self.resumo['linhas'], self.resumo['pedidos'])
+
+    def importar(self, linhas):
+        inicio = time.time()
+        lote = []
+        try:
+            for pedido in self.pedidos(linhas):
+                lote.append(pedido)
+                if len(lote) >= PEDIDOS_POR_LOTE:
+                    self._gravar_lote(lote)
+                    lote = []
+                    self._avisar_progresso()
+            if lote:
+                self._gravar_lote(lote)
+                self._avisar_progresso()
+        finally:
+            # Derivados reconstruídos uma vez em vez de por pedido; também quando um lote falha,
+            # pois os lotes anteriores já foram confirmados
+            if not self.simular and self.resumo['pedidos']:
+                contadores.reconstruir(self.conn)
+                fatos_performance.reconstruir(self.conn)
+            self.cursor.close()
+        self.resumo['segundos'] = round(time.time() - inicio, 1)
+        return self.resumo
+
+
+def importar_arquivo(conn, caminho, aba=None, status_padrao='Entregue', simular=False, progresso=None):
+    importador = ImportadorPlanilha(conn, status_padrao=status_padrao, simular=simular, progresso=progresso)
+    return importador.importar(ler_linhas(caminho, aba))
+
+
+class FilaPlanilhas:
+    """
+    Importações disparadas pela tela de admin: uma de cada vez, numa thread de fundo
+    (carga grande leva minutos e não pode prender uma thread do Waitress).
+    """
+    def __init__(self, obter_conexao, logger=None, ao_concluir=None):
+        self.obter_conexao = obter_conexao
+        self.logger = logger
+        self.ao_concluir = ao_concluir
+        self._executor = ThreadPoolExecutor(max_workers=PLANILHAS_WORKERS, thread_name_prefix='importacao_planilha')
+        self._lock = threading.Lock()
+        self._tarefas = {}
+
+    def enviar(self, caminho, nome_original, dono, **opcoes):
+        tarefa_id = uuid.uuid4().hex
+        with self._lock:
+            self._tarefas[tarefa_id] = {'status': 'na_fila', 'erro': None, 'resumo': None, 'dono': dono,
+                                        'arquivo': nome_original, 'linhas': 0, 'pedidos': 0}
+        self._executor.submit(self._executar, tarefa_id, caminho, opcoes)
+        return tarefa_id
+
+    def consultar(self, tarefa_id):
+        with self._lock:
+            tarefa = self._tarefas.get(tarefa_id)
+            return dict(tarefa) if tarefa else None
+
+    def _atualizar(self, tarefa_id, **campos):
+        with self._lock:
+            self._tarefas[tarefa_id].update(campos)
+
+    def _executar(self, tarefa_id, caminho, opcoes):
+        self._atualizar(tarefa_id, status='processando')
+        conn = None
+        try:
+            conn = self.obter_conexao()
+            resumo = importar_arquivo(
+                conn, caminho,
+                progresso=lambda linhas, pedidos: self._atualizar(tarefa_id, linhas=linhas, pedidos=pedidos),
+                **opcoes
+            )
+            self._atualizar(tarefa_id, status='pronto', resumo=resumo)
+            if self.ao_concluir and not opcoes.get('simular'):
+                self.ao_concluir()
+        except Exception as e:
+            with self._lock:
+                gravados = self._tarefas[tarefa_id].get('pedidos', 0)
+            mensagem = str(e)
+            if gravados and not opcoes.get('simular'):
+                mensagem += f" ({gravados} pedidos dos lotes anteriores ficaram gravados; reimportar a planilha pula esses)"
+                if self.ao_concluir:
+                    self.ao_concluir()
+            self._atualizar(tarefa_id, status='erro', erro=mensagem)
+            if self.logger and not isinstance(e, ErroPlanilha):
+                self.logger.error(f"Erro ao importar planilha: {e}", exc_info=True)
+        finally:
+            if conn:
+                conn.close()
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+if __name__ == '__main__':
+    import argparse
+    argumentos = argparse.ArgumentParser(description="Importa o histórico de uma planilha XLSX/CSV.")
+    argumentos.add_argument('arquivo')
+    argumentos.add_argument('--aba', help="Nome da aba (XLSX); padrão: a primeira")
+    argumentos.add_argument('--status-padrao', default='Entregue', help="Status quando a coluna estiver vazia")
+    argumentos.add_argument('--simular', action='store_true', help="Valida e grava dentro de transações desfeitas")
+    opcoes = argumentos.parse_args()
+
+    conn = banco_dados.obter_conexao()
+    try:
+        resumo = importar_arquivo(
+            conn, opcoes.arquivo, aba=opcoes.aba, status_padrao=opcoes.status_padrao, simular=opcoes.simular,
+            progresso=lambda linhas, pedidos: print(f"   ... {linhas} linhas lidas, {pedidos} pedidos gravados")
+        )
+    except ErroPlanilha as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    for erro in resumo['erros']:
+        print(f"⚠️ {erro}")
+    prefixo = "🧪 Simulação" if opcoes.simular else "✅ Importação"
+    print(f"{prefixo}: {resumo['pedidos']} pedidos, {resumo['itens']} itens, "
+          f"{resumo['duplicados']} já existente(s) pulado(s), "
+          f"{resumo['ignoradas']} linha(s) ignorada(s) em {resumo['segundos']} s.")
@@ -1,100 +1,168 @@
+"""
+Cria o banco SQLite usado com DB_BACKEND=sqlite (arquivo em DB_SQLITE_CAMINHO, padrão database.db).
+
+A estrutura é a mesma que as migrações (migracoes/0000..0007) produzem no MySQL, já com
+contadores, fatos diários, totais, anexos por conteúdo, situação do pedido e índices.
+Ao criar uma migração nova para o MySQL, repita a mudança aqui.
+Diferença: a busca do dashboard no SQLite usa LIKE (não há índice FULLTEXT).
+
+Uso pela linha de comando:
+    python init_db.py
+"""
 import sqlite3
 from werkzeug.security import generate_password_hash
 
-def criar_banco():
-    print("🔄 Criando tabelas do banco de dados...")
-    connection = sqlite3.connect('database.db')
+import banco_sqlite
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS usuarios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome_completo TEXT NOT NULL,
+    email TEXT NOT NULL UNIQUE,
+    senha TEXT NOT NULL,
+    nivel_acesso TEXT NOT NULL DEFAULT 'comprador',
+    aprovado INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS empresas_compras (
+    codi_empresa INTEGER PRIMARY KEY,
+    nome_empresa TEXT NOT NULL
+);
+
+-- Cabeçalho do pedido. data_registro em hora local, como o CURRENT_TIMESTAMP do MySQL
+CREATE TABLE IF NOT EXISTS acompanhamento_compras (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data_registro DATETIME DEFAULT (datetime('now', 'localtime')),
+    data_abertura TEXT,
+    numero_solicitacao TEXT NOT NULL,
+    numero_orcamento TEXT,
+    numero_pedido TEXT,
+    item_comprado TEXT,
+    categoria TEXT,
+    fornecedor TEXT,
+    data_compra DATE,
+    nota_fiscal TEXT,
+    serie_nota TEXT,
+    observacao TEXT,
+    codi_empresa INTEGER NOT NULL REFERENCES empresas_compras (codi_empresa),
+    id_responsavel_chamado INTEGER REFERENCES usuarios (id) ON DELETE RESTRICT,
+    id_comprador_responsavel INTEGER REFERENCES usuarios (id) ON DELETE RESTRICT,
+    solicitante_real TEXT,
+    prazo_entrega DATE,
+    data_entrega_reprogramada DATE,
+    data_entrega_real DATE,
+    entrega_conforme INTEGER,
+    detalhes_entrega TEXT,
+    status_compra TEXT NOT NULL DEFAULT 'Aguardando Aprovação',
+    valor_total DECIMAL(15,2) NOT NULL DEFAULT 0,
+    qtd_itens INTEGER NOT NULL DEFAULT 0,
+    codigo_status INTEGER GENERATED ALWAYS AS (
+        CASE status_compra
+            WHEN 'Aguardando Aprovação' THEN 1
+            WHEN 'Orçamento' THEN 2
+            WHEN 'Confirmado' THEN 3
+            WHEN 'Em Trânsito' THEN 4
+            WHEN 'Entregue Parcialmente' THEN 5
+            WHEN 'Entregue Totalmente' THEN 6
+            ELSE 0
+        END) STORED,
+    em_aberto INTEGER GENERATED ALWAYS AS (
+        CASE WHEN status_compra LIKE '%Entregue%' THEN 0 ELSE 1 END) STORED
+);
+
+CREATE TABLE IF NOT EXISTS pedidos_itens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pedido_id INTEGER NOT NULL REFERENCES acompanhamento_compras (id) ON DELETE CASCADE,
+    nome_item TEXT NOT NULL,
+    quantidade INTEGER NOT NULL DEFAULT 1,
+    unidade_medida TEXT NOT NULL DEFAULT 'UN',
+    valor_unitario DECIMAL(15,2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS pedidos_anexos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pedido_id INTEGER NOT NULL REFERENCES acompanhamento_compras (id) ON DELETE CASCADE,
+    nome_arquivo TEXT NOT NULL,
+    nome_original TEXT,
+    data_upload DATETIME DEFAULT (datetime('now', 'localtime')),
+    hash_conteudo TEXT,
+    tamanho INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS contadores_pedidos (
+    codi_empresa INTEGER NOT NULL,
+    id_comprador INTEGER NOT NULL DEFAULT 0,
+    status_compra TEXT NOT NULL,
+    faixa_prazo TEXT NOT NULL,
+    qtd INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (codi_empresa, id_comprador, status_compra, faixa_prazo)
+);
+
+-- atualizado_em com milissegundos: entra na versão dos relatórios PDF em cache
+CREATE TABLE IF NOT EXISTS fatos_diarios (
+    dia DATE NOT NULL,
+    codi_empresa INTEGER NOT NULL,
+    fornecedor TEXT NOT NULL DEFAULT '',
+    qtd_pedidos INTEGER NOT NULL DEFAULT 0,
+    qtd_entregues INTEGER NOT NULL DEFAULT 0,
+    qtd_conformes INTEGER NOT NULL DEFAULT 0,
+    qtd_nao_conformes INTEGER NOT NULL DEFAULT 0,
+    qtd_com_entrega_real INTEGER NOT NULL DEFAULT 0,
+    soma_lead_dias INTEGER NOT NULL DEFAULT 0,
+    qtd_abertos INTEGER NOT NULL DEFAULT 0,
+    qtd_atrasados INTEGER NOT NULL DEFAULT 0,
+    valor_aberto DECIMAL(15,2) NOT NULL DEFAULT 0,
+    atualizado_em DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    PRIMARY KEY (dia, codi_empresa, fornecedor)
+);
+
+CREATE INDEX IF NOT EXISTS idx_pedidos_empresa_status ON acompanhamento_compras (codi_empresa, status_compra);
+CREATE INDEX IF NOT EXISTS idx_pedidos_comprador_status ON acompanhamento_compras (id_comprador_responsavel, status_compra);
+CREATE INDEX IF NOT EXISTS idx_pedidos_status ON acompanhamento_compras (status_compra);
+CREATE INDEX IF NOT EXISTS idx_pedidos_registro ON acompanhamento_compras (data_registro);
+CREATE INDEX IF NOT EXISTS idx_pedidos_empresa_registro ON acompanhamento_compras (codi_empresa, data_registro);
+CREATE INDEX IF NOT EXISTS idx_pedidos_prazo ON acompanhamento_compras (prazo_entrega);
+CREATE INDEX IF NOT EXISTS idx_pedidos_solicitacao ON acompanhamento_compras (numero_solicitacao);
+CREATE INDEX IF NOT EXISTS idx_pedidos_numero_pedido ON acompanhamento_compras (numero_pedido);
+CREATE INDEX IF NOT EXISTS idx_pedidos_aberto_prazo ON acompanhamento_compras (em_aberto, prazo_entrega);
+CREATE INDEX IF NOT EXISTS idx_pedidos_aberto_registro ON acompanhamento_compras (em_aberto, data_registro);
+CREATE INDEX IF NOT EXISTS idx_pedidos_empresa_aberto ON acompanhamento_compras (codi_empresa, em_aberto);
+CREATE INDEX IF NOT EXISTS idx_pedidos_comprador_aberto ON acompanhamento_compras (id_comprador_responsavel, em_aberto);
+CREATE INDEX IF NOT EXISTS idx_itens_pedido ON pedidos_itens (pedido_id);
+CREATE INDEX IF NOT EXISTS idx_anexos_pedido ON pedidos_anexos (pedido_id);
+CREATE INDEX IF NOT EXISTS idx_anexos_hash ON pedidos_anexos (hash_conteudo);
+CREATE INDEX IF NOT EXISTS idx_contadores_faixa ON contadores_pedidos (faixa_prazo);
+CREATE INDEX IF NOT EXISTS idx_fatos_empresa_dia ON fatos_diarios (codi_empresa, dia);
+'''
+
+
+def _estrutura_antiga(cursor):
+    """Arquivo criado pela versão anterior deste script (sem totais/situação): não dá para completar."""
+    colunas = {r[1] for r in cursor.execute("PRAGMA table_xinfo(acompanhamento_compras)")}
+    return bool(colunas) and 'em_aberto' not in colunas
+
+
+def criar_banco(caminho=banco_sqlite.SQLITE_CAMINHO):
+    print(f"🔄 Criando tabelas do banco de dados ({caminho})...")
+    connection = banco_sqlite.conectar_bruta(caminho)
     cursor = connection.cursor()
-    
-    # 1. Tabela de Usuários
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS usuarios (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome_completo TEXT NOT NULL,
-        email TEXT NOT NULL UNIQUE,
-        senha TEXT NOT NULL,
-        nivel_acesso TEXT DEFAULT 'comprador',
-        aprovado INTEGER DEFAULT 0 
-    )
-    ''')
-
-    # 2. Tabela de Empresas (Unidades)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS empresas_compras (
-        codi_empresa INTEGER PRIMARY KEY,
-        nome_empresa TEXT NOT NULL
-    )
-    ''')
-
-    # 3. Tabela Principal do Pedido (Cabeçalho)
-    # Inclui a nova coluna 'solicitante_real'
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS acompanhamento_compras (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        
-        numero_solicitacao TEXT NOT NULL,
-        numero_orcamento TEXT,
-        numero_pedido TEXT,
-        item_comprado TEXT,  -- Título/Resumo do pedido
-        categoria TEXT,
-        fornecedor TEXT,
-        data_compra TEXT,
-        
-        nota_fiscal TEXT,
-        serie_nota TEXT,
-        observacao TEXT,                   
-        
-        codi_empresa INTEGER NOT NULL,
-        id_responsavel_chamado INTEGER,   -- Usuário do Sistema
-        id_comprador_responsavel INTEGER, -- Usuário do Sistema
-        solicitante_real TEXT,            -- Nome de quem pediu na ponta (Texto livre)
-        
-        prazo_entrega TEXT,
-        data_entrega_reprogramada TEXT,
-        status_compra TEXT DEFAULT 'Aguardando Aprovação',
-        data_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        
-        FOREIGN KEY (codi_empresa) REFERENCES empresas_compras (codi_empresa),
-        FOREIGN KEY (id_responsavel_chamado) REFERENCES usuarios (id),
-        FOREIGN KEY (id_comprador_responsavel) REFERENCES usuarios (id)
-    )
-    ''')
-    
-    # 4. Tabela de Itens do Pedido (1 Pedido -> Vários Itens)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS pedidos_itens (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        pedido_id INTEGER NOT NULL,
-        nome_item TEXT NOT NULL,
-        categoria TEXT,
-        quantidade INTEGER DEFAULT 1,
-        unidade_medida TEXT DEFAULT 'UN',
-        valor_estimado REAL DEFAULT 0.0,
-        FOREIGN KEY (pedido_id) REFERENCES acompanhamento_compras (id) ON DELETE CASCADE
-    )
-    ''')
-    
-    # 5. Tabela de Múltiplos Anexos
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS pedidos_anexos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        pedido_id INTEGER NOT NULL,
-        nome_arquivo TEXT NOT NULL,
-        nome_original TEXT,
-        data_upload TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (pedido_id) REFERENCES acompanhamento_compras (id) ON DELETE CASCADE
-    )
-    ''')
-    
+
+    if _estrutura_antiga(cursor):
+        connection.close()
+        print(f"❌ {caminho} tem a estrutura antiga. Renomeie ou apague o arquivo e rode de novo.")
+        return False
+
+    cursor.executescript(SCHEMA)
+
     # --- DADOS INICIAIS (SEED) ---
-    
+
     # Criar Administrador Padrão
     senha_admin = generate_password_hash('123456')
     try:
         cursor.execute("INSERT INTO usuarios (nome_completo, email, senha, nivel_acesso, aprovado) VALUES (?, ?, ?, ?, ?)",
                        ('Administrador', 'admin@nutrane.com.br', senha_admin, 'admin', 1))
         print("👤 Usuário Admin criado.")
-    except sqlite3.IntegrityError: 
+    except sqlite3.IntegrityError:
         print("👤 Usuário Admin já existe.")
 
     # Criar Empresas/Unidades do CSV
@@ -106,14 +174,14 @@ def criar_banco():
         (6, 'Nutrane Piaui'),
         (10, 'Nutrind')
     ]
-    try:
-        cursor.executemany("REPLACE INTO empresas_compras (codi_empresa, nome_empresa) VALUES (?, ?)", empresas)
-        print("🏢 Unidades (Filiais) cadastradas.")
-    except sqlite3.IntegrityError: pass
+    cursor.executemany("INSERT OR IGNORE INTO empresas_compras (codi_empresa, nome_empresa) VALUES (?, ?)", empresas)
+    print("🏢 Unidades (Filiais) cadastradas.")
 
-    connection.commit()
+    cursor.execute('PRAGMA optimize')
     connection.close()
-    print("✅ Banco de dados recriado com sucesso (Estrutura Completa)!")
+    print("✅ Banco de dados criado com sucesso (Estrutura Completa, modo WAL)!")
+    print("   Para usar: DB_BACKEND=sqlite no .env")
+    return True
 
 if __name__ == '__main__':
-    criar_banco()
\ No newline at end of file
+    criar_banco()
@@ -0,0 +1,282 @@
+"""
+Métricas de desempenho por rota: tempo total, quantidade e tempo de SQL, renderização
+de templates, geração/leitura de PDF e OCR. Tudo em memória, por processo.
+
+- Cada série é um histograma de faixas fixas (como o Prometheus): memória constante
+  e p50/p95/p99 estimados por interpolação dentro da faixa.
+- O SQL é medido no cursor do pool (banco_dados.CursorMedido); a requisição corrente
+  fica numa variável por thread (o Waitress atende uma requisição por thread).
+- Respostas em fluxo (exportação) contam só até o início do envio.
+- Telas: /admin/metrics (HTML) e /admin/metrics/prometheus (texto para o Prometheus).
+
+Desligue com METRICAS=0 (os cursores deixam de ser embrulhados).
+"""
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+HABILITADO = os.getenv('METRICAS', '1') != '0'
+MAX_CONSULTAS = int(os.getenv('METRICAS_MAX_CONSULTAS', 200))    # Textos de SQL distintos acompanhados
+PREFIXO = 'compras'
+
+# Limites superiores das faixas, em segundos (a última faixa é +Inf)
+FAIXAS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+# tipo -> (nome no Prometheus, nome do rótulo, descrição)
+TIPOS = {
+    'requisicao': ('requisicao_segundos', 'rota', 'Tempo total da requisição'),
+    'sql_requisicao': ('requisicao_sql_segundos', 'rota', 'Tempo de SQL somado por requisição'),
+    'template': ('template_segundos', 'template', 'Renderização de template'),
+    'sql': ('sql_segundos', 'consulta', 'Execução de um comando SQL'),
+    'pdf': ('pdf_segundos', 'etapa', 'Geração ou leitura de PDF'),
+    'ocr': ('ocr_segundos', 'etapa', 'OCR (tempo de processamento no worker)'),
+}
+OUTRAS = 'outras'
+
+
+class Histograma:
+    __slots__ = ('contagens', 'total', 'soma', 'maximo')
+
+    def __init__(self):
+        self.contagens = [0] * (len(FAIXAS) + 1)
+        self.total = 0
+        self.soma = 0.0
+        self.maximo = 0.0
+
+    def observar(self, valor):
+        i = 0
+        while i < len(FAIXAS) and valor > FAIXAS[i]:
+            i += 1
+        self.contagens[i] += 1
+        self.total += 1
+        self.soma += valor
+        if valor > self.maximo:
+            self.maximo = valor
+
+    def percentil(self, p):
+        """Estimativa por interpolação linear dentro da faixa (mesma ideia do histogram_quantile)."""
+        if not self.total:
+            return 0.0
+        alvo = p / 100 * self.total
+        acumulado = 0
+        for i, qtd in enumerate(self.contagens):
+            if acumulado + qtd >= alvo and qtd:
+                if i == len(FAIXAS):
+                    return self.maximo
+                inicio = FAIXAS[i - 1] if i else 0.0
+                fim = min(FAIXAS[i], self.maximo)
+                return inicio + (fim - inicio) * (alvo - acumulado) / qtd
+            acumulado += qtd
+        return self.maximo
+
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}       # (tipo, nome) -> Histograma
+        self._rotas = {}        # rota -> {'consultas': n, 'erros': n}
+        self.desde = time.time()
+
+    def observar(self, tipo, nome, segundos):
+        with self._lock:
+            chave = (tipo, nome)
+            serie = self._series.get(chave)
+            if serie is None:
+                if tipo == 'sql' and sum(1 for t, _ in self._series if t == 'sql') >= MAX_CONSULTAS:
+                    chave = (tipo, OUTRAS)
+                    serie = self._series.setdefault(chave, Histograma())
+                else:
+                    serie = self._series[chave] = Histograma()
+            serie.observar(segundos)
+
+    def registrar_requisicao(self, rota, segundos, sql_segundos, consultas, erro):
+        with self._lock:
+            for tipo, valor in (('requisicao', segundos), ('sql_requisicao', sql_segundos)):
+                self._series.setdefault((tipo, rota), Histograma()).observar(valor)
+            contadores = self._rotas.setdefault(rota, {'consultas': 0, 'erros': 0})
+            contadores['consultas'] += consultas
+            contadores['erros'] += int(erro)
+
+    def zerar(self):
+        with self._lock:
+            self._series.clear()
+            self._rotas.clear()
+            self.desde = time.time()
+
+    def _copia(self):
+        with self._lock:
+            series = {}
+            for chave, h in self._series.items():
+                copia = Histograma()
+                copia.contagens, copia.total, copia.soma, copia.maximo = list(h.contagens), h.total, h.soma, h.maximo
+                series[chave] = copia
+            return series, {r: dict(c) for r, c in self._rotas.items()}
+
+    def resumo(self):
+        """{'rotas': [...], tipo: [...]} com p50/p95/p99 em ms, cada lista da mais custosa para a menos."""
+        series, rotas = self._copia()
+
+        def linha(nome, h):
+            return {'nome': nome, 'qtd': h.total, 'total_ms': h.soma * 1000, 'media_ms': h.soma / h.total * 1000,
+                    'p50_ms': h.percentil(50) * 1000, 'p95_ms': h.percentil(95) * 1000,
+                    'p99_ms': h.percentil(99) * 1000, 'max_ms': h.maximo * 1000}
+
+        resultado = {tipo: [] for tipo in TIPOS if tipo not in ('requisicao', 'sql_requisicao')}
+        resultado['rotas'] = []
+        for (tipo, nome), h in series.items():
+            if not h.total:
+                continue
+            if tipo == 'requisicao':
+                item = linha(nome, h)
+                sql = series.get(('sql_requisicao', nome))
+                contadores = rotas.get(nome, {'consultas': 0, 'erros': 0})
+                item.update(sql_media_ms=sql.soma / sql.total * 1000 if sql and sql.total else 0.0,
+                            consultas_media=contadores['consultas'] / h.total, erros=contadores['erros'])
+                resultado['rotas'].append(item)
+            elif tipo in resultado:
+                resultado[tipo].append(linha(nome, h))
+        for lista in resultado.values():
+            lista.sort(key=lambda r: r['total_ms'], reverse=True)
+        resultado['desde'] = self.desde
+        return resultado
+
+    def texto_prometheus(self):
+        series, rotas = self._copia()
+        linhas = []
+        for tipo, (nome_metrica, rotulo, descricao) in TIPOS.items():
+            nome_metrica = f"{PREFIXO}_{nome_metrica}"
+            do_tipo = sorted((nome, h) for (t, nome), h in series.items() if t == tipo)
+            if not do_tipo:
+                continue
+            linhas.append(f"# HELP {nome_metrica} {descricao}")
+            linhas.append(f"# TYPE {nome_metrica} histogram")
+            for nome, h in do_tipo:
+                valor_rotulo = _escapar(nome)
+                acumulado = 0
+                for limite, qtd in zip(FAIXAS + ('+Inf',), h.contagens):
+                    acumulado += qtd
+                    linhas.append(f'{nome_metrica}_bucket{{{rotulo}="{valor_rotulo}",le="{limite}"}} {acumulado}')
+                linhas.append(f'{nome_metrica}_sum{{{rotulo}="{valor_rotulo}"}} {h.soma:.6f}')
+                linhas.append(f'{nome_metrica}_count{{{rotulo}="{valor_rotulo}"}} {h.total}')
+
+        for campo, descricao in (('consultas', 'Comandos SQL executados'), ('erros', 'Respostas com status 5xx')):
+            nome_metrica = f"{PREFIXO}_requisicao_{'consultas_sql' if campo == 'consultas' else 'erros'}_total"
+            linhas.append(f"# HELP {nome_metrica} {descricao}")
+            linhas.append(f"# TYPE {nome_metrica} counter")
+            for rota, contadores in sorted(rotas.items()):
+                linhas.append(f'{nome_metrica}{{rota="{_escapar(rota)}"}} {contadores[campo]}')
+        return "\n".join(linhas) + "\n"
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+@lru_cache(maxsize=1024)
+def normalizar_sql(sql):
+    """Uma série por comando: junta espaços e colapsa listas de %s (IN, VALUES de várias linhas)."""
+    texto = ' '.join(str(sql).split())
+    texto = re.sub(r'%s(?:\s*,\s*%s)+', '%s…', texto)
+    texto = re.sub(r'\(%s…?\)(?:\s*,\s*\(%s…?\))+', '(%s…)…', texto)
+    return texto[:160]
+
+
+metricas = Metricas()
+
+
+# --- REQUISIÇÃO CORRENTE (uma por thread) ---
+
+_local = threading.local()
+
+
+def iniciar_requisicao():
+    _local.requisicao = {'inicio': time.perf_counter(), 'sql_segundos': 0.0, 'consultas': 0, 'template_segundos': 0.0}
+
+
+def requisicao_atual():
+    return getattr(_local, 'requisicao', None)
+
+
+def finalizar_requisicao(rota, status):
+    """Registra a requisição corrente e devolve seus números (para o cabeçalho Server-Timing)."""
+    atual = requisicao_atual()
+    _local.requisicao = None
+    if atual is None:
+        return None
+    atual['segundos'] = time.perf_counter() - atual['inicio']
+    metricas.registrar_requisicao(rota, atual['segundos'], atual['sql_segundos'], atual['consultas'], status >= 500)
+    return atual
+
+
+def registrar_sql(sql, segundos):
+    metricas.observar('sql', normalizar_sql(sql), segundos)
+    atual = requisicao_atual()
+    if atual is not None:
+        atual['consultas'] += 1
+        atual['sql_segundos'] += segundos
+
+
+def registrar_template(nome, segundos):
+    metricas.observar('template', nome or 'sem_nome', segundos)
+    atual = requisicao_atual()
+    if atual is not None:
+        atual['template_segundos'] += segundos
+
+
+@contextmanager
+def medir(tipo, nome):
+    """with medir('pdf', 'relatorio_performance'): ..."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        metricas.observar(tipo, nome, time.perf_counter() - inicio)
+
+
+def cronometrar(funcao, *args):
+    """Para o pool de processos do OCR: devolve (resultado, segundos) medidos dentro do worker."""
+    inicio = time.perf_counter()
+    resultado = funcao(*args)
+    return resultado, time.perf_counter() - inicio
+
+
+# --- LIGAÇÃO COM O FLASK ---
+
+def instrumentar(app):
+    """Mede toda requisição do app e cada template renderizado; adiciona o cabeçalho Server-Timing."""
+    if not HABILITADO:
+        return
+    from flask import request, before_render_template, template_rendered
+
+    @app.before_request
+    def _inicio_requisicao():
+        iniciar_requisicao()
+
+    @app.after_request
+    def _fim_requisicao(resposta):
+        atual = finalizar_requisicao(request.endpoint or 'nao_encontrada', resposta.status_code)
+        if atual is not None:
+            # Aparece na aba Rede das ferramentas do navegador (Timing)
+            resposta.headers['Server-Timing'] = (
+                f'total;dur={atual["segundos"] * 1000:.1f}, '
+                f'sql;dur={atual["sql_segundos"] * 1000:.1f};desc="{atual["consultas"]} consultas", '
+                f'template;dur={atual["template_segundos"] * 1000:.1f}'
+            )
+        return resposta
+
+    def _antes_template(remetente, template, context, **extras):
+        pilha = getattr(_local, 'templates', None)
+        if pilha is None:
+            pilha = _local.templates = []
+        pilha.append(time.perf_counter())
+
+    def _depois_template(remetente, template, context, **extras):
+        pilha = getattr(_local, 'templates', None)
+        if pilha:
+            registrar_template(template.name, time.perf_counter() - pilha.pop())
+
+    before_render_template.connect(_antes_template, app, weak=False)
+    template_rendered.connect(_depois_template, app, weak=False)
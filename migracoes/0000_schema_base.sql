@@ -0,0 +1,69 @@
+-- Estrutura base do MariaDB/MySQL usada pelo app (as migrações seguintes partem dela).
+-- Em um banco que já existia antes do migrar.py, não rode este arquivo: registre as
+-- migrações já aplicadas com   python migrar.py --marcar-ate 0005
+-- Usuário admin e unidades iniciais: cadastre pela tela de registro / admin.
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    nome_completo VARCHAR(150) NOT NULL,
+    email VARCHAR(190) NOT NULL,
+    senha VARCHAR(255) NOT NULL,
+    nivel_acesso VARCHAR(20) NOT NULL DEFAULT 'comprador',
+    aprovado TINYINT NOT NULL DEFAULT 0,
+    UNIQUE KEY uq_usuarios_email (email)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS empresas_compras (
+    codi_empresa INT NOT NULL PRIMARY KEY,
+    nome_empresa VARCHAR(150) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS acompanhamento_compras (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    data_registro DATETIME DEFAULT CURRENT_TIMESTAMP,
+    data_abertura VARCHAR(50),
+    numero_solicitacao VARCHAR(50) NOT NULL,
+    numero_orcamento VARCHAR(50),
+    numero_pedido VARCHAR(50),
+    item_comprado VARCHAR(255),
+    categoria VARCHAR(100),
+    fornecedor VARCHAR(255),
+    data_compra DATE,
+    nota_fiscal VARCHAR(50),
+    serie_nota VARCHAR(10),
+    observacao TEXT,
+    codi_empresa INT NOT NULL,
+    id_responsavel_chamado INT,
+    id_comprador_responsavel INT,
+    solicitante_real VARCHAR(255),
+    prazo_entrega DATE,
+    data_entrega_reprogramada DATE,
+    data_entrega_real DATE,
+    entrega_conforme TINYINT,
+    detalhes_entrega TEXT,
+    status_compra VARCHAR(50) NOT NULL DEFAULT 'Aguardando Aprovação',
+    CONSTRAINT fk_pedido_empresa FOREIGN KEY (codi_empresa) REFERENCES empresas_compras (codi_empresa),
+    CONSTRAINT fk_pedido_responsavel FOREIGN KEY (id_responsavel_chamado) REFERENCES usuarios (id) ON DELETE RESTRICT,
+    CONSTRAINT fk_pedido_comprador FOREIGN KEY (id_comprador_responsavel) REFERENCES usuarios (id) ON DELETE RESTRICT
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS pedidos_itens (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    pedido_id INT NOT NULL,
+    nome_item VARCHAR(255) NOT NULL,
+    quantidade INT NOT NULL DEFAULT 1,
+    unidade_medida VARCHAR(10) NOT NULL DEFAULT 'UN',
+    valor_unitario DECIMAL(15,2) NOT NULL DEFAULT 0,
+    KEY idx_itens_pedido (pedido_id),
+    CONSTRAINT fk_item_pedido FOREIGN KEY (pedido_id) REFERENCES acompanhamento_compras (id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS pedidos_anexos (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    pedido_id INT NOT NULL,
+    nome_arquivo VARCHAR(255) NOT NULL,
+    nome_original VARCHAR(255),
+    data_upload DATETIME DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_anexos_pedido (pedido_id),
+    CONSTRAINT fk_anexo_pedido FOREIGN KEY (pedido_id) REFERENCES acompanhamento_compras (id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
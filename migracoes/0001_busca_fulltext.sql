@@ -0,0 +1,10 @@
+-- Índices FULLTEXT usados pela barra de pesquisa do dashboard (campo "busca").
+-- Substituem os quatro LIKE '%termo%' que obrigavam a varrer a tabela inteira.
+-- Palavras com menos de innodb_ft_min_token_size (padrão 3) caracteres não são
+-- indexadas; para elas o app busca por prefixo em numero_solicitacao/numero_pedido.
+
+ALTER TABLE acompanhamento_compras
+    ADD FULLTEXT INDEX IF NOT EXISTS ft_busca_pedido (numero_solicitacao, numero_pedido, fornecedor, item_comprado);
+
+ALTER TABLE pedidos_itens
+    ADD FULLTEXT INDEX IF NOT EXISTS ft_busca_item (nome_item);
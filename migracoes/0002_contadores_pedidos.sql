@@ -0,0 +1,15 @@
+-- Contadores de pedidos usados pelos cards e gráficos do dashboard (contadores.py).
+-- faixa_prazo: data prevista 'AAAA-MM-DD', 'SEM_PRAZO' ou 'VENCIDO'.
+-- id_comprador = 0 quando o pedido não tem comprador responsável.
+-- Depois de criar a tabela, carregue os valores iniciais com:
+--     python contadores.py --reconstruir
+
+CREATE TABLE IF NOT EXISTS contadores_pedidos (
+    codi_empresa INT NOT NULL,
+    id_comprador INT NOT NULL DEFAULT 0,
+    status_compra VARCHAR(50) NOT NULL,
+    faixa_prazo VARCHAR(10) NOT NULL,
+    qtd INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (codi_empresa, id_comprador, status_compra, faixa_prazo),
+    KEY idx_contadores_faixa (faixa_prazo)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
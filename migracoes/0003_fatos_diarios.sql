@@ -0,0 +1,22 @@
+-- Fatos diários da tela de Performance e do relatório em PDF (fatos_performance.py).
+-- Uma linha por (dia de registro, unidade, fornecedor) com somas e contagens que podem
+-- ser combinadas para qualquer período. Depois de criar a tabela, faça a carga inicial:
+--     python fatos_performance.py --reconstruir
+
+CREATE TABLE IF NOT EXISTS fatos_diarios (
+    dia DATE NOT NULL,
+    codi_empresa INT NOT NULL,
+    fornecedor VARCHAR(255) NOT NULL DEFAULT '',
+    qtd_pedidos INT NOT NULL DEFAULT 0,
+    qtd_entregues INT NOT NULL DEFAULT 0,
+    qtd_conformes INT NOT NULL DEFAULT 0,
+    qtd_nao_conformes INT NOT NULL DEFAULT 0,
+    qtd_com_entrega_real INT NOT NULL DEFAULT 0,
+    soma_lead_dias INT NOT NULL DEFAULT 0,
+    qtd_abertos INT NOT NULL DEFAULT 0,
+    qtd_atrasados INT NOT NULL DEFAULT 0,
+    valor_aberto DECIMAL(15,2) NOT NULL DEFAULT 0,
+    atualizado_em TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+    PRIMARY KEY (dia, codi_empresa, fornecedor),
+    KEY idx_fatos_empresa_dia (codi_empresa, dia)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
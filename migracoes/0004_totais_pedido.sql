@@ -0,0 +1,17 @@
+-- Total do pedido e quantidade de itens guardados no cabeçalho (totais_pedido.py).
+-- O app mantém os valores a cada gravação de itens; o UPDATE abaixo faz a carga inicial.
+-- Para conferir/corrigir depois: python totais_pedido.py --verificar | --reparar
+-- Como os fatos de performance passam a ler valor_total, refaça-os em seguida:
+--     python fatos_performance.py --reconstruir
+
+ALTER TABLE acompanhamento_compras
+    ADD COLUMN IF NOT EXISTS valor_total DECIMAL(15,2) NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS qtd_itens INT NOT NULL DEFAULT 0;
+
+UPDATE acompanhamento_compras c
+LEFT JOIN (
+    SELECT pedido_id, SUM(quantidade * valor_unitario) AS valor, COUNT(*) AS itens
+    FROM pedidos_itens GROUP BY pedido_id
+) t ON t.pedido_id = c.id
+SET c.valor_total = COALESCE(t.valor, 0),
+    c.qtd_itens = COALESCE(t.itens, 0);
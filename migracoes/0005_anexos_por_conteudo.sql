@@ -0,0 +1,10 @@
+-- Anexos guardados por conteúdo (armazem_anexos.py): o hash SHA-256 identifica o arquivo em disco e
+-- cada linha com o mesmo hash é uma referência a ele. O índice atende a contagem de referências
+-- feita ao excluir anexos/pedidos.
+-- Os anexos já existentes seguem funcionando; para movê-los e unificar duplicados:
+--     python armazem_anexos.py --migrar-legado
+
+ALTER TABLE pedidos_anexos
+    ADD COLUMN IF NOT EXISTS hash_conteudo CHAR(64) NULL,
+    ADD COLUMN IF NOT EXISTS tamanho BIGINT NULL,
+    ADD INDEX IF NOT EXISTS idx_anexos_hash (hash_conteudo);
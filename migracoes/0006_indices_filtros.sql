@@ -0,0 +1,22 @@
+-- Índices das colunas usadas nos filtros do dashboard, na exportação, nos fatos de
+-- performance e nas telas de pedido. Conferir com: python migrar.py --verificar
+-- (IF NOT EXISTS: bancos antigos podem já ter parte deles criada à mão.)
+--
+-- No InnoDB todo índice secundário termina na chave primária, então (codi_empresa)
+-- já entrega os pedidos da unidade em ordem de id para a paginação por cursor.
+
+ALTER TABLE acompanhamento_compras
+    ADD INDEX IF NOT EXISTS idx_pedidos_empresa_status (codi_empresa, status_compra),
+    ADD INDEX IF NOT EXISTS idx_pedidos_comprador_status (id_comprador_responsavel, status_compra),
+    ADD INDEX IF NOT EXISTS idx_pedidos_status (status_compra),
+    ADD INDEX IF NOT EXISTS idx_pedidos_registro (data_registro),
+    ADD INDEX IF NOT EXISTS idx_pedidos_empresa_registro (codi_empresa, data_registro),
+    ADD INDEX IF NOT EXISTS idx_pedidos_prazo (prazo_entrega),
+    ADD INDEX IF NOT EXISTS idx_pedidos_solicitacao (numero_solicitacao),
+    ADD INDEX IF NOT EXISTS idx_pedidos_numero_pedido (numero_pedido);
+
+ALTER TABLE pedidos_itens
+    ADD INDEX IF NOT EXISTS idx_itens_pedido (pedido_id);
+
+ALTER TABLE pedidos_anexos
+    ADD INDEX IF NOT EXISTS idx_anexos_pedido (pedido_id);
@@ -0,0 +1,31 @@
+-- Situação do pedido em forma compacta e indexável (ver situacao.py).
+-- status_compra continua sendo o texto exibido; as duas colunas abaixo são geradas
+-- pelo banco (STORED), então toda escrita as mantém e este ALTER preenche as
+-- linhas existentes. Consultas filtram por em_aberto em vez de LIKE '%Entregue%'.
+--
+-- codigo_status: 1..6 na ordem de situacao.CODIGOS; 0 = texto fora da lista (planilhas antigas)
+-- em_aberto:     1 enquanto o pedido não foi entregue (parcial ou totalmente)
+-- Mantenha a CASE igual a situacao.CODIGOS.
+
+ALTER TABLE acompanhamento_compras
+    ADD COLUMN IF NOT EXISTS codigo_status TINYINT UNSIGNED AS (
+        CASE status_compra
+            WHEN 'Aguardando Aprovação' THEN 1
+            WHEN 'Orçamento' THEN 2
+            WHEN 'Confirmado' THEN 3
+            WHEN 'Em Trânsito' THEN 4
+            WHEN 'Entregue Parcialmente' THEN 5
+            WHEN 'Entregue Totalmente' THEN 6
+            ELSE 0
+        END) STORED,
+    ADD COLUMN IF NOT EXISTS em_aberto TINYINT AS (
+        CASE WHEN status_compra LIKE '%Entregue%' THEN 0 ELSE 1 END) STORED;
+
+-- Atrasados (fatos diários, relatório PDF): em_aberto = 1 AND prazo_entrega < hoje
+-- Entregues do período (relatório PDF):     em_aberto = 0 AND data_registro >= ... AND < ...
+-- Dashboard (fornecedores, compradores, linha do tempo de abertos) por unidade/comprador
+ALTER TABLE acompanhamento_compras
+    ADD INDEX IF NOT EXISTS idx_pedidos_aberto_prazo (em_aberto, prazo_entrega),
+    ADD INDEX IF NOT EXISTS idx_pedidos_aberto_registro (em_aberto, data_registro),
+    ADD INDEX IF NOT EXISTS idx_pedidos_empresa_aberto (codi_empresa, em_aberto),
+    ADD INDEX IF NOT EXISTS idx_pedidos_comprador_aberto (id_comprador_responsavel, em_aberto);
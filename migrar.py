@@ -0,0 +1,274 @@
+"""
+Aplica as migrações de migracoes/ (NNNN_descricao.sql) em ordem e registra cada uma
+na tabela schema_migracoes, para que nenhuma rode duas vezes.
+
+- Cada arquivo é dividido em comandos pelo ';' no fim da linha; linhas '--' são comentários.
+- No MariaDB DDL não é transacional: a versão só é registrada depois que todos os comandos
+  do arquivo passam. Escreva migrações que possam ser repetidas (IF NOT EXISTS).
+- Algumas migrações precisam de uma carga em Python (ex: contadores). As cargas das
+  migrações aplicadas (POS_MIGRACAO) rodam uma vez cada, depois de todo o SQL pendente,
+  porque leem colunas criadas por migrações posteriores (valor_total, em_aberto).
+- Só para MySQL/MariaDB: o banco SQLite (DB_BACKEND=sqlite) é criado já atualizado pelo init_db.py.
+- --verificar roda EXPLAIN nas consultas mais frequentes do app e falha se alguma
+  varrer uma tabela grande inteira (tipo ALL).
+
+Uso pela linha de comando:
+    python migrar.py                      (aplica as pendentes)
+    python migrar.py --status             (lista aplicadas e pendentes)
+    python migrar.py --marcar-ate 0005    (banco que já existia: registra até 0005 sem rodar)
+    python migrar.py --verificar          (EXPLAIN das consultas quentes)
+"""
+import os
+import re
+import sys
+import hashlib
+from datetime import date
+
+PASTA_MIGRACOES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migracoes')
+RE_ARQUIVO = re.compile(r'^(\d{4})_[\w-]+\.sql$')
+
+# Tabelas de consulta (unidades, usuários) são minúsculas: varrê-las num JOIN é normal
+ALIASES_PEQUENOS = {'e', 'u', 'u1', 'u2'}
+# Abaixo disso o otimizador prefere varrer mesmo tendo índice (banco de teste quase vazio)
+LINHAS_MINIMAS_VARREDURA = 1000
+
+
+def _carga_contadores(conn):
+    import contadores
+    contadores.reconstruir(conn)
+
+
+def _carga_fatos(conn):
+    import fatos_performance
+    fatos_performance.reconstruir(conn)
+
+
+# Versão -> carga a rodar ao final, quando ela ou uma posterior for aplicada
+POS_MIGRACAO = {
+    '0002': _carga_contadores,
+    '0003': _carga_fatos,
+    '0004': _carga_fatos,
+    '0007': _carga_fatos,
+}
+
+
+def listar_migracoes(pasta=PASTA_MIGRACOES):
+    """[(versao, arquivo, caminho)] em ordem."""
+    migracoes = []
+    for nome in sorted(os.listdir(pasta)):
+        m = RE_ARQUIVO.match(nome)
+        if m:
+            migracoes.append((m.group(1), nome, os.path.join(pasta, nome)))
+    return migracoes
+
+
+def comandos_sql(texto):
+    comandos = []
+    atual = []
+    for linha in texto.splitlines():
+        if linha.strip().startswith('--') or not linha.strip():
+            continue
+        atual.append(linha)
+        if linha.rstrip().endswith(';'):
+            comandos.append('\n'.join(atual).rstrip().rstrip(';'))
+            atual = []
+    if atual:
+        comandos.append('\n'.join(atual))
+    return comandos
+
+
+def _checksum(caminho):
+    with open(caminho, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _garantir_tabela(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migracoes (
+            versao CHAR(4) NOT NULL PRIMARY KEY,
+            arquivo VARCHAR(255) NOT NULL,
+            checksum CHAR(64) NOT NULL,
+            aplicada_em DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+
+
+def aplicadas(cursor):
+    _garantir_tabela(cursor)
+    cursor.execute('SELECT versao, arquivo, checksum, aplicada_em FROM schema_migracoes ORDER BY versao')
+    return {r['versao']: r for r in cursor.fetchall()}
+
+
+def _registrar(cursor, versao, arquivo, caminho):
+    cursor.execute('INSERT INTO schema_migracoes (versao, arquivo, checksum) VALUES (%s, %s, %s)',
+                   (versao, arquivo, _checksum(caminho)))
+
+
+def migrar(conn, pasta=PASTA_MIGRACOES, saida=print):
+    """Aplica as migrações pendentes. Devolve a lista de versões aplicadas."""
+    cursor = conn.cursor()
+    try:
+        feitas = aplicadas(cursor)
+        novas = []
+        cargas = []
+        for versao, arquivo, caminho in listar_migracoes(pasta):
+            if versao in feitas:
+                continue
+            saida(f"⏳ {arquivo}")
+            with open(caminho, encoding='utf-8') as f:
+                for comando in comandos_sql(f.read()):
+                    cursor.execute(comando)
+            _registrar(cursor, versao, arquivo, caminho)
+            novas.append(versao)
+            saida(f"✅ {arquivo}")
+            carga = POS_MIGRACAO.get(versao)
+            if carga and carga not in cargas:
+                cargas.append(carga)
+    finally:
+        cursor.close()
+
+    # Só agora a estrutura está completa; se uma carga falhar, rode-a de novo pelo script dela
+    for carga in cargas:
+        saida(f"⏳ Carga: {carga.__name__.replace('_carga_', '')}")
+        carga(conn)
+    return novas
+
+
+def marcar_ate(conn, ate, pasta=PASTA_MIGRACOES):
+    """Registra como aplicadas (sem rodar) as migrações até `ate`, para bancos criados antes do migrar.py."""
+    cursor = conn.cursor()
+    try:
+        feitas = aplicadas(cursor)
+        marcadas = []
+        for versao, arquivo, caminho in listar_migracoes(pasta):
+            if versao <= ate and versao not in feitas:
+                _registrar(cursor, versao, arquivo, caminho)
+                marcadas.append(versao)
+        return marcadas
+    finally:
+        cursor.close()
+
+
+# --- VERIFICAÇÃO DOS ÍNDICES (EXPLAIN) ---
+
+def consultas_quentes(hoje=None):
+    """(nome, SQL, parâmetros) das consultas mais frequentes do app, com valores de exemplo."""
+    hoje = (hoje or date.today()).isoformat()
+    pagina = '''SELECT c.*, e.nome_empresa, u2.nome_completo AS nome_comprador
+                FROM acompanhamento_compras c
+                JOIN empresas_compras e ON c.codi_empresa = e.codi_empresa
+                LEFT JOIN usuarios u2 ON c.id_comprador_responsavel = u2.id'''
+    return [
+        ('Dashboard: primeira página', f'{pagina} ORDER BY c.id DESC LIMIT 11', []),
+        ('Dashboard: unidade', f'{pagina} WHERE c.codi_empresa = %s ORDER BY c.id DESC LIMIT 11', [1]),
+        ('Dashboard: comprador', f'{pagina} WHERE c.id_comprador_responsavel = %s ORDER BY c.id DESC LIMIT 11', [1]),
+        ('Dashboard: situação', f'{pagina} WHERE c.status_compra = %s ORDER BY c.id DESC LIMIT 11', ['Confirmado']),
+        ('Dashboard: unidade + situação',
+         f'{pagina} WHERE c.codi_empresa = %s AND c.status_compra = %s ORDER BY c.id DESC LIMIT 11', [1, 'Confirmado']),
+        ('Dashboard: período de registro',
+         f'{pagina} WHERE c.data_registro >= %s AND c.data_registro <= %s ORDER BY c.id DESC LIMIT 11',
+         [f'{hoje} 00:00:00', f'{hoje} 23:59:59']),
+        ('Dashboard: nº da solicitação (prefixo)',
+         'SELECT id FROM acompanhamento_compras WHERE numero_solicitacao LIKE %s', ['589%']),
+        ('Dashboard: nº do pedido (prefixo)',
+         'SELECT id FROM acompanhamento_compras WHERE numero_pedido LIKE %s', ['589%']),
+        ('Dashboard: KPIs da unidade',
+         '''SELECT COUNT(*), SUM(c.valor_total) FROM acompanhamento_compras c
+            JOIN empresas_compras e ON c.codi_empresa = e.codi_empresa WHERE c.codi_empresa = %s''', [1]),
+        ('Importação: solicitações já cadastradas',
+         'SELECT DISTINCT numero_solicitacao FROM acompanhamento_compras WHERE numero_solicitacao IN (%s, %s)',
+         ['589', '590']),
+        ('Fatos: pedidos de um dia',
+         'SELECT id FROM acompanhamento_compras c WHERE c.data_registro >= %s AND c.data_registro < %s',
+         [hoje, hoje]),
+        ('Fatos: dias com pedidos abertos vencidos',
+         'SELECT DISTINCT DATE(data_registro) FROM acompanhamento_compras WHERE em_aberto = 1 AND prazo_entrega < %s',
+         [hoje]),
+        ('Relatório PDF: entregues do período',
+         'SELECT id FROM acompanhamento_compras c WHERE c.em_aberto = 0 AND c.data_registro >= %s AND c.data_registro < %s',
+         [hoje, hoje]),
+        ('Dashboard: abertos da unidade',
+         'SELECT c.fornecedor, COUNT(*) FROM acompanhamento_compras c WHERE c.codi_empresa = %s AND c.em_aberto = 1 GROUP BY c.fornecedor',
+         [1]),
+        ('Performance: fatos do período', 'SELECT SUM(qtd_pedidos) FROM fatos_diarios WHERE dia BETWEEN %s AND %s',
+         [hoje, hoje]),
+        ('Pedido: itens', 'SELECT * FROM pedidos_itens WHERE pedido_id = %s', [1]),
+        ('Pedido: anexos', 'SELECT * FROM pedidos_anexos WHERE pedido_id = %s', [1]),
+        ('Anexos: referências ao arquivo',
+         'SELECT COUNT(*) FROM pedidos_anexos WHERE hash_conteudo = %s AND nome_arquivo = %s', ['0' * 64, 'x']),
+        ('Login', 'SELECT * FROM usuarios WHERE email = %s', ['admin@exemplo.com']),
+    ]
+
+
+def varreduras(plano):
+    """Linhas do EXPLAIN que leem uma tabela grande inteira."""
+    problemas = []
+    for linha in plano:
+        tabela = linha.get('table') or ''
+        if linha.get('type') != 'ALL' or tabela.startswith('<') or tabela in ALIASES_PEQUENOS:
+            continue
+        # Com índice possível e tabela pequena, a varredura é escolha do otimizador, não falta de índice
+        if linha.get('possible_keys') and int(linha.get('rows') or 0) < LINHAS_MINIMAS_VARREDURA:
+            continue
+        problemas.append(linha)
+    return problemas
+
+
+def verificar(conn, saida=print):
+    """Roda EXPLAIN em cada consulta quente. Devolve True se nenhuma faz varredura completa."""
+    cursor = conn.cursor()
+    ok = True
+    try:
+        for nome, sql, params in consultas_quentes():
+            cursor.execute('EXPLAIN ' + sql, params)
+            plano = cursor.fetchall()
+            problemas = varreduras(plano)
+            if problemas:
+                ok = False
+                for p in problemas:
+                    saida(f"❌ {nome}: varre {p['table']} inteira (~{p.get('rows')} linhas, índices possíveis: {p.get('possible_keys') or 'nenhum'})")
+            else:
+                usados = ', '.join(f"{l['table']}={l.get('key') or l.get('type')}" for l in plano)
+                saida(f"✅ {nome}: {usados}")
+        return ok
+    finally:
+        cursor.close()
+
+
+if __name__ == '__main__':
+    import banco_dados
+    if banco_dados.DB_BACKEND == 'sqlite':
+        print("ℹ️ Com DB_BACKEND=sqlite a estrutura completa é criada pelo init_db.py; as migrações são só do MySQL.")
+        sys.exit(0)
+    conn = banco_dados.obter_conexao()
+    try:
+        if '--verificar' in sys.argv:
+            sys.exit(0 if verificar(conn) else 1)
+
+        if '--marcar-ate' in sys.argv:
+            posicao = sys.argv.index('--marcar-ate') + 1
+            if posicao >= len(sys.argv) or not re.fullmatch(r'\d{4}', sys.argv[posicao]):
+                print("Uso: python migrar.py --marcar-ate NNNN")
+                sys.exit(1)
+            marcadas = marcar_ate(conn, sys.argv[posicao])
+            print(f"✅ {len(marcadas)} migração(ões) registrada(s) sem executar: {', '.join(marcadas) or '-'}")
+            sys.exit(0)
+
+        if '--status' in sys.argv:
+            cursor = conn.cursor()
+            feitas = aplicadas(cursor)
+            cursor.close()
+            for versao, arquivo, caminho in listar_migracoes():
+                registro = feitas.get(versao)
+                if not registro:
+                    print(f"⏳ {arquivo} (pendente)")
+                elif registro['checksum'] != _checksum(caminho):
+                    print(f"⚠️ {arquivo} (aplicada em {registro['aplicada_em']}, mas o arquivo mudou depois)")
+                else:
+                    print(f"✅ {arquivo} (aplicada em {registro['aplicada_em']})")
+            sys.exit(0)
+
+        novas = migrar(conn)
+        print(f"Banco atualizado: {len(novas)} migração(ões) aplicada(s).")
+    finally:
+        conn.close()
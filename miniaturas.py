@@ -0,0 +1,136 @@
+"""
+Miniaturas dos anexos (imagens e primeira página de PDFs) para as telas de pedido.
+
+As páginas do pedido mostram JPEGs de poucos KB em vez de obrigar o comprador a
+baixar a digitalização inteira só para achar a nota fiscal.
+
+- Geradas na primeira visualização ou, logo após o upload, numa thread de fundo.
+- Guardadas em disco com despejo LRU (cache_disco.py). A chave é o hash do conteúdo
+  do anexo (ou nome + tamanho + data para anexos antigos, sem hash), então a mesma
+  NF anexada em vários pedidos gera uma miniatura só.
+- PDFs são rasterizados com o pypdfium2; sem ele, só as imagens ganham miniatura.
+"""
+import os
+import hashlib
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from cache_disco import CacheDisco
+
+HAS_PDFIUM = False
+try:
+    import pypdfium2 as pdfium
+    HAS_PDFIUM = True
+except ImportError:
+    print("⚠️ Biblioteca 'pypdfium2' não encontrada: PDFs ficam sem miniatura.")
+
+PASTA_MINIATURAS = os.getenv('MINIATURAS_PASTA', 'cache_miniaturas')
+MINIATURAS_MAX_MB = int(os.getenv('MINIATURAS_MAX_MB', 100))
+MINIATURAS_MAX_ITENS = int(os.getenv('MINIATURAS_MAX_ITENS', 20000))
+MINIATURA_LADO = int(os.getenv('MINIATURA_LADO', 320))
+MINIATURA_QUALIDADE = 80
+
+# Aumente quando a forma de gerar mudar: miniaturas antigas deixam de valer
+VERSAO_MINIATURA = 1
+
+EXTENSOES_IMAGEM = {'png', 'jpg', 'jpeg'}
+
+
+def _abrir_pdf(caminho, lado):
+    pdf = pdfium.PdfDocument(caminho)
+    try:
+        if len(pdf) == 0:
+            return None
+        pagina = pdf[0]
+        try:
+            largura, altura = pagina.get_size()     # em pontos (1/72")
+            return pagina.render(scale=lado / max(largura, altura, 1)).to_pil()
+        finally:
+            pagina.close()
+    finally:
+        pdf.close()
+
+
+def _abrir_imagem(caminho, lado):
+    imagem = Image.open(caminho)
+    # JPEG: decodifica já reduzido (fotos de celular de 12 MP abrem em uma fração do tempo)
+    imagem.draft('RGB', (lado, lado))
+    return ImageOps.exif_transpose(imagem)
+
+
+def gerar(caminho, lado=MINIATURA_LADO):
+    """Devolve os bytes JPEG da miniatura, ou None se o tipo de arquivo não tiver prévia."""
+    extensao = caminho.rsplit('.', 1)[-1].lower() if '.' in caminho else ''
+    if extensao == 'pdf':
+        if not HAS_PDFIUM:
+            return None
+        imagem = _abrir_pdf(caminho, lado)
+    elif extensao in EXTENSOES_IMAGEM:
+        imagem = _abrir_imagem(caminho, lado)
+    else:
+        return None
+    if imagem is None:
+        return None
+
+    imagem.thumbnail((lado, lado))
+    if imagem.mode in ('RGBA', 'LA', 'P'):
+        # Transparência vira fundo branco (JPEG não tem canal alfa)
+        imagem = imagem.convert('RGBA')
+        fundo = Image.new('RGB', imagem.size, 'white')
+        fundo.paste(imagem, mask=imagem.getchannel('A'))
+        imagem = fundo
+    elif imagem.mode not in ('RGB', 'L'):
+        imagem = imagem.convert('RGB')
+
+    saida = BytesIO()
+    imagem.save(saida, 'JPEG', quality=MINIATURA_QUALIDADE, optimize=True)
+    return saida.getvalue()
+
+
+class CacheMiniaturas(CacheDisco):
+    EXTENSAO = '.jpg'
+
+    def __init__(self, pasta=PASTA_MINIATURAS, max_bytes=MINIATURAS_MAX_MB * 1024 * 1024,
+                 max_itens=MINIATURAS_MAX_ITENS, lado=MINIATURA_LADO, logger=None):
+        super().__init__(pasta, max_bytes, max_itens)
+        self.lado = lado
+        self.logger = logger
+        self._executor = None
+        self._lock_executor = threading.Lock()
+
+    def _chave(self, caminho_anexo, hash_conteudo):
+        if hash_conteudo:
+            base = hash_conteudo
+        else:
+            info = os.stat(caminho_anexo)
+            base = f"{os.path.basename(caminho_anexo)}|{info.st_size}|{int(info.st_mtime)}"
+        return hashlib.sha256(f"{VERSAO_MINIATURA}|{self.lado}|{base}".encode('utf-8')).hexdigest()
+
+    def obter(self, caminho_anexo, hash_conteudo=None):
+        """Caminho do JPEG da miniatura (gerado na hora se ainda não existir) ou None se não houver prévia."""
+        chave = self._chave(caminho_anexo, hash_conteudo)
+        caminho = self.caminho_existente(chave)
+        if caminho:
+            return caminho
+        conteudo = gerar(caminho_anexo, self.lado)
+        if conteudo is None:
+            return None
+        return self.gravar(chave, conteudo)
+
+    def agendar(self, caminho_anexo, hash_conteudo=None):
+        """Gera em segundo plano (após o upload), para a primeira visualização já encontrar pronta."""
+        with self._lock_executor:
+            if self._executor is None:
+                # Uma thread só: miniatura é prioridade baixa e não deve disputar CPU com as requisições
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='miniaturas')
+        self._executor.submit(self._gerar_em_fundo, caminho_anexo, hash_conteudo)
+
+    def _gerar_em_fundo(self, caminho_anexo, hash_conteudo):
+        try:
+            self.obter(caminho_anexo, hash_conteudo)
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Falha ao gerar miniatura de {caminho_anexo}: {e}")
@@ -0,0 +1,344 @@
+"""
+OCR de solicitações digitalizadas fora das threads do Waitress.
+
+O Tesseract é CPU puro e pode levar vários segundos por página; rodando dentro
+da requisição ele prende uma thread e esbarra no channel_timeout=30. Aqui o
+trabalho vai para um pool de PROCESSOS (usa todos os núcleos, sem disputar o
+GIL com o servidor web) e a tela acompanha o andamento por um id de tarefa.
+
+Este módulo não importa o app.py: os processos do pool só carregam o necessário
+para o OCR. No Windows (spawn) cada processo também reimporta o script de entrada;
+por isso o Run.py só importa o app dentro do `if __name__ == "__main__"`.
+(Com `python app.py`, modo de desenvolvimento, os processos carregam o app inteiro.)
+"""
+import os
+import time
+import shutil
+import uuid
+import threading
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+import metricas
+import parser_solicitacao
+
+# --- CONFIGURAÇÃO DO OCR (TESSERACT PORTÁTIL) ---
+HAS_OCR = False
+try:
+    import pytesseract
+
+    # Define o caminho RELATIVO para a pasta que você já colocou no servidor
+    caminho_base = os.getcwd()
+    caminho_tesseract = os.path.join(caminho_base, 'Tesseract-OCR', 'tesseract.exe')
+
+    # Verifica se o arquivo existe
+    if os.path.exists(caminho_tesseract):
+        pytesseract.pytesseract.tesseract_cmd = caminho_tesseract
+        HAS_OCR = True
+        print(f"✅ Tesseract Portátil encontrado em: {caminho_tesseract}")
+    else:
+        print(f"⚠️ AVISO: Tesseract não encontrado em: {caminho_tesseract}")
+
+except ImportError:
+    print("⚠️ Biblioteca 'pytesseract' não encontrada.")
+except Exception as e:
+    print(f"⚠️ Erro ao configurar Tesseract: {e}")
+
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+OCR_TAREFA_VALIDADE = int(os.getenv('OCR_TAREFA_VALIDADE', 3600))   # Segundos que um resultado fica disponível
+OCR_MAX_PAGINAS = int(os.getenv('OCR_MAX_PAGINAS', 30))
+
+# --- PRÉ-PROCESSAMENTO DAS IMAGENS ANTES DO TESSERACT ---
+# Digitalizações coloridas em 600 dpi deixam o Tesseract lento e pesado; 300 dpi em preto e
+# branco é a resolução que ele lê melhor. OCR_RECORTE: "esquerda,topo,direita,base" em fração
+# da página (ex.: "0,0.05,1,0.9" tira cabeçalho/rodapé do scanner); vazio = página inteira.
+CONFIG_PREPROCESSAMENTO = {
+    'ativo': os.getenv('OCR_PREPROCESSAR', '1') == '1',
+    'dpi_alvo': int(os.getenv('OCR_DPI_ALVO', 300)),
+    'lado_maximo': int(os.getenv('OCR_LADO_MAXIMO', 3600)),     # px; usado quando o DPI não é conhecido
+    'limiar_janela': int(os.getenv('OCR_LIMIAR_JANELA', 15)),   # raio (px) da média local do limiar adaptativo
+    'limiar_offset': int(os.getenv('OCR_LIMIAR_OFFSET', 12)),   # quanto mais escuro que a vizinhança vira "tinta"
+    'recorte': os.getenv('OCR_RECORTE', ''),
+    'aparar_margens': os.getenv('OCR_APARAR_MARGENS', '1') == '1',
+}
+
+
+def assinatura_preprocessamento(config=None):
+    """Identifica a configuração: entra na versão do cache de importação."""
+    config = config or CONFIG_PREPROCESSAMENTO
+    return ';'.join(f"{chave}={config[chave]}" for chave in sorted(config))
+
+STATUS_NA_FILA = 'na_fila'
+STATUS_PROCESSANDO = 'processando'
+STATUS_PRONTO = 'pronto'
+STATUS_ERRO = 'erro'
+
+ORIGEM_TEXTO_DIGITAL = "Texto Digital (Rápido)"
+ORIGEM_OCR = "Tesseract Portátil (Imagem)"
+
+
+def imagens_por_pagina(file_bytes, max_paginas=OCR_MAX_PAGINAS):
+    """
+    (páginas, ignoradas): imagens de cada página, na ordem, como {'largura_pol': largura
+    da página em polegadas, 'imagens': [bytes]}, e quantas páginas passaram de max_paginas
+    e não foram lidas. Roda no processo web (pypdf só copia os dados).
+    """
+    leitor_pdf = PdfReader(BytesIO(file_bytes))
+    paginas = []
+    for pagina in leitor_pdf.pages[:max_paginas]:
+        paginas.append({
+            'largura_pol': float(pagina.mediabox.width) / 72,
+            'imagens': [imagem_obj.data for imagem_obj in pagina.images],
+        })
+    return paginas, max(0, len(leitor_pdf.pages) - max_paginas)
+
+
+def _dpi_estimado(imagem, largura_pol):
+    # Digitalização ocupa a página inteira: pixels / polegadas da página. Senão, o que o arquivo informar.
+    if largura_pol:
+        return imagem.width / largura_pol
+    dpi = imagem.info.get('dpi')
+    return float(dpi[0]) if dpi else None
+
+
+def preprocessar_imagem(imagem, largura_pol=None, config=None):
+    """Normaliza o DPI, converte para cinza, binariza com limiar adaptativo e recorta."""
+    config = config or CONFIG_PREPROCESSAMENTO
+
+    # 1. Tons de cinza primeiro: redimensionar 1 canal custa um terço de RGB
+    imagem = ImageOps.exif_transpose(imagem).convert('L')
+
+    # 2. DPI alvo (só reduz: ampliar não cria detalhe e deixa o Tesseract mais lento)
+    dpi = _dpi_estimado(imagem, largura_pol)
+    if dpi:
+        escala = config['dpi_alvo'] / dpi
+    else:
+        escala = config['lado_maximo'] / max(imagem.size)
+    if escala < 0.95:
+        imagem = imagem.resize((max(1, round(imagem.width * escala)), max(1, round(imagem.height * escala))),
+                               Image.LANCZOS)
+
+    # 3. Recorte fixo da região útil
+    if config['recorte']:
+        esquerda, topo, direita, base = (float(v) for v in config['recorte'].split(','))
+        imagem = imagem.crop((round(esquerda * imagem.width), round(topo * imagem.height),
+                              round(direita * imagem.width), round(base * imagem.height)))
+
+    # 4. Limiar adaptativo: tinta é o que está mais escuro que a média da vizinhança.
+    #    Aguenta sombra de dobra e fundo amarelado, onde um limiar global apaga o texto.
+    media_local = imagem.filter(ImageFilter.BoxBlur(config['limiar_janela']))
+    diferenca = ImageChops.subtract(media_local, imagem)
+    offset = config['limiar_offset']
+    imagem = diferenca.point(lambda v: 0 if v > offset else 255, mode='1').convert('L')
+
+    # 5. Margens brancas fora: menos pixels para o Tesseract segmentar
+    if config['aparar_margens']:
+        caixa = ImageOps.invert(imagem).getbbox()
+        if caixa:
+            margem = 10
+            imagem = imagem.crop((max(0, caixa[0] - margem), max(0, caixa[1] - margem),
+                                  min(imagem.width, caixa[2] + margem), min(imagem.height, caixa[3] + margem)))
+    return imagem
+
+
+def ocr_imagem(imagem, largura_pol=None, config=None):
+    config = config or CONFIG_PREPROCESSAMENTO
+    if not config['ativo']:
+        return pytesseract.image_to_string(imagem, lang='por')
+    imagem = preprocessar_imagem(imagem, largura_pol, config)
+    # Informa o DPI final: sem isso o Tesseract tenta adivinhar a escala da fonte
+    return pytesseract.image_to_string(imagem, lang='por', config=f"--dpi {config['dpi_alvo']}")
+
+
+def extrair_solicitacao(caminho):
+    """
+    Roda no processo do pool (importação em lote): lê o PDF gravado em `caminho` e extrai o
+    texto digital ou, se não houver, faz OCR de todas as páginas. Nunca levanta exceção:
+    falha de um arquivo não derruba o lote.
+    """
+    try:
+        with open(caminho, 'rb') as arquivo:
+            file_bytes = arquivo.read()
+        texto, layout = parser_solicitacao.ler_texto_pdf(file_bytes)
+        if len(texto.strip()) >= 10:
+            return {'texto': texto, 'layout': layout, 'origem': ORIGEM_TEXTO_DIGITAL, 'erro': None}
+        if not HAS_OCR:
+            return {'texto': '', 'layout': '', 'origem': None, 'erro': 'PDF sem texto e OCR indisponível.'}
+        paginas, ignoradas = imagens_por_pagina(file_bytes)
+        texto = "".join(ocr_pagina(pagina) for pagina in paginas if pagina['imagens'])
+        return {'texto': texto, 'layout': texto, 'origem': ORIGEM_OCR, 'erro': None, 'paginas_ignoradas': ignoradas}
+    except Exception as e:
+        return {'texto': '', 'layout': '', 'origem': None, 'erro': f"PDF ilegível: {e}"}
+
+
+def ocr_pagina(pagina, config=None):
+    """Roda no processo do pool: lê as imagens de UMA página com o Tesseract."""
+    texto_pagina = ""
+    for dados in pagina['imagens']:
+        imagem_pil = Image.open(BytesIO(dados))
+        # Leitura com Tesseract
+        texto_pagina += ocr_imagem(imagem_pil, pagina['largura_pol'], config) + "\n"
+    return texto_pagina
+
+
+def _apagar_ao_terminar(futuros, pasta):
+    """Remove `pasta` quando o último futuro terminar (com resultado, erro ou cancelado)."""
+    restantes = [len(futuros)]
+    trava = threading.Lock()
+
+    def concluido(_futuro):
+        with trava:
+            restantes[0] -= 1
+            ultimo = restantes[0] == 0
+        if ultimo:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+    if not futuros:
+        shutil.rmtree(pasta, ignore_errors=True)
+    for futuro in futuros:
+        futuro.add_done_callback(concluido)
+
+
+class FilaOCR:
+    def __init__(self, workers=OCR_WORKERS, validade=OCR_TAREFA_VALIDADE, logger=None):
+        self.workers = workers
+        self.validade = validade
+        self.logger = logger
+        self._executor = None
+        self._lock = threading.Lock()
+        self._tarefas = {}
+        self._por_conteudo = {}   # hash do arquivo -> (futuros do OCR, páginas ignoradas): mesmo PDF não roda outra vez
+
+    def _pool(self):
+        # Criado só no primeiro OCR: quem nunca importa PDF digitalizado não paga os processos
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def enviar(self, file_bytes, dono=None, extras=None, hash_conteudo=None):
+        """
+        Enfileira o OCR do PDF e devolve o id da tarefa. Cada página vira um trabalho
+        separado no pool, então um PDF de 10 páginas usa todos os núcleos livres.
+        Com hash_conteudo, um arquivo idêntico ainda em leitura (ou já lido) reaproveita o OCR.
+        Páginas além de OCR_MAX_PAGINAS não são lidas; a quantidade sai em 'paginas_ignoradas'.
+        """
+        tarefa_id = uuid.uuid4().hex
+        with self._lock:
+            self._limpar_expiradas()
+            existente = self._reaproveitavel(hash_conteudo)
+            if existente:
+                self._registrar(tarefa_id, existente, dono, extras)
+                return tarefa_id
+
+        # Fora do lock: abrir o PDF e copiar as imagens demora e travaria as consultas de status
+        paginas, ignoradas = imagens_por_pagina(file_bytes)
+        paginas = [pagina for pagina in paginas if pagina['imagens']]
+
+        with self._lock:
+            # Outro envio do mesmo arquivo pode ter chegado antes enquanto as páginas eram extraídas
+            existente = self._reaproveitavel(hash_conteudo)
+            if existente is None:
+                # Cada futuro devolve (resultado, segundos no worker): o tempo vai para as métricas do app
+                futuros = [self._pool().submit(metricas.cronometrar, ocr_pagina, pagina) for pagina in paginas]
+                for numero, futuro in enumerate(futuros, start=1):
+                    futuro.add_done_callback(lambda f, n=numero: self._ao_concluir(tarefa_id, n, 'pagina', f))
+                existente = (futuros, ignoradas)
+                if hash_conteudo:
+                    self._por_conteudo[hash_conteudo] = existente
+            self._registrar(tarefa_id, existente, dono, extras)
+        return tarefa_id
+
+    def _registrar(self, tarefa_id, existente, dono, extras):
+        futuros, ignoradas = existente
+        self._tarefas[tarefa_id] = {
+            'futuros': futuros, 'dono': dono, 'extras': extras or {},
+            'criado_em': time.time(), 'paginas_ignoradas': ignoradas,
+        }
+
+    def _reaproveitavel(self, hash_conteudo):
+        """(futuros, ignoradas) de um OCR do mesmo arquivo em andamento ou concluído sem erro. Chamar com o lock."""
+        existente = self._por_conteudo.get(hash_conteudo) if hash_conteudo else None
+        if existente is None or any(f.cancelled() or (f.done() and f.exception()) for f in existente[0]):
+            return None
+        return existente
+
+    def enviar_lote(self, caminhos, dono=None, extras=None, pasta_temporaria=None):
+        """
+        Um trabalho por arquivo (extrair_solicitacao, que lê o PDF do disco no processo do pool);
+        os resultados saem na ordem de `caminhos`. `pasta_temporaria` é apagada quando todos os
+        trabalhos terminarem ou forem cancelados.
+        """
+        tarefa_id = uuid.uuid4().hex
+        with self._lock:
+            self._limpar_expiradas()
+            futuros = [self._pool().submit(metricas.cronometrar, extrair_solicitacao, caminho) for caminho in caminhos]
+            self._tarefas[tarefa_id] = {
+                'futuros': futuros, 'dono': dono, 'extras': extras or {},
+                'criado_em': time.time(),
+            }
+        for numero, futuro in enumerate(futuros, start=1):
+            futuro.add_done_callback(lambda f, n=numero: self._ao_concluir(tarefa_id, n, 'arquivo_lote', f))
+        if pasta_temporaria:
+            _apagar_ao_terminar(futuros, pasta_temporaria)
+        return tarefa_id
+
+    def _ao_concluir(self, tarefa_id, numero, etapa, futuro):
+        if futuro.cancelled():
+            return
+        if futuro.exception():
+            if self.logger:
+                self.logger.error(f"Erro no Tesseract (tarefa {tarefa_id}, parte {numero}): {futuro.exception()}")
+            return
+        metricas.metricas.observar('ocr', etapa, futuro.result()[1])
+
+    def consultar(self, tarefa_id, dono=None):
+        """
+        Devolve {'status', 'resultados', 'texto', 'erro', 'extras', 'partes', 'partes_prontas',
+        'paginas_ignoradas'} ou None
+        se a tarefa não existir / for de outro usuário. 'resultados' segue a ordem do envio.
+        """
+        with self._lock:
+            tarefa = self._tarefas.get(tarefa_id)
+        if not tarefa or (dono is not None and tarefa['dono'] != dono):
+            return None
+
+        futuros = tarefa['futuros']
+        concluidos = sum(1 for f in futuros if f.done())
+        resposta = {'status': STATUS_NA_FILA, 'resultados': None, 'texto': None, 'erro': None,
+                    'extras': tarefa['extras'], 'partes': len(futuros), 'partes_prontas': concluidos,
+                    'paginas_ignoradas': tarefa.get('paginas_ignoradas', 0)}
+        if concluidos == len(futuros):
+            erros = [f.exception() for f in futuros if f.exception()]
+            if erros:
+                resposta.update(status=STATUS_ERRO, erro=str(erros[0]))
+            else:
+                # Na ordem do envio, independente de qual processo terminou primeiro
+                resultados = [f.result()[0] for f in futuros]
+                resposta.update(status=STATUS_PRONTO, resultados=resultados,
+                                texto="".join(r for r in resultados if isinstance(r, str)))
+        elif concluidos or any(f.running() for f in futuros):
+            resposta['status'] = STATUS_PROCESSANDO
+        return resposta
+
+    def descartar(self, tarefa_id):
+        with self._lock:
+            tarefa = self._tarefas.pop(tarefa_id, None)
+            if not tarefa:
+                return
+            compartilhada = any(t['futuros'] is tarefa['futuros'] for t in self._tarefas.values())
+        if not compartilhada:
+            for futuro in tarefa['futuros']:
+                futuro.cancel()
+
+    def _limpar_expiradas(self):
+        limite = time.time() - self.validade
+        for tarefa_id in [t for t, d in self._tarefas.items()
+                          if d['criado_em'] < limite and all(f.done() for f in d['futuros'])]:
+            del self._tarefas[tarefa_id]
+        # O texto pronto fica no cache em disco; aqui só seguram os futuros em uso por alguma tarefa
+        em_uso = {id(d['futuros']) for d in self._tarefas.values()}
+        for hash_conteudo in [h for h, (f, _) in self._por_conteudo.items() if id(f) not in em_uso]:
+            del self._por_conteudo[hash_conteudo]
@@ -0,0 +1,189 @@
+"""
+Leitura das Solicitações de Compra exportadas pelo ERP (PDF ou texto do OCR).
+
+interpretar(texto, texto_layout) devolve um ResultadoSolicitacao com o cabeçalho
+(número, data, empresa, requerente), as observações e os itens. As expressões
+regulares são compiladas uma vez na importação do módulo e o texto é percorrido
+em uma única passada por linha.
+
+Fixtures e medição de velocidade/acerto ficam em benchmarks/:
+    python benchmarks/benchmark_parser.py
+"""
+import re
+from io import BytesIO
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import pdfplumber
+
+# ADICIONADO: "MT" e "MT GERAL" na lista de unidades conhecidas
+UNIDADES_CONHECIDAS = frozenset(['UN', 'PC', 'CX', 'KG', 'M', 'L', 'LITRO', 'METRO', 'PAR', 'UN GERAL', 'MT', 'MT GERAL'])
+
+RE_SOLICITACAO = re.compile(r'Solicitação de Compra:\s*(\d+)')
+RE_DATA = re.compile(r'Data:\s*(\d{2}/\d{2}/\d{4})')
+RE_EMPRESA = re.compile(r'Empresa:\s*(\d+)')
+# Itens (Padrão: 00.00.0000 Descrição...)
+RE_ITEM = re.compile(r'^(\d{2}\.\d{2}\.\d{4})\s+(.+)')
+RE_LINHA_ITEM = re.compile(r'^\d{2}\.\d{2}\.\d{4}\s', re.MULTILINE)
+# CORREÇÃO CRUCIAL: Aceita ponto no meio (1.500,00)
+RE_QUANTIDADE = re.compile(r'[\d.]+,\d+')
+RE_SALDO = re.compile(r'\d+,\d+')
+RE_COLUNAS = re.compile(r'\s{2,}')
+
+MARCADOR_OBSERVACAO = "Observação:"
+MARCADOR_REQUERENTE = "Requerente"
+
+
+@dataclass
+class ItemSolicitacao:
+    codigo: str
+    descricao: str
+    quantidade: str = "1"
+    unidade: str = "UN"
+
+    @property
+    def nome(self):
+        return f"{self.codigo} - {self.descricao}"
+
+    def para_formulario(self):
+        return {'nome_item': self.nome, 'quantidade': self.quantidade, 'unidade_medida': self.unidade}
+
+
+@dataclass
+class ResultadoSolicitacao:
+    solicitacao: str = None
+    data_registro: str = None       # AAAA-MM-DD
+    empresa: str = None
+    solicitante_real: str = None
+    observacoes: list = field(default_factory=list)
+    itens: list = field(default_factory=list)
+
+    def dados_formulario(self):
+        """Campos no formato que o nova_compra.html espera em dados_form."""
+        dados = {}
+        for campo in ('solicitacao', 'data_registro', 'empresa', 'solicitante_real'):
+            valor = getattr(self, campo)
+            if valor:
+                dados[campo] = valor
+        if self.observacoes:
+            dados['observacao'] = "\n".join(self.observacoes)
+        return dados
+
+    def itens_formulario(self):
+        return [item.para_formulario() for item in self.itens]
+
+
+def _normalizar_unidade(token_upper):
+    if "UN" in token_upper: return "UN"
+    if token_upper == "PC": return "PCT"
+    if "MT" in token_upper: return "M"  # Converte MT para M
+    return token_upper
+
+
+def interpretar_item(codigo, resto):
+    """Separa descrição, unidade e quantidade do restante da linha do item."""
+    quantidade = "1"
+    unidade = "UN"
+    descricao = []
+    encontrou_unidade = False
+
+    for token in resto.split():
+        if RE_QUANTIDADE.fullmatch(token):
+            # Limpa o ponto de milhar antes de salvar
+            quantidade = token.split(',')[0].replace('.', '')
+            break
+
+        token_upper = token.upper()
+        if token_upper in UNIDADES_CONHECIDAS:
+            encontrou_unidade = True
+            unidade = _normalizar_unidade(token_upper)
+            continue
+
+        if encontrou_unidade: continue
+
+        # Se não for saldo numérico (com vírgula), é parte do nome
+        if not RE_SALDO.match(token):
+            descricao.append(token)
+
+    return ItemSolicitacao(codigo, ' '.join(descricao), quantidade, unidade)
+
+
+def _requerente(texto_layout):
+    # Via layout - só funciona bem no modo digital: o nome vem em uma das 3 linhas abaixo do rótulo
+    inicio = texto_layout.find(MARCADOR_REQUERENTE)
+    if inicio < 0:
+        return None
+    linhas = texto_layout[inicio:].split('\n', 4)[1:4]
+    for linha in linhas:
+        linha = linha.strip()
+        if RE_ITEM.match(linha):
+            # Texto do OCR não tem o nome abaixo do rótulo: a tabela de itens começou
+            return None
+        if linha:
+            return RE_COLUNAS.split(linha, 1)[0]
+    return None
+
+
+def interpretar(texto, texto_layout=""):
+    resultado = ResultadoSolicitacao()
+
+    # A) Metadados: primeira ocorrência no documento
+    if m := RE_SOLICITACAO.search(texto):
+        resultado.solicitacao = m.group(1)
+    if m := RE_DATA.search(texto):
+        try:
+            resultado.data_registro = datetime.strptime(m.group(1), '%d/%m/%Y').strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    if m := RE_EMPRESA.search(texto):
+        resultado.empresa = m.group(1)
+
+    # B) Requerente
+    resultado.solicitante_real = _requerente(texto_layout)
+
+    # C) Observações e itens em uma passada
+    for linha in texto.split('\n'):
+        if MARCADOR_OBSERVACAO in linha:
+            obs_texto = linha.split(MARCADOR_OBSERVACAO, 1)[1].strip().replace('"', '').replace("'", "")
+            if obs_texto:
+                resultado.observacoes.append(obs_texto)
+
+        if linha[:1].isdigit() and (m := RE_ITEM.match(linha)):
+            resultado.itens.append(interpretar_item(m.group(1), m.group(2)))
+
+    return resultado
+
+
+# --- LEITURA DO PDF DIGITAL ---
+
+def tem_itens(texto):
+    return bool(RE_LINHA_ITEM.search(texto))
+
+
+def paginas_texto_pdf(file_bytes):
+    """Gera (texto, texto com layout) página a página; só extrai a próxima quando pedida."""
+    with pdfplumber.open(BytesIO(file_bytes)) as pdf:
+        for page in pdf.pages:
+            yield page.extract_text() or "", page.extract_text(layout=True) or ""
+            # Libera os objetos já extraídos da página (PDFs longos não acumulam memória)
+            page.flush_cache()
+
+
+def ler_texto_pdf(file_bytes):
+    """
+    Junta o texto das páginas até o fim da tabela de itens: depois que algum item
+    apareceu, a primeira página sem itens encerra a leitura (rodapés, anexos e
+    páginas de assinatura não são extraídos).
+    """
+    textos = []
+    layouts = []
+    achou_itens = False
+    for texto_pagina, layout_pagina in paginas_texto_pdf(file_bytes):
+        # A página que encerra a tabela entra no texto: observações costumam vir logo após os itens
+        textos.append(texto_pagina)
+        layouts.append(layout_pagina)
+        pagina_tem_itens = tem_itens(texto_pagina)
+        if achou_itens and not pagina_tem_itens:
+            break
+        achou_itens = achou_itens or pagina_tem_itens
+    return "\n".join(textos), "\n".join(layouts)
@@ -0,0 +1,166 @@
+"""
+Fila de geração do relatório de performance em PDF.
+
+O xhtml2pdf é lento em períodos longos; em vez de prender uma das threads do
+Waitress, a rota só enfileira o pedido e devolve um id de tarefa. Uma thread de
+fundo gera o arquivo e a tela consulta o andamento até o link de download ficar
+pronto.
+
+- Tarefas ficam gravadas em relatorios_gerados/tarefas/<id>.json (sobrevivem a
+  reinícios: uma tarefa interrompida é reenfileirada quando consultada).
+- O PDF é guardado por chave (inicio, fim, versão dos dados, dia): pedir de novo
+  o mesmo período sem alterações devolve o arquivo pronto na hora.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PASTA_RELATORIOS = os.getenv('RELATORIOS_PASTA', 'relatorios_gerados')
+RELATORIOS_WORKERS = int(os.getenv('RELATORIOS_WORKERS', 1))
+RELATORIOS_VALIDADE_DIAS = int(os.getenv('RELATORIOS_VALIDADE_DIAS', 7))
+
+STATUS_NA_FILA = 'na_fila'
+STATUS_PROCESSANDO = 'processando'
+STATUS_PRONTO = 'pronto'
+STATUS_ERRO = 'erro'
+
+
+class FilaRelatorios:
+    def __init__(self, gerador, pasta=PASTA_RELATORIOS, workers=RELATORIOS_WORKERS, logger=None):
+        """`gerador(inicio, fim)` devolve os bytes do PDF; roda na thread de fundo."""
+        self.gerador = gerador
+        self.pasta = pasta
+        self.pasta_tarefas = os.path.join(pasta, 'tarefas')
+        self.logger = logger
+        os.makedirs(self.pasta_tarefas, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='relatorio_pdf')
+        self._lock = threading.Lock()
+        self._ativas = {}   # chave -> id da tarefa em andamento neste processo
+
+    # --- CHAVES E CAMINHOS ---
+
+    @staticmethod
+    def chave(inicio, fim, versao_dados):
+        bruto = f"{inicio}|{fim}|{versao_dados}"
+        return hashlib.sha256(bruto.encode('utf-8')).hexdigest()[:32]
+
+    def caminho_pdf(self, chave):
+        return os.path.join(self.pasta, f"{chave}.pdf")
+
+    def _caminho_tarefa(self, tarefa_id):
+        return os.path.join(self.pasta_tarefas, f"{tarefa_id}.json")
+
+    def pdf_pronto(self, chave):
+        caminho = self.caminho_pdf(chave)
+        return caminho if os.path.exists(caminho) else None
+
+    # --- TAREFAS ---
+
+    def _salvar_tarefa(self, tarefa):
+        tarefa['atualizado_em'] = time.time()
+        temporario = self._caminho_tarefa(tarefa['id']) + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(tarefa, f, ensure_ascii=False)
+        os.replace(temporario, self._caminho_tarefa(tarefa['id']))
+
+    def ler_tarefa(self, tarefa_id):
+        # O id vem da URL: só aceita o formato gerado por uuid4().hex
+        if not tarefa_id or not all(c in '0123456789abcdef' for c in tarefa_id) or len(tarefa_id) != 32:
+            return None
+        try:
+            with open(self._caminho_tarefa(tarefa_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def solicitar(self, inicio, fim, versao_dados, nome_download):
+        """Devolve a tarefa para o período, reaproveitando a que já estiver na fila ou pronta."""
+        chave = self.chave(inicio, fim, versao_dados)
+        with self._lock:
+            tarefa_ativa = self._ativas.get(chave)
+            if tarefa_ativa:
+                tarefa = self.ler_tarefa(tarefa_ativa)
+                if tarefa:
+                    return tarefa
+
+            tarefa = {
+                'id': uuid.uuid4().hex,
+                'chave': chave,
+                'inicio': inicio,
+                'fim': fim,
+                'nome_download': nome_download,
+                'status': STATUS_PRONTO if self.pdf_pronto(chave) else STATUS_NA_FILA,
+                'erro': None,
+                'criado_em': time.time(),
+            }
+            self._salvar_tarefa(tarefa)
+            if tarefa['status'] == STATUS_NA_FILA:
+                self._enfileirar(tarefa)
+
+        self.limpar_antigos()
+        return tarefa
+
+    def consultar(self, tarefa_id):
+        """Lê a tarefa; se ela ficou pendente por causa de um reinício, volta para a fila."""
+        tarefa = self.ler_tarefa(tarefa_id)
+        if not tarefa:
+            return None
+        if tarefa['status'] in (STATUS_NA_FILA, STATUS_PROCESSANDO):
+            with self._lock:
+                if self._ativas.get(tarefa['chave']) is None:
+                    if self.pdf_pronto(tarefa['chave']):
+                        tarefa['status'] = STATUS_PRONTO
+                        self._salvar_tarefa(tarefa)
+                    else:
+                        tarefa['status'] = STATUS_NA_FILA
+                        self._salvar_tarefa(tarefa)
+                        self._enfileirar(tarefa)
+        return tarefa
+
+    def _enfileirar(self, tarefa):
+        # Chamado com self._lock adquirido
+        self._ativas[tarefa['chave']] = tarefa['id']
+        self._executor.submit(self._executar, dict(tarefa))
+
+    def _executar(self, tarefa):
+        tarefa['status'] = STATUS_PROCESSANDO
+        self._salvar_tarefa(tarefa)
+        try:
+            if not self.pdf_pronto(tarefa['chave']):
+                conteudo = self.gerador(tarefa['inicio'], tarefa['fim'])
+                destino = self.caminho_pdf(tarefa['chave'])
+                with open(destino + '.tmp', 'wb') as f:
+                    f.write(conteudo)
+                os.replace(destino + '.tmp', destino)
+            tarefa['status'] = STATUS_PRONTO
+        except Exception as e:
+            tarefa['status'] = STATUS_ERRO
+            tarefa['erro'] = str(e)
+            if self.logger:
+                self.logger.error(f"Erro ao gerar relatório PDF ({tarefa['inicio']} a {tarefa['fim']}): {e}", exc_info=True)
+        finally:
+            self._salvar_tarefa(tarefa)
+            with self._lock:
+                if self._ativas.get(tarefa['chave']) == tarefa['id']:
+                    del self._ativas[tarefa['chave']]
+
+    def limpar_antigos(self):
+        """Remove PDFs e tarefas com mais de RELATORIOS_VALIDADE_DIAS."""
+        limite = time.time() - RELATORIOS_VALIDADE_DIAS * 86400
+        for pasta in (self.pasta, self.pasta_tarefas):
+            try:
+                nomes = os.listdir(pasta)
+            except OSError:
+                continue
+            for nome in nomes:
+                caminho = os.path.join(pasta, nome)
+                try:
+                    if os.path.isfile(caminho) and os.path.getmtime(caminho) < limite:
+                        os.remove(caminho)
+                except OSError:
+                    pass
@@ -0,0 +1,37 @@
+"""
+Situação (status) dos pedidos.
+
+O texto de status_compra é o que aparece nas telas, mas o banco mantém a partir dele
+duas colunas geradas e indexadas (migracoes/0007_situacao_pedido.sql):
+codigo_status (TINYINT) e em_aberto (1 até o pedido ser entregue).
+As consultas filtram por elas; as funções abaixo aplicam a mesma regra no Python
+(ex: contadores, que guardam só o texto).
+"""
+
+CODIGO_OUTRO = 0    # Texto fora da lista (ex: status livre vindo de planilha)
+AGUARDANDO_APROVACAO = 1
+ORCAMENTO = 2
+CONFIRMADO = 3
+EM_TRANSITO = 4
+ENTREGUE_PARCIALMENTE = 5
+ENTREGUE_TOTALMENTE = 6
+
+# Mesma ordem/valores da CASE da migração 0007
+CODIGOS = {
+    'Aguardando Aprovação': AGUARDANDO_APROVACAO,
+    'Orçamento': ORCAMENTO,
+    'Confirmado': CONFIRMADO,
+    'Em Trânsito': EM_TRANSITO,
+    'Entregue Parcialmente': ENTREGUE_PARCIALMENTE,
+    'Entregue Totalmente': ENTREGUE_TOTALMENTE,
+}
+LISTA_STATUS = list(CODIGOS)
+
+
+def codigo(status):
+    return CODIGOS.get(status or '', CODIGO_OUTRO)
+
+
+def em_aberto(status):
+    # O LIKE do MariaDB não diferencia maiúsculas: 'ENTREGUE' de planilha também fecha o pedido
+    return 'entregue' not in (status or '').lower()
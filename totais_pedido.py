@@ -0,0 +1,86 @@
+"""
+Total do pedido (valor_total) e quantidade de itens (qtd_itens) guardados em
+acompanhamento_compras, para que relatórios e dashboard leiam uma coluna em vez
+de somar pedidos_itens a cada linha.
+
+recalcular() deve ser chamado na mesma transação sempre que itens forem
+inseridos, alterados ou removidos.
+
+Uso pela linha de comando:
+    python totais_pedido.py --verificar     (lista pedidos com total divergente)
+    python totais_pedido.py --reparar       (corrige os divergentes)
+"""
+import sys
+
+SQL_TOTAIS_ITENS = '''
+    SELECT COALESCE(SUM(i.quantidade * i.valor_unitario), 0) AS valor_total, COUNT(i.id) AS qtd_itens
+    FROM pedidos_itens i WHERE i.pedido_id = %s
+'''
+
+
+def recalcular(cursor, pedido_id):
+    cursor.execute(SQL_TOTAIS_ITENS, (pedido_id,))
+    totais = cursor.fetchone()
+    cursor.execute('UPDATE acompanhamento_compras SET valor_total = %s, qtd_itens = %s WHERE id = %s',
+                   (totais['valor_total'], totais['qtd_itens'], pedido_id))
+    return totais
+
+
+def listar_divergentes(cursor):
+    cursor.execute('''
+        SELECT c.id, c.valor_total, c.qtd_itens,
+               COALESCE(t.valor_real, 0) AS valor_real, COALESCE(t.itens_reais, 0) AS itens_reais
+        FROM acompanhamento_compras c
+        LEFT JOIN (
+            SELECT pedido_id, ROUND(SUM(quantidade * valor_unitario), 2) AS valor_real, COUNT(*) AS itens_reais
+            FROM pedidos_itens GROUP BY pedido_id
+        ) t ON t.pedido_id = c.id
+        WHERE c.qtd_itens <> COALESCE(t.itens_reais, 0)
+           OR ABS(c.valor_total - COALESCE(t.valor_real, 0)) >= 0.01
+        ORDER BY c.id
+    ''')
+    return cursor.fetchall()
+
+
+def reparar(conn):
+    """Corrige todos os pedidos divergentes em uma transação. Devolve quantos foram corrigidos."""
+    cursor = conn.cursor()
+    try:
+        divergentes = listar_divergentes(cursor)
+        if not divergentes:
+            return 0
+        conn.begin()
+        try:
+            cursor.executemany('UPDATE acompanhamento_compras SET valor_total = %s, qtd_itens = %s WHERE id = %s',
+                               [(d['valor_real'], d['itens_reais'], d['id']) for d in divergentes])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(divergentes)
+    finally:
+        cursor.close()
+
+
+if __name__ == '__main__':
+    if '--verificar' not in sys.argv and '--reparar' not in sys.argv:
+        print("Uso: python totais_pedido.py --verificar | --reparar")
+        sys.exit(1)
+
+    import banco_dados
+    conn = banco_dados.obter_conexao()
+    try:
+        if '--reparar' in sys.argv:
+            corrigidos = reparar(conn)
+            print(f"✅ {corrigidos} pedido(s) corrigido(s).")
+        else:
+            cursor = conn.cursor()
+            divergentes = listar_divergentes(cursor)
+            cursor.close()
+            for d in divergentes:
+                print(f"❌ Pedido {d['id']}: gravado R$ {d['valor_total']} / {d['qtd_itens']} itens"
+                      f" | real R$ {d['valor_real']} / {d['itens_reais']} itens")
+            print(f"{len(divergentes)} pedido(s) divergente(s).")
+            sys.exit(1 if divergentes else 0)
+    finally:
+        conn.close()